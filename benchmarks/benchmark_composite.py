@@ -0,0 +1,38 @@
+"""Benchmarks of the compositing of channel stacks into RGB, with the lookup
+table engine of the package and with one colorify call per frame."""
+
+import numpy as np
+from cmap import Colormap
+from microfilm import colorify
+from napari_microfilm.composite import composite_frames, composite_stack
+
+
+class CompositeSuite:
+    params = ([np.uint8, np.uint16, np.float32], [8, 32])
+    param_names = ['dtype', 'num_frames']
+
+    def setup(self, dtype, num_frames):
+        rng = np.random.default_rng(0)
+        self.channels = [
+            (rng.random((num_frames, 512, 512)) * 250).astype(dtype) for _ in range(3)]
+        self.names = ['magenta', 'green', 'cyan']
+        self.cmaps = [Colormap(name).to_matplotlib() for name in self.names]
+        self.limits = [[10, 200], [0, 250], [50, 150]]
+
+    def time_colorify(self, dtype, num_frames):
+        for frame in range(num_frames):
+            colorify.multichannel_to_rgb(
+                [x[frame] for x in self.channels], cmaps=self.cmaps,
+                rescale_type='limits', limits=self.limits, proj_type='sum')
+
+    def time_composite_frames(self, dtype, num_frames):
+        composite_frames(self.channels, self.cmaps, self.limits)
+
+    def time_composite_stack(self, dtype, num_frames):
+        composite_stack(self.channels, self.cmaps, self.limits)
+
+    def peakmem_colorify(self, dtype, num_frames):
+        self.time_colorify(dtype, num_frames)
+
+    def peakmem_composite_frames(self, dtype, num_frames):
+        composite_frames(self.channels, self.cmaps, self.limits)
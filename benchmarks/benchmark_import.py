@@ -0,0 +1,23 @@
+"""Benchmarks of the import time of the plugin, in a fresh interpreter. The
+widget is imported after napari, as it is when napari loads the plugin, so
+that only the share of the plugin and its deferred dependencies is timed."""
+
+
+class ImportSuite:
+    timeout = 120
+
+    def timeraw_import_package(self):
+        return "import napari_microfilm"
+
+    def timeraw_import_batch(self):
+        return "import napari_microfilm.batch", "import numpy"
+
+    def timeraw_import_widget(self):
+        return "import napari_microfilm.microfilm_widget", "import napari.qt"
+
+    def timeraw_first_panel(self):
+        # deferred cost paid by the widget when creating its first panel
+        return (
+            "import microfilm.microplot; microfilm.microplot.Micropanel(1, 1)",
+            "import napari.qt",
+        )
@@ -0,0 +1,37 @@
+"""Benchmarks of the list operations on panel elements, which should not
+depend on the size of the snapshots and stay flat per element as the panel
+grows."""
+
+import numpy as np
+from napari_microfilm.panel_item import PanelElement, PanelElementList, ViewerState
+from napari_microfilm.snapshot_store import SnapshotStore
+
+
+class PanelElementListSuite:
+    params = [4, 16, 64, 256]
+    param_names = ['num_elements']
+
+    def setup(self, num_elements):
+        self.store = SnapshotStore(budget=2**30)
+        state = ViewerState(camera={}, dims={}, layers={})
+        self.elements = PanelElementList()
+        for _ in range(num_elements):
+            snapshot = np.zeros((3, 512, 512), dtype=np.uint8)
+            self.elements.append(
+                PanelElement(state, self.store.put(snapshot), store=self.store))
+        self.last = self.elements[-1]
+
+    def time_index(self, num_elements):
+        self.elements.index(self.last)
+
+    def time_contains(self, num_elements):
+        self.last in self.elements
+
+    def time_remove_insert(self, num_elements):
+        self.elements.remove(self.last)
+        self.elements.append(self.last)
+
+    def time_digest(self, num_elements):
+        for element in self.elements:
+            element.__dict__.pop('digest', None)
+            element.digest
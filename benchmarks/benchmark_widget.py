@@ -0,0 +1,169 @@
+"""Benchmarks of the widget: capture, thumbnails, preview, panel rebuild,
+grid resize, composite layer and saving. They run headless with the
+offscreen Qt platform, or under Xvfb if QT_QPA_PLATFORM is set otherwise."""
+
+import os
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from unittest import mock  # noqa: E402
+
+import napari  # noqa: E402
+import numpy as np  # noqa: E402
+from napari_microfilm.microfilm_widget import MicrofilmWidget  # noqa: E402
+from napari_microfilm.panel_item import PanelElement  # noqa: E402
+from napari_microfilm.utils import make_thumbnail  # noqa: E402
+
+GRID_SIZES = ['1x1', '3x4', '6x8']
+
+
+def _shape(size):
+    return tuple(int(x) for x in size.split('x'))
+
+
+def _make_widget(shape=(3, 512, 512)):
+    viewer = napari.Viewer(show=False)
+    viewer.add_image(np.random.random(shape), channel_axis=0)
+    widget = MicrofilmWidget(viewer)
+    widget.flush_preview()
+    return viewer, widget
+
+
+def _set_grid(widget, grid):
+    rows, cols = _shape(grid)
+    widget.numrows.setValue(rows)
+    widget.numcolumns.setValue(cols)
+    widget.flush_preview()
+    widget.await_workers()
+
+
+class CaptureSuite:
+    def setup(self):
+        self.viewer, self.widget = _make_widget()
+
+    def teardown(self):
+        self.viewer.close()
+
+    def time_from_viewer(self):
+        PanelElement.from_viewer(self.viewer)
+
+    def peakmem_from_viewer(self):
+        PanelElement.from_viewer(self.viewer)
+
+
+class ThumbnailSuite:
+    params = ['600x800', '1200x1600', '2400x3200']
+    param_names = ['canvas_size']
+
+    def setup(self, canvas_size):
+        self.snapshot = np.random.randint(
+            0, 255, (3,) + _shape(canvas_size), dtype=np.uint8)
+
+    def time_make_thumbnail(self, canvas_size):
+        make_thumbnail(self.snapshot)
+
+    def peakmem_make_thumbnail(self, canvas_size):
+        make_thumbnail(self.snapshot)
+
+
+class PanelSuite:
+    params = GRID_SIZES
+    param_names = ['grid']
+    # benchmarks modify the panel, so each sample starts from setup
+    number = 1
+    repeat = 5
+    warmup_time = 0
+
+    def setup(self, grid):
+        self.viewer, self.widget = _make_widget()
+        _set_grid(self.widget, grid)
+
+    def teardown(self, grid):
+        self.viewer.close()
+
+    def time_update_preview(self, grid):
+        self.widget.update_preview()
+        self.widget.await_workers()
+
+    def peakmem_update_preview(self, grid):
+        self.widget.update_preview()
+        self.widget.await_workers()
+
+    def time_reinitialize(self, grid):
+        self.widget.reinitialize()
+
+    def peakmem_reinitialize(self, grid):
+        self.widget.reinitialize()
+
+
+class GridResizeSuite:
+    params = GRID_SIZES
+    param_names = ['grid']
+    number = 1
+    repeat = 5
+    warmup_time = 0
+
+    def setup(self, grid):
+        self.viewer, self.widget = _make_widget()
+
+    def teardown(self, grid):
+        self.viewer.close()
+
+    def time_change_number_rows_cols(self, grid):
+        _set_grid(self.widget, grid)
+
+    def peakmem_change_number_rows_cols(self, grid):
+        _set_grid(self.widget, grid)
+
+
+class CompositeLayerSuite:
+    params = ['512x512', '2048x2048', '10x512x512', '100x512x512']
+    param_names = ['shape']
+    number = 1
+    repeat = 3
+    warmup_time = 0
+
+    def setup(self, shape):
+        self.viewer, self.widget = _make_widget((3,) + _shape(shape))
+
+    def teardown(self, shape):
+        self.viewer.close()
+
+    def time_add_image_as_layer(self, shape):
+        self.widget.add_image_as_layer()
+
+    def peakmem_add_image_as_layer(self, shape):
+        self.widget.add_image_as_layer()
+
+
+class SaveSuite:
+    params = GRID_SIZES
+    param_names = ['grid']
+    number = 1
+    repeat = 3
+    warmup_time = 0
+
+    def setup(self, grid):
+        import tempfile
+
+        self.viewer, self.widget = _make_widget()
+        _set_grid(self.widget, grid)
+        self.tempdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tempdir.name, 'panel.png')
+        self.dialog = mock.patch(
+            'napari_microfilm.microfilm_widget.QFileDialog.getSaveFileName',
+            return_value=(path, '*.png'))
+        self.dialog.start()
+
+    def teardown(self, grid):
+        self.widget.panel_saver.shutdown()
+        self.dialog.stop()
+        self.tempdir.cleanup()
+        self.viewer.close()
+
+    def time_save_panel(self, grid):
+        # saving happens in a background process
+        self.widget.save_panel().result()
+
+    def peakmem_save_panel(self, grid):
+        self.widget.save_panel().result()
@@ -8,4 +8,10 @@ except ImportError:
 
 
 
-from .microfilm_widget import MicrofilmWidget
+def __getattr__(name):
+    # the widget needs Qt, which is not available to the headless batch API
+    if name == "MicrofilmWidget":
+        from .microfilm_widget import MicrofilmWidget
+
+        return MicrofilmWidget
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,56 @@
+import matplotlib
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+from napari_microfilm.batch import PanelSpec, render_batch, render_cells, render_figure
+from napari_microfilm.panel_item import ViewerState
+
+matplotlib.use('Agg')
+
+
+def test_spec_renders_without_viewer(tmp_path):
+    viewer = ViewerModel()
+    data = np.random.randint(0, 1000, (2, 3, 40, 60)).astype(np.uint16)
+    viewer.add_image(data, channel_axis=0, name=['dapi', 'gfp'])
+    cells = []
+    for i in range(2):
+        viewer.dims.set_point(0, i)
+        cells.append({'state': ViewerState.from_viewer(viewer).to_dict(),
+                      'region': [[0, 0], [40, 60]]})
+
+    PanelSpec(1, 2, cells, labels=['a', 'b'], cell_size=60).to_json(tmp_path / 'spec.json')
+    spec = PanelSpec.from_json(tmp_path / 'spec.json')
+    assert spec.layer_names() == ['dapi', 'gfp']
+
+    images = render_cells(spec, {'dapi': data[0], 'gfp': data[1]})
+    assert [image.shape for image in images] == [(3, 40, 60), (3, 40, 60)]
+    assert not np.array_equal(images[0], images[1])
+
+    path = render_figure(spec, {'dapi': data[0], 'gfp': data[1]}, tmp_path / 'panel.png')
+    assert path.exists()
+
+
+def test_non_image_layers_are_skipped(tmp_path):
+    viewer = ViewerModel()
+    data = np.random.randint(0, 1000, (2, 40, 60)).astype(np.uint16)
+    viewer.add_image(data, channel_axis=0, name=['dapi', 'gfp'])
+    viewer.add_points([[10, 10]], name='spots')
+    viewer.add_shapes([[[0, 0], [10, 10], [0, 10]]], shape_type='polygon', name='outline')
+    cells = [{'state': ViewerState.from_viewer(viewer).to_dict(), 'region': [[0, 0], [40, 60]]}]
+    spec = PanelSpec(1, 1, cells, channel_labels=True, cell_size=60)
+
+    assert spec.layer_names() == ['dapi', 'gfp']
+    path = render_figure(spec, {'dapi': data[0], 'gfp': data[1]}, tmp_path / 'panel.png')
+    assert path.exists()
+
+
+def test_batch_rejects_datasets_with_the_same_name(tmp_path):
+    spec = PanelSpec(1, 1, [{'state': {}, 'region': [[0, 0], [1, 1]]}])
+    for folder in ['a', 'b']:
+        (tmp_path / folder).mkdir()
+        np.save(tmp_path / folder / 'img.npy', np.zeros((2, 4, 4)))
+
+    with pytest.raises(ValueError, match='same figure'):
+        render_batch(spec, [tmp_path / 'a' / 'img.npy', tmp_path / 'b' / 'img.npy'],
+                     tmp_path / 'out', layer_names=['dapi', 'gfp'])
+    assert not (tmp_path / 'out').exists()
@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+from cmap import Colormap
+from microfilm import colorify
+from napari.layers import Image
+from napari_microfilm import composite
+from napari_microfilm.composite import (
+    camera_region, composite_frames, composite_lazy, composite_stack, layer_region,
+    make_lut, match_shapes, select_level)
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.int16, np.float32])
+def test_lut_composite_matches_colorify(dtype):
+    rng = np.random.default_rng(0)
+    channels = [(rng.random((2, 30, 40)) * 250).astype(dtype) for _ in range(2)]
+    cmaps = [Colormap(name).to_matplotlib() for name in ['magenta', 'green']]
+    limits = [[10, 200], [0, 250]]
+
+    rgb = composite_frames(channels, cmaps, limits)
+    assert rgb.shape == (2, 30, 40, 3) and rgb.dtype == np.uint8
+    for frame in range(2):
+        expected = colorify.multichannel_to_rgb(
+            [x[frame] for x in channels], cmaps=cmaps, rescale_type='limits',
+            limits=limits, proj_type='sum')[0][..., :3]
+        # colorify works in float, so values can differ by rounding
+        assert np.abs(rgb[frame] / 255 - expected).max() <= 2 / 255
+
+
+def test_integer_data_indexes_lut_directly():
+    cmap = Colormap('gray').to_matplotlib()
+    assert len(make_lut(cmap, [0, 1000], np.uint16)) == 2 ** 16
+    assert len(make_lut(cmap, [0, 1], np.float32)) == cmap.N
+
+
+class SlicedArray:
+    """Array recording the frames read from it."""
+
+    def __init__(self, data):
+        self.data, self.shape, self.dtype = data, data.shape, data.dtype
+        self.reads = []
+
+    def __getitem__(self, index):
+        self.reads.append((index.start, index.stop))
+        return self.data[index]
+
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_composite_stack_writes_chunks_into_output(n_workers, tmp_path):
+    rng = np.random.default_rng(0)
+    data = [(rng.random((10, 20, 30)) * 250).astype(np.uint8) for _ in range(2)]
+    channels = [SlicedArray(x) for x in data]
+    cmaps = [Colormap(name).to_matplotlib() for name in ['magenta', 'green']]
+    limits = [[10, 200], [0, 250]]
+    out = np.lib.format.open_memmap(
+        tmp_path / 'out.npy', mode='w+', dtype=np.uint8, shape=(10, 20, 30, 3))
+    done = []
+
+    result = composite_stack(
+        channels, cmaps, limits, chunk_size=4, out=out, n_workers=n_workers,
+        progress=done.append)
+
+    assert result is out
+    for channel in channels:
+        assert sorted(channel.reads) == [(0, 4), (4, 8), (8, 10)]
+    assert sorted(done) == [2, 4, 4] and sum(done) == 10
+    np.testing.assert_array_equal(out, composite_frames(data, cmaps, limits))
+
+
+def test_composite_stack_checks_output_shape():
+    channels = [np.zeros((2, 5, 5), dtype=np.uint8)]
+    with pytest.raises(ValueError):
+        composite_stack(
+            channels, [Colormap('gray').to_matplotlib()], [[0, 255]],
+            out=np.empty((2, 5, 5, 4), dtype=np.uint8))
+
+
+@pytest.mark.parametrize('shape', [(6, 20, 30), (4, 3, 20, 30)])
+def test_lazy_composite_matches_stack(shape, monkeypatch):
+    da = pytest.importorskip('dask.array')
+    rng = np.random.default_rng(0)
+    data = [(rng.random(shape) * 250).astype(np.uint16) for _ in range(2)]
+    cmaps = [Colormap(name).to_matplotlib() for name in ['magenta', 'green']]
+    limits = [[10, 200], [0, 250]]
+    channels = [da.from_array(x, chunks=(2,) + shape[1:-2] + (10, 15)) for x in data]
+
+    calls = []
+    frames = composite.composite_frames
+    monkeypatch.setattr(
+        composite, 'composite_frames', lambda *args: calls.append(1) or frames(*args))
+    lazy = composite_lazy(channels, cmaps, limits)
+    assert calls == []
+    assert lazy.shape == shape + (3,) and lazy.dtype == np.uint8
+
+    result = lazy.compute(scheduler='sync')
+    assert len(calls) == channels[0].npartitions
+    np.testing.assert_array_equal(result, composite_stack(data, cmaps, limits))
+
+
+@pytest.mark.parametrize('target_size, level', [(600, 0), (400, 1), (250, 2), (100, 2)])
+def test_select_level(target_size, level):
+    factors = [[1, 1, 1], [1, 2, 2], [1, 4, 4]]
+    # the region is 1000 pixels wide at level 0
+    assert select_level(factors, (500, 1000), target_size) == level
+
+
+def test_layer_region_of_pyramid():
+    base = np.arange(80 * 120).reshape(80, 120)
+    pyramid = [base, base[::2, ::2], base[::4, ::4]]
+    layer = Image(pyramid, multiscale=True, scale=(2, 2), translate=(10, 20))
+    # level 0 pixels [10, 30) x [20, 60)
+    region = [[30, 60], [70, 140]]
+
+    data, scale, translate = layer_region(layer, region)
+    np.testing.assert_array_equal(data, base[10:30, 20:60])
+    np.testing.assert_array_equal(scale, [2, 2])
+    np.testing.assert_array_equal(translate, [30, 60])
+
+    # 10 pixels along the longest side are enough with level 2
+    data, scale, translate = layer_region(layer, region, target_size=10)
+    np.testing.assert_array_equal(data, pyramid[2][2:8, 5:15])
+    np.testing.assert_array_equal(scale, [8, 8])
+    np.testing.assert_array_equal(translate, [26, 60])
+
+    data, _, _ = layer_region(layer, region, target_size=20)
+    np.testing.assert_array_equal(data, pyramid[1][5:15, 10:30])
+
+
+def test_camera_region():
+    camera = {'center': (0, 50, 60), 'zoom': 2}
+    np.testing.assert_array_equal(
+        camera_region(camera, (100, 200)), [[25, 10], [75, 110]])
+
+
+def test_match_shapes():
+    small = np.zeros((2, 4, 6))
+    large = np.arange(2 * 8 * 12).reshape(2, 8, 12)
+
+    (first, second), zoom = match_shapes([large, small])
+    np.testing.assert_array_equal(first, large[:, ::2, ::2])
+    assert second is small
+    np.testing.assert_array_equal(zoom, [2, 2])
@@ -0,0 +1,113 @@
+import matplotlib
+import numpy as np
+import pytest
+import tifffile
+from napari_microfilm.batch import PanelSpec
+from napari_microfilm.export import PanelRender, PNGStreamWriter, export_panel, save_render
+
+matplotlib.use('Agg')
+
+
+def _spec_and_images(rows=3, cols=2):
+    rng = np.random.default_rng(0)
+    images = [(rng.random((3, 30, 40)) * 255).astype(np.uint8) for _ in range(rows * cols)]
+    cells = [{'state': {'camera': {}, 'dims': {}, 'layers': {}}} for _ in images]
+    return PanelSpec(rows, cols, cells, labels=['a', 'b'], dpi=50), images
+
+
+def test_png_writer_streams_rows(tmp_path):
+    from PIL import Image
+
+    image = np.random.default_rng(0).integers(0, 255, (25, 7, 4), dtype=np.uint8)
+    with PNGStreamWriter(tmp_path / 'rows.png', 7, compress_level=9) as writer:
+        for start in range(0, 25, 10):
+            writer.write(image[start:start + 10])
+    np.testing.assert_array_equal(np.asarray(Image.open(tmp_path / 'rows.png')), image)
+
+
+def test_raster_exports_match(tmp_path):
+    from PIL import Image
+
+    spec, images = _spec_and_images()
+    export_panel(spec, images, tmp_path / 'panel.png')
+    export_panel(spec, images, tmp_path / 'panel.tif', tile=64)
+
+    png = np.asarray(Image.open(tmp_path / 'panel.png'))
+    with tifffile.TiffFile(tmp_path / 'panel.tif') as tif:
+        assert tif.is_bigtiff and tif.pages[0].is_tiled
+        tiff = tif.asarray()
+    np.testing.assert_array_equal(png, tiff)
+    # Micropanel sizes the figure 5 inches per cell along the longest side
+    assert png.shape[1] == 2 * 5 * 50
+    assert png.shape[0] >= 3 * int(5 * 50 * 30 / 40)
+
+
+@pytest.mark.parametrize('suffix', ['.pdf', '.svg'])
+def test_vector_export(tmp_path, suffix):
+    spec, images = _spec_and_images(1, 2)
+    path = export_panel(spec, images, tmp_path / f'panel{suffix}')
+    assert path.stat().st_size > 0
+
+    with pytest.raises(ValueError):
+        export_panel(spec, images, tmp_path / 'panel.bmp')
+
+
+@pytest.mark.parametrize('suffix', ['.png', '.tif', '.jpg', '.pdf'])
+def test_save_render_compression(tmp_path, suffix):
+    spec, images = _spec_and_images(1, 2)
+    render = PanelRender.from_images(spec, images)
+    assert not render.images[0].flags.writeable
+
+    fast = save_render(render, tmp_path / f'fast{suffix}', compress_level=0)
+    small = save_render(render, tmp_path / f'small{suffix}', compress_level=9)
+    assert small.stat().st_size < fast.stat().st_size
+
+
+def test_panel_saver_signals(qtbot, tmp_path):
+    from napari_microfilm.save_queue import PanelSaver
+
+    spec, images = _spec_and_images(1, 2)
+    saver = PanelSaver()
+    try:
+        with qtbot.waitSignal(saver.saved, timeout=60000) as blocker:
+            saver.save(PanelRender.from_images(spec, images), tmp_path / 'panel.png')
+        assert blocker.args == [str(tmp_path / 'panel.png')]
+
+        with qtbot.waitSignal(saver.failed, timeout=60000):
+            saver.save(PanelRender.from_images(spec, images), tmp_path / 'panel.xyz')
+    finally:
+        saver.shutdown()
+
+
+def test_panel_saver_shares_images(qtbot, tmp_path, monkeypatch):
+    from multiprocessing import shared_memory
+
+    from PIL import Image
+    from napari_microfilm import save_queue
+
+    names = []
+
+    def share_image(image, segments):
+        shared = _share_image(image, segments)
+        names.append(shared[0])
+        return shared
+
+    _share_image = save_queue._share_image
+    monkeypatch.setattr(save_queue, '_share_image', share_image)
+    spec, images = _spec_and_images(1, 2)
+    render = PanelRender.from_images(spec, images)
+    saver = save_queue.PanelSaver()
+    try:
+        saver.save(render, tmp_path / 'shared.png').result(timeout=60)
+        # the segments are freed once the panel is saved
+        qtbot.waitUntil(lambda: not saver.is_running())
+    finally:
+        saver.shutdown()
+
+    save_render(render, tmp_path / 'local.png')
+    np.testing.assert_array_equal(
+        np.asarray(Image.open(tmp_path / 'shared.png')), np.asarray(Image.open(tmp_path / 'local.png')))
+    assert len(names) == 2
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name)
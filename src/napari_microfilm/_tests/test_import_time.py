@@ -0,0 +1,51 @@
+import subprocess
+import sys
+
+import pytest
+
+# modules of the headless API, loaded e.g. by the batch workers
+HEADLESS_MODULES = [
+    "napari_microfilm", "napari_microfilm.batch", "napari_microfilm.export",
+    "napari_microfilm.session", "napari_microfilm.panel_item",
+]
+# dependencies only loaded on first use
+DEFERRED = ["napari", "matplotlib", "microfilm", "cmap", "scipy", "skimage", "qtpy"]
+# import time of the headless modules, numpy excluded
+BUDGET = 0.3
+
+
+def import_time(modules, preload=("numpy",)):
+    """Import modules in a new interpreter and return the cumulative import
+    time in seconds of each top level import reported by -X importtime, and
+    the names of all imported modules."""
+
+    code = "import sys\n" + "".join(f"import {x}\n" for x in preload)
+    code += "sys.stderr.write('START\\n')\n"
+    code += "".join(f"import {x}\n" for x in modules)
+    code += "print('\\n'.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True)
+
+    times = {}
+    stderr = result.stderr.split("START\n", 1)[1]
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # nested imports are indented below their parent
+        if not name.startswith("  ") and cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) * 1e-6
+    return times, set(result.stdout.split())
+
+
+@pytest.mark.parametrize("module", HEADLESS_MODULES)
+def test_heavy_dependencies_are_deferred(module):
+    _, loaded = import_time([module])
+    assert [x for x in DEFERRED if x in loaded] == []
+
+
+def test_import_time_budget():
+    times, _ = import_time(HEADLESS_MODULES)
+    total = sum(times.values())
+    assert total < BUDGET, f"import took {total:.3f} s: {times}"
@@ -0,0 +1,24 @@
+import numpy as np
+from napari.components import ViewerModel
+from napari_microfilm.napari_panel import NapariPanel
+
+
+def _screenshot(self, canvas_only=True):
+    return np.zeros((20, 30, 4), dtype=np.uint8)
+
+
+def test_sweeps_capture_one_cell_per_step(monkeypatch):
+    monkeypatch.setattr(ViewerModel, 'screenshot', _screenshot, raising=False)
+    viewer = ViewerModel()
+    viewer.add_image(np.random.random((2, 10, 20, 30)), channel_axis=0, name=['a', 'b'])
+    napari_panel = NapariPanel(viewer)
+    camera = viewer.camera.dict()
+
+    frames = napari_panel.capture_sweep(napari_panel.sweep_steps(0, 2, 8, 2))
+    assert [x.viewer_state.dims['point'][0] for x in frames] == [2, 4, 6]
+    assert all(x.viewer_state.camera == camera for x in frames)
+
+    frames = napari_panel.capture_sweep(napari_panel.visibility_steps())
+    assert [[name for name, layer in x.viewer_state.layers.items() if layer['visible']]
+            for x in frames] == [['a'], ['b'], ['a', 'b']]
+    assert len(napari_panel.key_frames) == 6
@@ -0,0 +1,95 @@
+from unittest import mock
+
+import numpy as np
+from napari.components import ViewerModel
+from napari_microfilm.panel_item import PanelElement, PanelElementList, ViewerState
+from napari_microfilm.snapshot_store import SnapshotStore
+from napari_microfilm.utils import get_canvas_size
+
+
+def test_state_refers_to_data_and_compares_by_digest():
+    viewer = ViewerModel()
+    points = viewer.add_points(np.random.random((1000, 2)) * 50)
+    viewer.add_image(np.random.random((4, 30, 40)))
+
+    first = ViewerState.from_viewer(viewer)
+    second = ViewerState.from_viewer(viewer)
+    assert 'data' not in first.layers[points.name]
+    assert first.data_refs[points.name][0] == id(points.data)
+    assert first == second and hash(first) == hash(second)
+
+    viewer.dims.set_point(0, 3)
+    assert ViewerState.from_viewer(viewer) != first
+    assert len({first, second, ViewerState.from_viewer(viewer)}) == 2
+
+
+def test_list_operations_never_read_snapshots():
+    store = SnapshotStore()
+    state = ViewerState(camera={}, dims={}, layers={})
+    elements = PanelElementList()
+    for i in range(5):
+        elements.append(PanelElement(
+            state, store.put(np.full((3, 20, 20), i, dtype=np.uint8)), store=store))
+    first, last = elements[0], elements[-1]
+
+    with mock.patch.object(PanelElement, 'snapshot', new_callable=mock.PropertyMock) as snapshot:
+        assert elements.index(last) == 4
+        assert first in elements
+        elements.remove(last)
+        assert last not in elements
+        assert snapshot.call_count == 0
+
+    # same content, distinct panel items
+    store.retain(first.snapshot_key)
+    copy = PanelElement(state, first.snapshot_key, store=store)
+    assert copy.digest == first.digest and copy != first
+    assert copy.digest != elements[1].digest
+
+
+def test_snapshot_is_cropped_to_visible_layers(monkeypatch):
+    def screenshot(self, canvas_only=True):
+        return np.full(get_canvas_size(self) + (4,), 255, dtype=np.uint8)
+
+    monkeypatch.setattr(ViewerModel, 'screenshot', screenshot, raising=False)
+    viewer = ViewerModel()
+    viewer.add_image(np.zeros((50, 200)))
+    store = SnapshotStore()
+
+    full = PanelElement.from_viewer(viewer, store=store)
+    cropped = PanelElement.from_viewer(viewer, store=store, crop=True)
+    assert full.snapshot.shape == (3,) + get_canvas_size(viewer)
+    assert cropped.snapshot.flags.c_contiguous
+    # the crop keeps the aspect ratio of the data, up to a pixel
+    height, width = cropped.snapshot.shape[1:]
+    assert width <= get_canvas_size(viewer)[1]
+    assert abs(height / width - 50 / 200) < 2 / width
+    np.testing.assert_allclose(cropped.region[:, 1], [-0.5, 199.5])
+
+    # zoomed in, the data covers the canvas width
+    viewer.camera.zoom *= 4
+    zoomed = PanelElement.from_viewer(viewer, store=store, crop=True)
+    assert zoomed.snapshot.shape[2] == get_canvas_size(viewer)[1]
+    np.testing.assert_allclose(zoomed.region[:, 0], [-0.5, 49.5])
+
+
+def test_roi_crops_shared_snapshot():
+    viewer = ViewerModel()
+    viewer.add_image(np.zeros((50, 100)))
+    store = SnapshotStore()
+    snapshot = np.random.randint(0, 255, (3, 50, 100), dtype=np.uint8)
+    overview = PanelElement(
+        ViewerState.from_viewer(viewer), store.put(snapshot), store=store,
+        region=np.array([[0, 0], [50, 100]]))
+
+    zoom = overview.roi([[10, 20], [30, 60]])
+    assert zoom.snapshot_key == overview.snapshot_key and len(store) == 1
+    assert zoom.crop == (10, 30, 20, 60)
+    np.testing.assert_array_equal(zoom.snapshot, snapshot[:, 10:30, 20:60])
+    np.testing.assert_allclose(zoom.region, [[10, 20], [30, 60]])
+    assert zoom.viewer_state.camera['zoom'] == 2.5 * overview.viewer_state.camera['zoom']
+    assert zoom.digest != overview.digest
+
+    # regions of interest of regions of interest crop the same snapshot
+    detail = zoom.roi([[15, 30], [20, 40]])
+    assert detail.crop == (15, 20, 30, 40)
+    np.testing.assert_array_equal(detail.snapshot, snapshot[:, 15:20, 30:40])
@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+import pytest
+from napari_microfilm import profiling
+from napari_microfilm.utils import make_thumbnail
+
+
+@pytest.fixture
+def recording():
+    profiling.reset()
+    profiling.enable()
+    yield
+    profiling.disable()
+    profiling.reset()
+
+
+def test_spans_are_only_recorded_when_enabled():
+    profiling.reset()
+    with profiling.span('disabled'):
+        pass
+    assert profiling.get_totals() == {}
+
+
+def test_totals_and_chrome_trace(recording, tmp_path):
+    for _ in range(3):
+        with profiling.span('outer'):
+            make_thumbnail(np.zeros((3, 200, 300), dtype=np.uint8))
+
+    totals = profiling.get_totals()
+    assert totals['outer']['count'] == 3
+    assert totals['make_thumbnail']['count'] == 3
+    assert totals['outer']['total'] >= totals['make_thumbnail']['total']
+    assert 'make_thumbnail: 3 x' in profiling.format_totals()
+
+    path = tmp_path / 'trace.json'
+    profiling.write_chrome_trace(path)
+    events = json.loads(path.read_text())['traceEvents']
+    assert len(events) == 6
+    assert {e['ph'] for e in events} == {'X'}
+    # spans are written when they end, inner ones first
+    assert [e['name'] for e in events[:2]] == ['make_thumbnail', 'outer']
+    assert events[1]['ts'] <= events[0]['ts']
+    assert events[1]['dur'] >= events[0]['dur']
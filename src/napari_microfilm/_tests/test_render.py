@@ -0,0 +1,92 @@
+import weakref
+
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+from napari_microfilm.panel_item import ViewerState
+from napari_microfilm.render import OffscreenRenderer, render_state
+
+
+@pytest.fixture
+def layer_data():
+    return (np.arange(24) * 10).reshape(4, 6).astype(np.uint8)
+
+
+@pytest.fixture
+def state(layer_data):
+    viewer = ViewerModel()
+    viewer.add_image(
+        layer_data, name='image', colormap='gray', contrast_limits=[0, 255],
+        scale=(2, 2), translate=(1, 3))
+    return ViewerState.from_viewer(viewer)
+
+
+# pixel centers are at translate + index * scale, so the pixels cover
+# [0, 8) x [2, 14) in world coordinates
+REGION = [[0, 2], [8, 14]]
+
+
+@pytest.mark.parametrize('zoom', [1, 2, 3])
+def test_render_state_matches_data(state, layer_data, zoom):
+    image = render_state(state, {'image': layer_data}, 6 * zoom, region=REGION)
+
+    expected = np.repeat(np.repeat(layer_data, zoom, axis=0), zoom, axis=1)
+    assert image.shape == expected.shape + (3,)
+    # the gray colormap maps values to within 1 of themselves, neighbouring
+    # pixels differ by 10
+    for channel in range(3):
+        np.testing.assert_allclose(image[..., channel], expected, atol=1)
+
+
+def test_render_state_outside_data(state, layer_data):
+    # the left half of the region is left of the layer
+    image = render_state(state, {'image': layer_data}, 12, region=[[0, -10], [8, 14]])
+
+    assert image.shape == (4, 12, 3)
+    assert np.all(image[:, :6] == 0)
+    np.testing.assert_allclose(image[:, 6:, 0], layer_data, atol=1)
+
+
+def test_render_state_beyond_shorter_data():
+    viewer = ViewerModel()
+    viewer.add_image(np.zeros((5, 4, 6), dtype=np.uint8), name='image')
+    viewer.dims.set_point(0, 4)
+    state = ViewerState.from_viewer(viewer)
+
+    # a spec of the last plane applied to a dataset of 3 planes
+    with pytest.raises(ValueError, match="axis 0 is outside of layer 'image'"):
+        render_state(state, {'image': np.zeros((3, 4, 6), dtype=np.uint8)}, 6, region=REGION)
+
+
+def test_offscreen_renderer_caches_renders(state, layer_data):
+    renderer = OffscreenRenderer(maxsize=2)
+    data = {'image': layer_data}
+
+    first = renderer.render(state, data, 6, region=REGION)
+    assert renderer.render(state, data, 6, region=REGION) is first
+    np.testing.assert_array_equal(first, render_state(state, data, 6, region=REGION))
+
+    larger = renderer.render(state, data, 12, region=REGION)
+    assert larger.shape == (8, 12, 3)
+    # other data is rendered again
+    assert renderer.render(state, {'image': layer_data.copy()}, 6, region=REGION) is not first
+    assert len(renderer._cache) == 2
+
+    renderer.clear()
+    assert renderer.render(state, data, 6, region=REGION) is not first
+
+
+def test_offscreen_renderer_keeps_cached_data_alive(state, layer_data):
+    renderer = OffscreenRenderer()
+    data = layer_data.copy()
+    ref = weakref.ref(data)
+    first = renderer.render(state, {'image': data}, 6, region=REGION)
+
+    # the id of collected data could be reused by other data and hit the cache
+    del data
+    assert ref() is not None
+    other = np.zeros_like(layer_data)
+    assert renderer.render(state, {'image': other}, 6, region=REGION) is not first
+
+    renderer.clear()
+    assert ref() is None
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+from napari_microfilm.panel_item import PanelElement, ViewerState
+from napari_microfilm.session import load_session, save_session
+from napari_microfilm.snapshot_store import SnapshotStore
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_session_roundtrip_is_lazy(compress, tmp_path):
+    viewer = ViewerModel()
+    viewer.add_image(np.random.random((2, 30, 40)), channel_axis=0)
+    store = SnapshotStore()
+    key_frames = [
+        PanelElement(
+            ViewerState.from_viewer(viewer),
+            store.put(np.random.randint(0, 255, (3, 30, 40), dtype=np.uint8)),
+            name=f'elem {i}', store=store)
+        for i in range(3)
+    ]
+    save_session(tmp_path / 'session.zip', key_frames, {'rows': 1, 'cols': 3}, compress=compress)
+
+    new_store = SnapshotStore()
+    loaded, options = load_session(tmp_path / 'session.zip', store=new_store)
+    assert options == {'rows': 1, 'cols': 3}
+    assert [x.name for x in loaded] == ['elem 0', 'elem 1', 'elem 2']
+    # only thumbnails are read when loading
+    assert new_store.nbytes == 0
+    np.testing.assert_array_equal(loaded[1].thumbnail, key_frames[1].get_thumbnail())
+
+    np.testing.assert_array_equal(loaded[1].snapshot, key_frames[1].snapshot)
+    assert loaded[1].viewer_state.layers['Image']['colormap'].name == 'magenta'
+
+
+def test_shared_snapshots_are_saved_once(tmp_path):
+    import zipfile
+
+    viewer = ViewerModel()
+    viewer.add_image(np.random.random((30, 40)))
+    store = SnapshotStore()
+    snapshot = np.random.randint(0, 255, (3, 30, 40), dtype=np.uint8)
+    overview = PanelElement(
+        ViewerState.from_viewer(viewer), store.put(snapshot), store=store,
+        region=np.array([[0, 0], [30, 40]]))
+    key_frames = [overview, overview.roi([[0, 0], [10, 10]]), overview.copy()]
+    save_session(tmp_path / 'session.zip', key_frames)
+
+    with zipfile.ZipFile(tmp_path / 'session.zip') as archive:
+        assert len([x for x in archive.namelist() if x.startswith('snapshots/')]) == 1
+
+    # loading into a store holding the snapshot reuses it
+    loaded, _ = load_session(tmp_path / 'session.zip', store=store)
+    assert {x.snapshot_key for x in loaded} == {overview.snapshot_key}
+    assert len(store) == 1
+    np.testing.assert_array_equal(loaded[1].snapshot, snapshot[:, :10, :10])
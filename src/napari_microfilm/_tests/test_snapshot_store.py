@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from napari_microfilm.snapshot_store import SnapshotStore
+
+
+@pytest.mark.parametrize('spill', ['compress', 'disk'])
+def test_eviction_and_reload(spill, tmp_path):
+    snapshots = [np.full((50, 40, 4), i, dtype=np.uint8) for i in range(5)]
+    store = SnapshotStore(
+        budget=2 * snapshots[0].nbytes, spill=spill, cache_dir=tmp_path)
+    keys = [store.put(s) for s in snapshots]
+
+    assert store.nbytes <= store.budget
+    for key, snapshot in zip(keys, snapshots):
+        np.testing.assert_array_equal(store.get(key), snapshot)
+        assert store.nbytes <= store.budget
+
+
+def test_release_frees_snapshot(tmp_path):
+    store = SnapshotStore(budget=0, spill='disk', cache_dir=tmp_path)
+    first = store.put(np.zeros((10, 10, 4), dtype=np.uint8))
+    store.put(np.ones((10, 10, 4), dtype=np.uint8))
+    assert len(list(tmp_path.iterdir())) == 1
+
+    store.retain(first)
+    store.release(first)
+    assert first in store
+    store.release(first)
+    assert first not in store
+    assert len(list(tmp_path.iterdir())) == 0
+
+
+def test_lazy_snapshot_is_reloaded_from_source():
+    calls = []
+
+    def load():
+        calls.append(1)
+        return np.full((10, 10, 4), 7, dtype=np.uint8)
+
+    store = SnapshotStore(budget=0)
+    key = store.put_lazy(load)
+    assert calls == []
+    np.testing.assert_array_equal(store.get(key), load())
+    store.put(np.zeros((10, 10, 4), dtype=np.uint8))
+    # evicted lazy snapshots are not spilled but loaded again
+    assert key not in store._files
+    store.get(key)
+    assert len(calls) == 3
+
+
+def test_identical_snapshots_are_stored_once():
+    store = SnapshotStore()
+    keys = [store.put(np.full((3, 20, 30), 5, dtype=np.uint8)) for _ in range(3)]
+    other = store.put(np.full((3, 30, 20), 5, dtype=np.uint8))
+
+    assert len(set(keys)) == 1 and other != keys[0]
+    assert len(store) == 2
+    assert store.nbytes == 2 * 3 * 20 * 30
+    for key in keys[:-1]:
+        store.release(key)
+    assert keys[0] in store
+    store.release(keys[0])
+    assert keys[0] not in store
+
+
+def test_mapped_snapshots_are_not_counted(tmp_path):
+    path = tmp_path / "snapshot.npy"
+    np.save(path, np.full((3, 20, 30), 3, dtype=np.uint8))
+    in_memory = np.zeros((3, 20, 30), dtype=np.uint8)
+    store = SnapshotStore(budget=in_memory.nbytes)
+    key = store.put(in_memory)
+    lazy = store.put_lazy(lambda: np.load(path, mmap_mode='r'))
+
+    store.get(lazy)
+    # the in-memory snapshot fits the budget and is not spilled
+    assert key in store._cache and lazy in store._cache
+    assert store.nbytes == in_memory.nbytes
+    assert store.mapped_nbytes == in_memory.nbytes
+    store.release(lazy)
+    assert store.mapped_nbytes == 0
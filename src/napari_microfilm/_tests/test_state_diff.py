@@ -0,0 +1,54 @@
+import numpy as np
+from napari.components import ViewerModel
+from napari_microfilm.panel_item import ViewerState
+from napari_microfilm.state_diff import apply_state, diff_state
+
+
+def test_apply_only_changes_what_differs():
+    viewer = ViewerModel()
+    data = np.random.random((2, 4, 30, 40))
+    layers = viewer.add_image(data, channel_axis=0)
+    state = ViewerState.from_viewer(viewer)
+    assert not diff_state(viewer, state)
+
+    viewer.dims.set_point(0, 3)
+    layers[1].visible = False
+    layers[0].contrast_limits = (0.2, 0.5)
+    diff = diff_state(viewer, state)
+    assert not diff.camera
+    assert list(diff.dims) == ['point']
+    assert diff.layers == {
+        layers[0].name: {'contrast_limits': state.layers[layers[0].name]['contrast_limits']},
+        layers[1].name: {'visible': True},
+    }
+
+    apply_state(viewer, state)
+    assert not diff_state(viewer, state)
+    plane = int(state.dims['point'][0])
+    np.testing.assert_array_equal(layers[1]._slice.image.raw, data[1, plane])
+
+
+def test_only_slicing_changes_refresh(monkeypatch):
+    viewer = ViewerModel()
+    layers = viewer.add_image(np.random.random((2, 30, 40)), channel_axis=0)
+    state = ViewerState.from_viewer(viewer)
+    # refreshes that are not blocked, i.e. that slice the layer
+    calls = []
+    for layer in layers:
+        monkeypatch.setattr(
+            layer, 'refresh',
+            lambda *args, layer=layer, **kwargs: layer._refresh_blocked or calls.append(layer.name))
+
+    layers[0].contrast_limits = (0.2, 0.5)
+    layers[0].opacity = 0.5
+    layers[0].gamma = 2
+    calls.clear()
+    apply_state(viewer, state)
+    assert layers[0].contrast_limits == state.layers[layers[0].name]['contrast_limits']
+    assert calls == []
+
+    layers[1].scale = (2, 2)
+    layers[1].contrast_limits = (0.2, 0.5)
+    calls.clear()
+    apply_state(viewer, state)
+    assert calls == [layers[1].name]
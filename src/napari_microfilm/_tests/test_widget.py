@@ -1,5 +1,7 @@
 import numpy as np
-from napari_microfilm import MicrofilmWidget
+from qtpy.QtCore import QThreadPool, Qt
+from napari_microfilm import MicrofilmWidget, panel_item
+from napari_microfilm.utils import figure_to_rgba
 
 
 # make_napari_viewer is a pytest fixture that returns a napari viewer object
@@ -16,4 +18,221 @@ def test_example_q_widget(make_napari_viewer, capsys):
     my_widget.add_image_as_layer()
 
     # read captured output and check that it's as we expected
-    assert 'rgb_sequence' in viewer.layers
\ No newline at end of file
+    assert 'rgb_sequence' in viewer.layers
+
+
+def _select_first_item(widget):
+    view = widget.PanelItemListWidget
+    view.setCurrentIndex(view.model().index(0, 0))
+
+
+def test_capture_renders_preview_once(make_napari_viewer, qtbot):
+    viewer = make_napari_viewer()
+    viewer.add_image(np.random.random((3, 100, 100)), channel_axis=0)
+    my_widget = MicrofilmWidget(viewer)
+    my_widget.flush_preview()
+    _select_first_item(my_widget)
+
+    my_widget.preview_render_count = 0
+    my_widget._capture_panel_item_callback()
+    qtbot.waitUntil(lambda: not my_widget._preview_timer.isActive())
+
+    assert my_widget.preview_render_count == 1
+
+
+def test_option_burst_is_coalesced(make_napari_viewer, qtbot):
+    viewer = make_napari_viewer()
+    viewer.add_image(np.random.random((3, 100, 100)), channel_axis=0)
+    my_widget = MicrofilmWidget(viewer)
+    my_widget.flush_preview()
+
+    my_widget.preview_render_count = 0
+    for size in range(6, 12):
+        my_widget._channellabel_size.setValue(size)
+        my_widget._label_size.setValue(size)
+    qtbot.waitUntil(lambda: not my_widget._preview_timer.isActive())
+
+    assert my_widget.preview_render_count == 1
+
+
+def test_capture_takes_single_screenshot(make_napari_viewer, monkeypatch):
+    viewer = make_napari_viewer()
+    viewer.add_image(np.random.random((3, 100, 100)), channel_axis=0)
+    my_widget = MicrofilmWidget(viewer)
+    _select_first_item(my_widget)
+
+    calls = []
+    screenshot = type(viewer).screenshot
+
+    def counting_screenshot(self, *args, **kwargs):
+        calls.append(1)
+        return screenshot(self, *args, **kwargs)
+
+    monkeypatch.setattr(type(viewer), 'screenshot', counting_screenshot)
+    my_widget._capture_panel_item_callback()
+    my_widget.flush_preview()
+
+    assert len(calls) == 1
+
+
+def test_grid_resize_captures_placeholders_once(make_napari_viewer, monkeypatch):
+    viewer = make_napari_viewer()
+    viewer.add_image(np.random.random((3, 100, 100)), channel_axis=0)
+    my_widget = MicrofilmWidget(viewer)
+
+    calls = []
+    screenshot = type(viewer).screenshot
+
+    def counting_screenshot(self, *args, **kwargs):
+        calls.append(1)
+        return screenshot(self, *args, **kwargs)
+
+    monkeypatch.setattr(type(viewer), 'screenshot', counting_screenshot)
+    my_widget.numrows.setValue(4)
+    my_widget.numcolumns.setValue(3)
+
+    key_frames = my_widget.napari_panel.key_frames
+    assert len(key_frames) == 12
+    assert len(calls) == 2
+    # both placeholder captures show the reset view, and are stored once
+    assert len({x.snapshot_key for x in key_frames[1:]}) == 1
+
+
+def test_grid_resize_only_plots_new_cells(make_napari_viewer, monkeypatch):
+    viewer = make_napari_viewer()
+    viewer.add_image(np.random.random((3, 100, 100)), channel_axis=0)
+    my_widget = MicrofilmWidget(viewer)
+    my_widget.flush_preview()
+    first_axis = my_widget.panel.ax[0, 0]
+
+    plotted = []
+    set_cell = my_widget.set_cell
+    monkeypatch.setattr(
+        my_widget, 'set_cell', lambda i, *args: plotted.append(i) or set_cell(i, *args))
+    my_widget.numcolumns.setValue(3)
+    assert plotted == [1, 2]
+    assert my_widget.panel.ax.shape == (1, 3)
+    assert my_widget.panel.ax[0, 0] is first_axis
+
+    my_widget.numcolumns.setValue(2)
+    my_widget.flush_preview()
+    assert plotted == [1, 2]
+    assert list(my_widget.panel.fig.axes) == list(my_widget.panel.ax.ravel())
+
+
+def test_closing_stops_save_process(make_napari_viewer, tmp_path):
+    viewer = make_napari_viewer()
+    viewer.add_image(np.random.random((3, 100, 100)), channel_axis=0)
+    my_widget = MicrofilmWidget(viewer)
+    saver = my_widget.panel_saver
+
+    saver.save(my_widget.get_panel_render(), tmp_path / 'panel.png').result(timeout=120)
+    processes = list(saver._executor._processes.values())
+    my_widget.close()
+
+    assert saver._executor is None
+    for process in processes:
+        process.join(timeout=30)
+        assert not process.is_alive()
+
+
+def test_capture_roi_shares_reference_snapshot(make_napari_viewer, monkeypatch):
+    viewer = make_napari_viewer()
+    viewer.add_image(np.random.random((3, 100, 100)), channel_axis=0)
+    my_widget = MicrofilmWidget(viewer)
+    my_widget.numcolumns.setValue(2)
+    key_frames = my_widget.napari_panel.key_frames
+    view = my_widget.PanelItemListWidget
+    view.setCurrentIndex(view.model().index(1, 0))
+
+    calls = []
+    monkeypatch.setattr(type(viewer), 'screenshot', lambda *args, **kwargs: calls.append(1))
+    viewer.camera.zoom *= 4
+    my_widget._roi_reference.setValue(0)
+    my_widget._capture_roi_callback()
+    my_widget.flush_preview()
+
+    assert calls == []
+    assert key_frames[1].snapshot_key == key_frames[0].snapshot_key
+    assert key_frames[1].crop is not None
+    reference_shape = key_frames[0].snapshot.shape
+    roi_shape = key_frames[1].snapshot.shape
+    assert roi_shape[0] == 3 and roi_shape[1] < reference_shape[1] and roi_shape[2] < reference_shape[2]
+    assert my_widget._cell_elements[0, 1] is key_frames[1]
+
+
+def test_stack_composite_while_preview_renders(make_napari_viewer):
+    viewer = make_napari_viewer()
+    viewer.add_image(np.random.random((3, 4, 100, 100)), channel_axis=0)
+    max_threads = QThreadPool.globalInstance().maxThreadCount()
+    my_widget = MicrofilmWidget(viewer)
+
+    # the progress bar of the composite is shown while the preview is drawn
+    my_widget.update_preview()
+    my_widget.add_image_as_layer(lazy=False)
+    assert my_widget.await_workers(10000)
+
+    assert viewer.layers['rgb_sequence'].data.shape == (4, 100, 100, 3)
+    # the shared thread pool of napari is left alone
+    assert QThreadPool.globalInstance().maxThreadCount() == max_threads
+
+
+def test_shared_snapshot_thumbnail_is_built_once(make_napari_viewer, monkeypatch):
+    viewer = make_napari_viewer()
+    viewer.add_image(np.random.random((3, 100, 100)), channel_axis=0)
+    my_widget = MicrofilmWidget(viewer)
+    my_widget.numcolumns.setValue(3)
+
+    calls = []
+    make_thumbnail = panel_item.make_thumbnail
+    monkeypatch.setattr(
+        panel_item, 'make_thumbnail', lambda x: calls.append(1) or make_thumbnail(x))
+    model = my_widget.PanelItemListWidget.model()
+    pixmaps = [model.data(model.index(i, 0), Qt.DecorationRole) for i in range(3)]
+
+    # the placeholders share their snapshot, and thus their thumbnail
+    assert len(calls) == 1
+    assert pixmaps[1] is pixmaps[0] and pixmaps[2] is pixmaps[0]
+
+
+def test_preview_is_rendered_from_a_snapshot(make_napari_viewer, qtbot):
+    viewer = make_napari_viewer()
+    viewer.add_image(np.random.random((3, 100, 100)), channel_axis=0)
+    my_widget = MicrofilmWidget(viewer)
+    my_widget.numcolumns.setValue(2)
+    my_widget.flush_preview()
+    expected = figure_to_rgba(my_widget.panel.fig)
+
+    my_widget.update_preview()
+    # the figure is modified while the preview is drawn
+    my_widget._label_checkbox.setChecked(True)
+    my_widget._preview_timer.stop()
+    assert my_widget.await_workers(10000)
+    qtbot.waitUntil(lambda: my_widget._shown_generation == my_widget._preview_generation)
+
+    np.testing.assert_array_equal(my_widget._preview_buffer, expected)
+    assert (figure_to_rgba(my_widget.panel.fig) != expected).any()
+
+
+def test_options_change_during_sweep(make_napari_viewer, qtbot):
+    viewer = make_napari_viewer()
+    viewer.add_image(np.random.random((3, 100, 100)), channel_axis=0)
+    my_widget = MicrofilmWidget(viewer)
+    my_widget.numcolumns.setValue(2)
+    my_widget.flush_preview()
+
+    my_widget._sweep_channels_callback()
+    assert my_widget.capture_queue.is_running()
+    # the key-frames are being replaced, changes wait for the sweep to end
+    my_widget._check_channel_labels.setChecked(True)
+    my_widget._channellabel_size.setValue(8)
+    my_widget.flush_preview()
+    assert not my_widget._save_button.isEnabled()
+    assert my_widget.save_panel() is None
+
+    qtbot.waitUntil(lambda: not my_widget.capture_queue.is_running())
+    my_widget.flush_preview()
+    rows, cols = my_widget.panel.microplots.shape
+    assert len(my_widget.napari_panel.key_frames) == rows * cols
+    assert my_widget.panel.fig.texts
+    assert my_widget._save_button.isEnabled()
@@ -0,0 +1,357 @@
+"""
+This module implements the headless creation of panels. A panel spec saved
+from the widget (grid shape, ViewerState of each cell, labels and saving
+options) is applied to new datasets: each cell is rendered from the raw data
+with render_state, without viewer or screenshots, and the figures are built
+with Micropanel in a pool of processes.
+
+The same spec can be used from the command line:
+
+    napari-microfilm-batch spec.json data/*.npz -o figures --workers 8
+"""
+
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from . import profiling
+from .panel_item import ViewerState
+from .render import is_image_state, render_state
+from .utils import to_channel_first
+
+
+@dataclass
+class PanelSpec:
+    """Description of a panel, independent of the data shown in it.
+
+    Parameters
+    ----------
+    rows, cols : int
+        Grid shape of the panel.
+    cells : list of dict
+        One dict per cell, in row-major order, with a 'state' entry holding
+        a ViewerState dict (see `ViewerState.to_dict`) and an optional
+        'region' entry [[y0, x0], [y1, x1]] giving the rendered world region.
+    labels : list of str, optional
+        Label of each cell. No labels are added if None.
+    label_size : int
+        Font size of the labels.
+    label_color : list of float
+        RGB(A) color of the labels, values in [0, 1].
+    channel_labels : bool
+        Whether to show the names of the visible layers above each cell.
+    channel_label_size : float
+        Size of the channel labels as fraction of the figure.
+    dpi : int
+        Resolution of the saved figures.
+    cell_size : int
+        Number of pixels along the longest side of each rendered cell.
+    canvas_size : list of int, optional
+        (height, width) of the canvas the states were captured on, used for
+        cells without region.
+    """
+
+    rows: int
+    cols: int
+    cells: list
+    labels: list = None
+    label_size: int = 12
+    label_color: list = field(default_factory=lambda: [1.0, 1.0, 1.0])
+    channel_labels: bool = False
+    channel_label_size: float = 0.05
+    dpi: int = 300
+    cell_size: int = 1024
+    canvas_size: list = None
+
+    @classmethod
+    def from_panel(cls, rows, cols, key_frames, **kwargs):
+        """Create a spec from the PanelElements of a NapariPanel.
+
+        Parameters
+        ----------
+        rows, cols : int
+            Grid shape of the panel.
+        key_frames : list of PanelElement
+            Elements shown in the cells, in row-major order.
+        kwargs
+            Other PanelSpec fields.
+        """
+        cells = [
+            {
+                "state": key_frame.viewer_state.to_dict(),
+                "region": None if key_frame.region is None
+                else np.asarray(key_frame.region).tolist(),
+            }
+            for key_frame in list(key_frames)[:rows * cols]
+        ]
+        return cls(rows=rows, cols=cols, cells=cells, **kwargs)
+
+    def to_json(self, path):
+        """Save the spec as a JSON file."""
+        with open(path, "w") as f:
+            json.dump(asdict(self), f, indent=1)
+
+    @classmethod
+    def from_json(cls, path):
+        """Load a spec saved with `to_json`."""
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    def layer_names(self):
+        """Return the names of the image layers used in the spec, in order
+        of first appearance. Other layers are not rendered and need no data."""
+        names = {}
+        for cell in self.cells:
+            names.update(dict.fromkeys(
+                name for name, layer in cell["state"]["layers"].items()
+                if is_image_state(layer)))
+        return list(names)
+
+
+def load_dataset(path, layer_names=None, channel_axis=0) -> dict:
+    """Load the layer data of a dataset.
+
+    Parameters
+    ----------
+    path : str or Path
+        An .npz file with one array per layer name, or an .npy or .tif file
+        holding all channels in a single array.
+    layer_names : list of str, optional
+        Names given to the channels of a single array, in order. Required
+        for .npy and .tif files.
+    channel_axis : int
+        Axis of the channels in a single array.
+
+    Returns
+    -------
+    dict
+        Map of layer name -> array, as expected by `render_state`.
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".npz":
+        with np.load(path) as f:
+            return {name: f[name] for name in f.files}
+
+    if suffix == ".npy":
+        array = np.load(path, mmap_mode="r")
+    elif suffix in (".tif", ".tiff"):
+        import tifffile
+
+        array = tifffile.imread(path)
+    else:
+        raise ValueError(f"Unsupported dataset format {path.suffix}")
+
+    if layer_names is None:
+        raise ValueError("layer_names are required to split a single array into layers")
+    channels = np.moveaxis(array, channel_axis, 0)
+    if len(channels) != len(layer_names):
+        raise ValueError(
+            f"{path.name} has {len(channels)} channels but {len(layer_names)} "
+            "layer names were given")
+    return dict(zip(layer_names, channels))
+
+
+def render_cells(spec: PanelSpec, data: dict) -> list:
+    """Render the cells of a spec from layer data.
+
+    Returns
+    -------
+    list of np.ndarray
+        (3, h, w) uint8 RGB image of each cell, laid out like snapshots.
+    """
+    return [
+        to_channel_first(render_state(
+            ViewerState.from_dict(cell["state"], restore=False), data,
+            spec.cell_size, region=cell.get("region"),
+            canvas_size=spec.canvas_size))
+        for cell in spec.cells[:spec.rows * spec.cols]
+    ]
+
+
+def build_panel(spec: PanelSpec, images, figsize=None):
+    """Create the Micropanel of a spec from rendered cell images.
+
+    Parameters
+    ----------
+    spec : PanelSpec
+        Panel description.
+    images : list of np.ndarray
+        (3, h, w) RGB image of each cell, in row-major order.
+    figsize : tuple of float, optional
+        (width, height) of the figure in inches, by default the size chosen
+        by Micropanel.
+
+    Returns
+    -------
+    microfilm.microplot.Micropanel
+    """
+    import microfilm.microplot
+
+    with profiling.span('Micropanel'):
+        panel = microfilm.microplot.Micropanel(spec.rows, spec.cols, figsize=figsize)
+    for pos_index, image in enumerate(images[:spec.rows * spec.cols]):
+        pos_row, pos_col = np.unravel_index(pos_index, (spec.rows, spec.cols))
+        panel.add_element(
+            pos=[pos_row, pos_col],
+            microim=microfilm.microplot.Microimage(
+                image, cmaps=['pure_red', 'pure_green', 'pure_blue']))
+
+        if spec.labels is not None:
+            labels = list(spec.labels) + ['X'] * (pos_index + 1 - len(spec.labels))
+            panel.microplots[pos_row, pos_col].add_label(
+                label_text=labels[pos_index],
+                label_font_size=spec.label_size,
+                label_color=spec.label_color)
+
+    if spec.channel_labels:
+        names = [[[] for _ in range(spec.cols)] for _ in range(spec.rows)]
+        colors = [[[] for _ in range(spec.cols)] for _ in range(spec.rows)]
+        for pos_index, cell in enumerate(spec.cells[:spec.rows * spec.cols]):
+            pos_row, pos_col = np.unravel_index(pos_index, (spec.rows, spec.cols))
+            for name, layer in cell["state"]["layers"].items():
+                # only image layers are rendered, see render_state
+                if layer.get("visible") and is_image_state(layer):
+                    names[pos_row][pos_col].append(name)
+                    colors[pos_row][pos_col].append(layer["colormap"]["colors"][-1])
+        panel.add_channel_label(
+            channel_names=names, channel_label_size=spec.channel_label_size,
+            channel_colors=colors)
+    return panel
+
+
+def render_figure(spec: PanelSpec, data: dict, path, stream=False):
+    """Render the panel of a spec for one dataset and save it to `path`.
+    With stream=True, the figure is rendered and written one row at a time
+    (see `export.export_panel`)."""
+    import matplotlib.pyplot as plt
+
+    if stream:
+        from .export import export_panel
+
+        return export_panel(spec, render_cells(spec, data), path)
+    panel = build_panel(spec, render_cells(spec, data))
+    try:
+        with profiling.span('savefig'):
+            panel.savefig(path, dpi=spec.dpi)
+    finally:
+        plt.close(panel.fig)
+    return path
+
+
+def _render_job(spec, dataset, path, layer_names, channel_axis, stream):
+    """Load a dataset and render its figure in a worker process."""
+    import matplotlib
+
+    # workers have no display
+    matplotlib.use("Agg")
+    if not isinstance(dataset, dict):
+        dataset = load_dataset(dataset, layer_names, channel_axis)
+    return render_figure(spec, dataset, path, stream)
+
+
+def render_batch(
+    spec: PanelSpec, datasets, out_dir, n_workers=None, suffix=".png",
+    layer_names=None, channel_axis=0, stream=False,
+):
+    """Render the panel of a spec for many datasets, one figure per process.
+
+    Parameters
+    ----------
+    spec : PanelSpec
+        Panel description.
+    datasets : list of str, Path or dict
+        Dataset files (see `load_dataset`), loaded by the workers, or maps of
+        layer name -> array.
+    out_dir : str or Path
+        Directory where figures are saved. Figures of files are named after
+        the file, others after their position in `datasets`. Files whose
+        names only differ by directory or extension raise a ValueError, as
+        their figures would overwrite each other.
+    n_workers : int, optional
+        Number of processes, by default chosen by ProcessPoolExecutor.
+    suffix : str
+        Extension of the figures, setting their format.
+    layer_names : list of str, optional
+        Names of the channels of single array files, by default the layers
+        of the spec.
+    channel_axis : int
+        Axis of the channels in single array files.
+    stream : bool
+        Whether to render and write the figures one row at a time, to bound
+        the memory used by large panels. Only .png, .tif, .pdf and .svg are
+        supported.
+
+    Returns
+    -------
+    list of Path
+        Paths of the saved figures, in the order of `datasets`.
+    """
+    out_dir = Path(out_dir)
+    paths = [
+        out_dir / ((f"panel_{i:04d}" if isinstance(dataset, dict) else Path(dataset).stem) + suffix)
+        for i, dataset in enumerate(datasets)
+    ]
+    sources = {}
+    for dataset, path in zip(datasets, paths):
+        sources.setdefault(path, []).append(str(dataset))
+    duplicates = [files for files in sources.values() if len(files) > 1]
+    if duplicates:
+        raise ValueError(
+            "Datasets would be saved to the same figure: "
+            + "; ".join(", ".join(files) for files in duplicates))
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if layer_names is None:
+        layer_names = spec.layer_names()
+
+    with ProcessPoolExecutor(n_workers) as pool:
+        futures = [
+            pool.submit(_render_job, spec, dataset, path, layer_names, channel_axis, stream)
+            for dataset, path in zip(datasets, paths)
+        ]
+        return [future.result() for future in futures]
+
+
+def main(argv=None):
+    """Command line entry point, see `render_batch`."""
+    parser = argparse.ArgumentParser(
+        prog="napari-microfilm-batch",
+        description="Create microfilm panels for many datasets from a saved panel spec.")
+    parser.add_argument("spec", help="panel spec JSON file saved from the widget")
+    parser.add_argument("datasets", nargs="+", help=".npz, .npy or .tif files")
+    parser.add_argument("-o", "--out-dir", default=".", help="output directory")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of processes")
+    parser.add_argument("--format", default="png", help="figure format, e.g. png, pdf, svg")
+    parser.add_argument("--dpi", type=int, default=None, help="override the dpi of the spec")
+    parser.add_argument("--cell-size", type=int, default=None,
+                        help="override the rendered size of the cells in pixels")
+    parser.add_argument("--layer-names", default=None,
+                        help="comma separated names of the channels of single array files")
+    parser.add_argument("--channel-axis", type=int, default=0,
+                        help="channel axis of single array files")
+    parser.add_argument("--stream", action="store_true",
+                        help="render and write large figures one row at a time")
+    args = parser.parse_args(argv)
+
+    spec = PanelSpec.from_json(args.spec)
+    if args.dpi is not None:
+        spec.dpi = args.dpi
+    if args.cell_size is not None:
+        spec.cell_size = args.cell_size
+    layer_names = None if args.layer_names is None else args.layer_names.split(",")
+
+    paths = render_batch(
+        spec, args.datasets, args.out_dir, n_workers=args.workers,
+        suffix="." + args.format.lstrip("."), layer_names=layer_names,
+        channel_axis=args.channel_axis, stream=args.stream)
+    for path in paths:
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+This module implements the capture of sequences of views. Each step of a
+sequence prepares the viewer and reads the canvas back on the GUI thread, one
+step per event loop iteration so that the GUI stays responsive. Thumbnails
+are built lazily by the key-frame list when it shows them.
+"""
+
+from napari.utils import progress
+from qtpy.QtCore import QObject, QTimer, Signal
+
+
+class CaptureQueue(QObject):
+    """Queue of captures inserted into the key-frames of a NapariPanel.
+
+    Parameters
+    ----------
+    napari_panel : NapariPanel
+        Panel in which the captured key-frames are inserted.
+    parent : QObject, optional
+        Qt parent.
+
+    Signals
+    -------
+    progressed(int, int)
+        Emitted after each step with the number of done and total steps.
+    finished(list)
+        Emitted with the captured key-frames once all steps are done or the
+        queue was canceled.
+    """
+
+    progressed = Signal(int, int)
+    finished = Signal(list)
+
+    def __init__(self, napari_panel, parent=None):
+        super().__init__(parent)
+        self.napari_panel = napari_panel
+
+        self._steps = []
+        self._captured = []
+        self._canceled = False
+        self._progress = None
+        self._done = 0
+        self._total = 0
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._run_step)
+
+    def is_running(self) -> bool:
+        return self._progress is not None
+
+    def start(self, steps, position=None, pos_panels=None, description='Capturing'):
+        """Start capturing a sequence of views.
+
+        Parameters
+        ----------
+        steps : list of (callable or None, int)
+            For each step, a function called with the viewer to prepare the
+            view, and the number of key-frames sharing the captured snapshot.
+        position : int, optional
+            Index of the first captured key-frame. By default, key-frames
+            are appended.
+        pos_panels : list, optional
+            [row, col] of each captured key-frame, used to name them.
+        description : str
+            Description of the progress bar.
+        """
+
+        if self.is_running():
+            raise RuntimeError('A capture sequence is already running')
+
+        self._steps = list(steps)
+        self._captured = []
+        self._canceled = False
+        self._position = len(self.napari_panel.key_frames) if position is None else position
+        self._pos_panels = None if pos_panels is None else list(pos_panels)
+        self._done = 0
+        self._total = len(self._steps)
+        self._progress = progress(total=self._total, desc=description)
+        self._timer.start()
+
+    def cancel(self):
+        """Stop after the current step. Captured key-frames are kept."""
+
+        self._canceled = True
+
+    def _run_step(self):
+        if self._canceled or not self._steps:
+            self._finish()
+            return
+
+        prepare, count = self._steps.pop(0)
+        if prepare is not None:
+            prepare(self.napari_panel.viewer)
+
+        pos_panels = None
+        if self._pos_panels is not None:
+            pos_panels = self._pos_panels[len(self._captured):len(self._captured) + count]
+        frames = self.napari_panel.capture_panelitems(
+            count, position=self._position, pos_panels=pos_panels)
+        self._position += len(frames)
+        self._captured.extend(frames)
+
+        self._done += 1
+        self._progress.update(1)
+        self.progressed.emit(self._done, self._total)
+        # the next step runs once pending events, e.g. redraws, are processed
+        self._timer.start()
+
+    def _finish(self):
+        self._progress.close()
+        self._progress = None
+        self._steps = []
+        captured, self._captured = self._captured, []
+        self.finished.emit(captured)
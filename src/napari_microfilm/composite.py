@@ -0,0 +1,368 @@
+"""
+This module implements the conversion of multichannel layer data into RGB
+composites. Each channel is mapped to RGB through a lookup table computed
+once from its colormap and contrast limits, and channels are summed in
+saturating uint16. Stacks are processed in chunks of frames spread over a
+thread pool and written into a preallocated uint8 output. For multiscale
+layers, only the region and pyramid level needed for the output are read.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import profiling
+
+
+def camera_region(camera: dict, canvas_size) -> np.ndarray:
+    """Return the world bounding box displayed for a camera state.
+
+    Parameters
+    ----------
+    camera : dict
+        State of a napari camera, e.g. ViewerState.camera.
+    canvas_size : tuple
+        (height, width) of the canvas in screen pixels.
+
+    Returns
+    -------
+    np.ndarray
+        [[y0, x0], [y1, x1]] in world coordinates of the displayed axes.
+    """
+
+    center = np.asarray(camera['center'], dtype=float)[-2:]
+    half_size = np.asarray(canvas_size, dtype=float) / (2 * camera['zoom'])
+    return np.stack([center - half_size, center + half_size])
+
+
+def crop_box(region, data_region, shape):
+    """Return the pixels of an image of a world region that show data.
+
+    Parameters
+    ----------
+    region : array-like
+        [[y0, x0], [y1, x1]] world region shown by the image, e.g. from
+        `camera_region`.
+    data_region : array-like
+        [[y0, x0], [y1, x1]] world bounding box of the data.
+    shape : tuple
+        (height, width) of the image.
+
+    Returns
+    -------
+    (tuple of slice, np.ndarray) or None
+        Row and column slices of the image covering the data, rounded
+        outwards to whole pixels, and the world region shown by them. None
+        if the data is not in the image.
+    """
+
+    region = np.asarray(region, dtype=float)
+    data_region = np.asarray(data_region, dtype=float)
+    shape = np.asarray(shape[:2])
+    pixel_size = (region[1] - region[0]) / shape
+    # the tolerance avoids an extra pixel from rounding errors
+    start = np.floor((data_region[0] - region[0]) / pixel_size + 1e-6).astype(int)
+    stop = np.ceil((data_region[1] - region[0]) / pixel_size - 1e-6).astype(int)
+    start, stop = np.clip(start, 0, shape), np.clip(stop, 0, shape)
+    if np.any(stop <= start):
+        return None
+    slices = (slice(start[0], stop[0]), slice(start[1], stop[1]))
+    return slices, np.stack([region[0] + start * pixel_size, region[0] + stop * pixel_size])
+
+
+def select_level(downsample_factors, region_shape, target_size) -> int:
+    """Return the coarsest pyramid level that still resolves a region with
+    at least `target_size` pixels along its longest side.
+
+    Parameters
+    ----------
+    downsample_factors : array-like
+        Downsampling factor of each level and axis, level 0 first.
+    region_shape : array-like
+        (height, width) of the region in level 0 pixels.
+    target_size : int
+        Number of output pixels needed along the longest side.
+    """
+
+    factors = np.asarray(downsample_factors, dtype=float)[:, -2:]
+    for level in range(len(factors) - 1, 0, -1):
+        if np.max(np.asarray(region_shape) / factors[level]) >= target_size:
+            return level
+    return 0
+
+
+def layer_region(layer, region=None, target_size=None):
+    """Return the data of an image layer needed to render a region.
+
+    For multiscale layers, the coarsest pyramid level meeting `target_size`
+    is used. Only the region is sliced out of the data, so lazy arrays
+    (dask, zarr) are not read beyond it.
+
+    Parameters
+    ----------
+    layer : napari.layers.Image
+        An image layer.
+    region : array-like, optional
+        [[y0, x0], [y1, x1]] world bounding box, by default the full layer.
+    target_size : int, optional
+        Number of output pixels needed along the longest side of the
+        region. By default the full resolution is used.
+
+    Returns
+    -------
+    data : array-like
+        (..., Y, X) data of the region, not loaded into memory.
+    scale : np.ndarray
+        World size of a returned pixel along Y and X.
+    translate : np.ndarray
+        World position of the first returned pixel along Y and X.
+    """
+
+    scale = np.asarray(layer.scale, dtype=float)[-2:]
+    translate = np.asarray(layer.translate, dtype=float)[-2:]
+    if layer.multiscale:
+        levels = layer.data
+        factors = np.asarray(layer.downsample_factors, dtype=float)[:, -2:]
+    else:
+        levels = [layer.data]
+        factors = np.ones((1, 2))
+
+    full_shape = np.asarray(levels[0].shape[-2:])
+    if region is None:
+        start, stop = np.zeros(2, dtype=int), full_shape
+    else:
+        region = np.asarray(region, dtype=float)
+        start = np.clip(np.floor((region[0] - translate) / scale), 0, full_shape).astype(int)
+        stop = np.clip(np.ceil((region[1] - translate) / scale), 0, full_shape).astype(int)
+
+    level = 0
+    if target_size is not None:
+        level = select_level(factors, stop - start, target_size)
+    start = (start // factors[level]).astype(int)
+    stop = np.ceil(stop / factors[level]).astype(int)
+
+    data = levels[level][..., start[0]:stop[0], start[1]:stop[1]]
+    return data, scale * factors[level], translate + start * scale * factors[level]
+
+
+def match_shapes(channels):
+    """Resample channels with nearest neighbours to their smallest (Y, X) shape.
+
+    Returns
+    -------
+    channels : list of array-like
+        The resampled channels.
+    zoom : np.ndarray
+        Ratio of the original to the resampled (Y, X) shape of the first
+        channel.
+    """
+
+    shape = np.min([x.shape[-2:] for x in channels], axis=0)
+    zoom = np.asarray(channels[0].shape[-2:]) / shape
+    resampled = []
+    for data in channels:
+        if tuple(data.shape[-2:]) != tuple(shape):
+            rows = (np.arange(shape[0]) * data.shape[-2] // shape[0])
+            cols = (np.arange(shape[1]) * data.shape[-1] // shape[1])
+            data = data[..., rows, :][..., cols]
+        resampled.append(data)
+    return resampled, zoom
+
+
+def make_lut(cmap, limits, dtype) -> np.ndarray:
+    """Compute the RGB lookup table of a channel.
+
+    For 8 and 16 bit integer data, the table has one entry per possible
+    value and is indexed directly by the data. For other data types, it is
+    the table of the colormap (cmap.N entries, usually 256) spanning the
+    contrast limits, which gives the same result as evaluating the colormap.
+
+    Parameters
+    ----------
+    cmap : matplotlib.colors.Colormap
+        Colormap of the channel.
+    limits : [min, max]
+        Contrast limits of the channel.
+    dtype : numpy dtype
+        Data type of the channel.
+
+    Returns
+    -------
+    np.ndarray
+        (N, 3) uint8 lookup table.
+    """
+
+    dtype = np.dtype(dtype)
+    vmin, vmax = limits
+    if dtype.kind in 'ui' and dtype.itemsize <= 2:
+        # entries are ordered as the unsigned view of the data
+        unsigned = np.dtype(f'u{dtype.itemsize}')
+        values = np.arange(2 ** (8 * dtype.itemsize)).astype(unsigned).view(dtype)
+        scaled = (values.astype(np.float32) - vmin) / ((vmax - vmin) if vmax != vmin else 1)
+        return cmap(np.clip(scaled, 0, 1), bytes=True)[:, :3]
+    # integers index the colormap table
+    return cmap(np.arange(cmap.N), bytes=True)[:, :3]
+
+
+def apply_lut(data, lut, limits) -> np.ndarray:
+    """Map data through a lookup table made with `make_lut`.
+
+    Returns
+    -------
+    np.ndarray
+        uint8 array of shape data.shape + (3,).
+    """
+
+    data = np.asarray(data)
+    if data.dtype.kind in 'ui' and len(lut) == 2 ** (8 * data.dtype.itemsize):
+        index = data.view(f'u{data.dtype.itemsize}')
+    else:
+        vmin, vmax = limits
+        # same binning as matplotlib colormaps
+        index = np.array(data, dtype=np.float32)
+        index -= vmin
+        index *= len(lut) / ((vmax - vmin) if vmax != vmin else 1)
+        np.nan_to_num(index, copy=False)
+        np.clip(index, 0, len(lut) - 1, out=index)
+        index = index.astype(np.intp)
+    return np.take(lut, index, axis=0)
+
+
+@profiling.timed('composite_frames')
+def composite_frames(channels, cmaps, limits, luts=None) -> np.ndarray:
+    """Combine channels into an RGB image by summing their colormapped values.
+
+    Equivalent to colorify.multichannel_to_rgb with rescale_type='limits'
+    and proj_type='sum', but vectorized over any number of leading
+    dimensions. Channels are mapped through lookup tables and summed in
+    uint16 instead of evaluating colormaps in float64.
+
+    Parameters
+    ----------
+    channels : list of array-like
+        One array per channel, all with the same shape (..., Y, X).
+    cmaps : list of matplotlib.colors.Colormap
+        Colormap of each channel.
+    limits : list of [min, max]
+        Contrast limits of each channel.
+    luts : list of np.ndarray, optional
+        Lookup tables of the channels made with `make_lut`, to avoid
+        recomputing them for each batch of frames.
+
+    Returns
+    -------
+    np.ndarray
+        uint8 array of shape (..., Y, X, 3).
+    """
+
+    composite = None
+    for i, (data, cmap, channel_limits) in enumerate(zip(channels, cmaps, limits)):
+        data = np.asarray(data)
+        lut = luts[i] if luts is not None else make_lut(cmap, channel_limits, data.dtype)
+        rgb = apply_lut(data, lut, channel_limits)
+        if composite is None:
+            composite = rgb.astype(np.uint16)
+        else:
+            composite += rgb
+
+    np.minimum(composite, 255, out=composite)
+    return composite.astype(np.uint8)
+
+
+def composite_stack(
+    channels, cmaps, limits, chunk_size=8, out=None, n_workers=None, progress=None
+) -> np.ndarray:
+    """Combine channel stacks into an RGB stack, chunk by chunk.
+
+    Chunks of frames along the first axis are read and composited in
+    parallel; each result is written directly into `out`, so that only
+    the chunks being processed are held in memory besides the output.
+
+    Parameters
+    ----------
+    channels : list of array-like
+        One array per channel, all with the same shape (T, ..., Y, X).
+        Anything that can be sliced along the first axis and converted to
+        a numpy array works, e.g. dask or zarr arrays.
+    cmaps : list of matplotlib.colors.Colormap
+        Colormap of each channel.
+    limits : list of [min, max]
+        Contrast limits of each channel.
+    chunk_size : int
+        Number of frames processed together.
+    out : np.ndarray, optional
+        Preallocated uint8 array of shape (T, ..., Y, X, 3), e.g. a
+        memory-mapped array. Allocated if None.
+    n_workers : int, optional
+        Number of threads, by default chosen by ThreadPoolExecutor.
+    progress : callable, optional
+        Called with the number of frames of each completed chunk.
+
+    Returns
+    -------
+    np.ndarray
+        The composite stack, `out` if provided.
+    """
+
+    shape = tuple(channels[0].shape)
+    if out is None:
+        out = np.empty(shape + (3,), dtype=np.uint8)
+    elif out.shape != shape + (3,):
+        raise ValueError(f'Output shape {out.shape} does not match {shape + (3,)}')
+
+    luts = [make_lut(cmap, lim, x.dtype) for x, cmap, lim in zip(channels, cmaps, limits)]
+
+    def process(start):
+        stop = min(start + chunk_size, shape[0])
+        out[start:stop] = composite_frames(
+            [np.asarray(x[start:stop]) for x in channels], cmaps, limits, luts)
+        return stop - start
+
+    with ThreadPoolExecutor(n_workers) as pool:
+        for num_frames in pool.map(process, range(0, shape[0], chunk_size)):
+            if progress is not None:
+                progress(num_frames)
+
+    return out
+
+
+def composite_lazy(channels, cmaps, limits):
+    """Combine channels into a lazy RGB dask array.
+
+    Each block of the output is composited from the matching blocks of the
+    channels when it is computed, so that napari only computes the frames
+    and tiles it displays. The chunking of the channels is kept, with a
+    single chunk for the added RGB axis.
+
+    Parameters
+    ----------
+    channels : list of array-like
+        One array per channel, all with the same shape (..., Y, X), with any
+        number of leading dimensions. numpy, dask and zarr arrays work.
+    cmaps : list of matplotlib.colors.Colormap
+        Colormap of each channel.
+    limits : list of [min, max]
+        Contrast limits of each channel.
+
+    Returns
+    -------
+    dask.array.Array
+        uint8 array of shape (..., Y, X, 3).
+    """
+    import dask.array as da
+
+    arrays = [da.asarray(x) for x in channels]
+    index = tuple(range(arrays[0].ndim))
+    luts = [make_lut(cmap, lim, x.dtype) for x, cmap, lim in zip(arrays, cmaps, limits)]
+
+    def composite_block(*blocks):
+        return composite_frames(blocks, cmaps, limits, luts)
+
+    args = []
+    for array in arrays:
+        args.extend([array, index])
+    # with meta given, dask doesn't call composite_block to infer the output
+    return da.blockwise(
+        composite_block, index + (len(index),), *args,
+        new_axes={len(index): 3}, dtype=np.uint8,
+        meta=np.empty((0,) * (len(index) + 1), dtype=np.uint8))
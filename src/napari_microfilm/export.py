@@ -0,0 +1,364 @@
+"""
+This module implements the export of panels too large to be rendered as a
+single figure. Instead of one canvas for the whole panel, the figure is drawn
+one row of cells at a time and each row is streamed to the output file, so
+that the peak memory is bounded by a row:
+
+- PNG files are deflated row by row with zlib,
+- TIFF files are written as tiled BigTIFF with tifffile.
+
+Vector files (PDF, SVG) are saved from a single figure in which the cell
+images are not resampled, so that each of them is embedded once at its
+native resolution.
+
+A PanelRender is an immutable description of a panel, from which the figure
+can be saved away from the widget, e.g. in another process, while the panel
+keeps being edited.
+"""
+
+import struct
+import zlib
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+import numpy as np
+
+from . import profiling
+from .batch import PanelSpec, build_panel
+from .utils import figure_to_rgba
+
+RASTER_FORMATS = ('.png', '.tif', '.tiff')
+VECTOR_FORMATS = ('.pdf', '.svg')
+
+# formats of save_render, by extension
+SAVE_FORMATS = {
+    'png': 'PNG', 'tif': 'TIFF', 'jpg': 'JPEG', 'pdf': 'PDF', 'svg': 'SVG',
+}
+
+# fraction of a cell height left empty between rows, and size in inches of
+# the longest side of a cell, as in Micropanel
+ROW_MARGIN = 0.01
+FIGURE_SCALING = 5
+
+
+def _row_spec(spec: PanelSpec, row: int) -> PanelSpec:
+    """Return the spec of a single row of a panel."""
+
+    cells = slice(row * spec.cols, (row + 1) * spec.cols)
+    labels = spec.labels
+    if labels is not None:
+        labels = list(labels) + ['X'] * (spec.rows * spec.cols - len(labels))
+        labels = labels[cells]
+    # channel labels are sized as a fraction of the figure height, and a row
+    # is 1 / rows of the figure
+    return replace(
+        spec, rows=1, cells=spec.cells[cells], labels=labels,
+        channel_label_size=spec.channel_label_size * spec.rows)
+
+
+def _figure_size(spec: PanelSpec, images, figsize=None) -> tuple:
+    """Return the (width, height) in inches of the panel figure. By default
+    this is the size Micropanel gives it, from the shape of the last image."""
+
+    if figsize is not None:
+        return tuple(figsize)
+    height, width = images[:spec.rows * spec.cols][-1].shape[1:3]
+    return (
+        spec.cols * width / max(height, width) * FIGURE_SCALING,
+        spec.rows * height / max(height, width) * FIGURE_SCALING)
+
+
+def iter_rows(spec: PanelSpec, images, figsize=None):
+    """Render a panel one row of cells at a time.
+
+    Parameters
+    ----------
+    spec : PanelSpec
+        Panel description.
+    images : list of np.ndarray
+        (3, h, w) RGB image of each cell, in row-major order.
+    figsize : tuple of float, optional
+        (width, height) in inches of the whole panel, by default the size
+        of a Micropanel.
+
+    Yields
+    ------
+    np.ndarray
+        (h, w, 4) uint8 RGBA strips, rows of cells alternating with the
+        margins between them. All strips have the same width.
+    """
+    import matplotlib.pyplot as plt
+
+    width, height = _figure_size(spec, images, figsize)
+    strip_width = int(width * spec.dpi)
+    for row in range(spec.rows):
+        row_images = images[row * spec.cols:(row + 1) * spec.cols]
+        panel = build_panel(_row_spec(spec, row), row_images, figsize=(width, height / spec.rows))
+        try:
+            if spec.channel_labels:
+                # Micropanel narrows the figure by the height fraction taken
+                # by the channel labels, which is rows times larger for a
+                # single row than for the whole figure
+                shrink = 1 - panel.fig.get_size_inches()[0] / width
+                panel.fig.set_size_inches(width * (1 - shrink / spec.rows), height / spec.rows)
+            panel.fig.set_dpi(spec.dpi)
+            with profiling.span('render row'):
+                strip = figure_to_rgba(panel.fig)
+        finally:
+            plt.close(panel.fig)
+
+        # center the strip, channel labels make it narrower than the figure
+        strip = strip[:, :strip_width]
+        left = (strip_width - strip.shape[1]) // 2
+        if row > 0:
+            yield np.zeros((int(ROW_MARGIN * strip.shape[0]), strip_width, 4), dtype=np.uint8)
+        yield np.pad(strip, ((0, 0), (left, strip_width - strip.shape[1] - left), (0, 0)))
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack('>I', len(data)) + chunk_type + data
+        + struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+
+class PNGStreamWriter:
+    """Write an RGBA PNG file row by row.
+
+    The height of the image doesn't need to be known in advance: it is
+    written in the header when the file is closed.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path of the PNG file.
+    width : int
+        Width of the image in pixels.
+    compress_level : int
+        zlib compression level, from 0 (none) to 9 (smallest).
+    """
+
+    def __init__(self, path, width, compress_level=6):
+        self.width = width
+        self.height = 0
+        self._compressor = zlib.compressobj(compress_level)
+        self._file = open(path, 'wb')
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._header_offset = self._file.tell()
+        self._file.write(self._header())
+
+    def _header(self) -> bytes:
+        # 8 bits per sample, RGBA, deflate, no interlacing
+        return _png_chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 6, 0, 0, 0))
+
+    def write(self, rows: np.ndarray):
+        """Append (h, width, 4) uint8 rows to the image."""
+
+        if rows.shape[1:] != (self.width, 4):
+            raise ValueError(f"Expected rows of shape (h, {self.width}, 4), got {rows.shape}")
+        # each row starts with its filter type, 0 for none
+        scanlines = np.zeros((len(rows), 1 + 4 * self.width), dtype=np.uint8)
+        scanlines[:, 1:] = rows.reshape(len(rows), -1)
+        data = self._compressor.compress(scanlines.tobytes())
+        if data:
+            self._file.write(_png_chunk(b'IDAT', data))
+        self.height += len(rows)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.write(_png_chunk(b'IDAT', self._compressor.flush()))
+        self._file.write(_png_chunk(b'IEND', b''))
+        self._file.seek(self._header_offset)
+        self._file.write(self._header())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _iter_tiles(strips, width, tile):
+    """Regroup strips of any height into (tile, tile, 4) tiles in row-major
+    order, padding the last row and column of tiles."""
+
+    padded_width = -(-width // tile) * tile
+    buffer = np.zeros((0, padded_width, 4), dtype=np.uint8)
+    for strip in strips:
+        strip = np.pad(strip, ((0, 0), (0, padded_width - width), (0, 0)))
+        buffer = np.concatenate([buffer, strip])
+        while len(buffer) >= tile:
+            for x in range(0, padded_width, tile):
+                yield np.ascontiguousarray(buffer[:tile, x:x + tile])
+            buffer = buffer[tile:]
+    if len(buffer):
+        buffer = np.pad(buffer, ((0, tile - len(buffer)), (0, 0), (0, 0)))
+        for x in range(0, padded_width, tile):
+            yield np.ascontiguousarray(buffer[:, x:x + tile])
+
+
+def export_png(spec: PanelSpec, images, path, figsize=None, compress_level=6):
+    """Save a panel as a PNG file, rendered and compressed row by row."""
+
+    strips = iter_rows(spec, images, figsize)
+    first = next(strips)
+    with PNGStreamWriter(path, first.shape[1], compress_level) as writer:
+        writer.write(first)
+        for strip in strips:
+            writer.write(strip)
+    return path
+
+
+def export_tiff(spec: PanelSpec, images, path, figsize=None, tile=256, compress_level=6):
+    """Save a panel as a tiled BigTIFF file, rendered row by row. Tiles are
+    deflated unless compress_level is 0."""
+    import tifffile
+
+    strips = iter_rows(spec, images, figsize)
+    first = next(strips)
+    # all rows have the height of the first one
+    row_height, width = first.shape[:2]
+    height = spec.rows * row_height + (spec.rows - 1) * int(ROW_MARGIN * row_height)
+
+    def all_strips():
+        yield first
+        yield from strips
+
+    with tifffile.TiffWriter(path, bigtiff=True) as tif:
+        tif.write(
+            _iter_tiles(all_strips(), width, tile), shape=(height, width, 4),
+            dtype=np.uint8, tile=(tile, tile), photometric='rgb',
+            extrasamples=['unassalpha'],
+            compression='zlib' if compress_level else None,
+            compressionargs={'level': compress_level} if compress_level else None)
+    return path
+
+
+def export_vector(spec: PanelSpec, images, path, figsize=None, compress_level=6):
+    """Save a panel as a PDF or SVG file. The cell images are embedded
+    without resampling, at their native resolution."""
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    panel = build_panel(spec, images, figsize=figsize)
+    try:
+        for ax in panel.ax.flat:
+            for image in ax.images:
+                image.set_interpolation('none')
+        with profiling.span('savefig'), matplotlib.rc_context({'pdf.compression': compress_level}):
+            panel.savefig(path, dpi=spec.dpi)
+    finally:
+        plt.close(panel.fig)
+    return path
+
+
+def export_panel(spec: PanelSpec, images, path, figsize=None, compress_level=6, tile=256):
+    """Save a panel without rendering the whole figure at once.
+
+    Parameters
+    ----------
+    spec : PanelSpec
+        Panel description.
+    images : list of np.ndarray
+        (3, h, w) RGB image of each cell, in row-major order.
+    path : str or Path
+        Output file. Its extension sets the format: .png, .tif/.tiff
+        (tiled BigTIFF), .pdf or .svg.
+    figsize : tuple of float, optional
+        (width, height) in inches of the panel, by default the size of a
+        Micropanel.
+    compress_level : int
+        zlib compression level, from 0 (none) to 9 (smallest).
+    tile : int
+        Tile size of TIFF files.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == '.png':
+        return export_png(spec, images, path, figsize, compress_level)
+    if suffix in ('.tif', '.tiff'):
+        return export_tiff(spec, images, path, figsize, tile, compress_level)
+    if suffix in VECTOR_FORMATS:
+        return export_vector(spec, images, path, figsize, compress_level)
+    raise ValueError(
+        f"Unsupported format {suffix}, expected one of "
+        f"{', '.join(RASTER_FORMATS + VECTOR_FORMATS)}")
+
+
+@dataclass(frozen=True)
+class PanelRender:
+    """Everything needed to save a panel, independent of the widget.
+
+    Parameters
+    ----------
+    spec : PanelSpec
+        Panel description. It must not be shared with the widget.
+    images : tuple of np.ndarray
+        Read-only (3, h, w) RGB image of each cell, in row-major order.
+    stream : bool
+        Whether raster formats are rendered and written one row at a time.
+    """
+
+    spec: PanelSpec
+    images: tuple
+    stream: bool = False
+
+    @classmethod
+    def from_images(cls, spec: PanelSpec, images, stream=False):
+        """Create a PanelRender holding read-only views of images, so that
+        they can't be modified while the panel is saved."""
+        views = []
+        for image in images:
+            view = np.asarray(image).view()
+            view.flags.writeable = False
+            views.append(view)
+        return cls(spec=spec, images=tuple(views), stream=stream)
+
+
+def _savefig_kwargs(fmt: str, compress_level: int) -> dict:
+    """Return the savefig arguments setting the compression of a format."""
+
+    if fmt == 'png':
+        return {'pil_kwargs': {'compress_level': compress_level}}
+    if fmt in ('tif', 'tiff'):
+        return {'pil_kwargs': {'compression': 'tiff_adobe_deflate' if compress_level else 'raw'}}
+    if fmt in ('jpg', 'jpeg'):
+        # JPEG has no compression level, the quality decreases instead
+        return {'pil_kwargs': {'quality': 95 - 5 * compress_level}}
+    return {}
+
+
+def save_render(render: PanelRender, path, compress_level=6):
+    """Build the figure of a PanelRender and save it.
+
+    Parameters
+    ----------
+    render : PanelRender
+        Panel to save.
+    path : str or Path
+        Output file. Its extension sets the format, one of SAVE_FORMATS.
+    compress_level : int
+        From 0 (fastest) to 9 (smallest). The zlib level of PNG, PDF and
+        streamed TIFF files, whether other TIFF files are deflated, and
+        the quality of JPEG files, from 95 down to 50.
+
+    Returns
+    -------
+    Path
+        The path of the saved file.
+    """
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    path = Path(path)
+    fmt = path.suffix.lower().lstrip('.')
+    if render.stream and '.' + fmt in RASTER_FORMATS + VECTOR_FORMATS:
+        return export_panel(render.spec, list(render.images), path, compress_level=compress_level)
+
+    panel = build_panel(render.spec, list(render.images))
+    try:
+        with profiling.span('savefig'), matplotlib.rc_context({'pdf.compression': compress_level}):
+            panel.savefig(path, dpi=render.spec.dpi, **_savefig_kwargs(fmt, compress_level))
+    finally:
+        plt.close(panel.fig)
+    return path
@@ -7,17 +7,27 @@ import string
 from pathlib import Path
 from qtpy.QtWidgets import (QWidget, QPushButton, QSpinBox,
 QGroupBox, QGridLayout, QVBoxLayout, QLabel, QColorDialog,
-QTabWidget, QLineEdit, QCheckBox, QSizePolicy, QFileDialog)
-from qtpy.QtGui import QPixmap, QColor
-from qtpy.QtCore import Qt
-from cmap import Colormap
-
-import microfilm.microplot
-from microfilm import colorify
+QTabWidget, QLineEdit, QCheckBox, QSizePolicy, QFileDialog, QComboBox)
+from qtpy.QtGui import QPixmap, QColor, QImage
+from qtpy.QtCore import Qt, QThreadPool, QTimer
 import numpy as np
+from napari.qt.threading import create_worker
+from napari.utils import progress
+from napari.utils.notifications import show_error, show_info
+from .composite import (camera_region, composite_frames, composite_lazy,
+composite_stack, layer_region, match_shapes)
+from . import profiling
+from .batch import PanelSpec
+from .capture_queue import CaptureQueue
+from .export import SAVE_FORMATS, PanelRender
 from .napari_panel import NapariPanel
 from .panel_list_control_widget import PanelElementListControlWidget
+from .panel_item import ViewerState
 from .panel_items_widget import PanelItemListWidget
+from .render import OffscreenRenderer
+from .save_queue import PanelSaver
+from .session import load_session, save_session
+from .utils import figure_snapshot, get_canvas_size, render_figure_snapshot, to_channel_first
 
 
 class MicrofilmWidget(QWidget):
@@ -27,6 +37,8 @@ class MicrofilmWidget(QWidget):
         self.viewer = napari_viewer
 
         self.napari_panel = NapariPanel(viewer=self.viewer)
+        # captures of sequences of views, e.g. sweeps
+        self.capture_queue = CaptureQueue(self.napari_panel, parent=self)
 
         self.panelElementListControlWidget = PanelElementListControlWidget(
             napari_panel=self.napari_panel, parent=self
@@ -54,6 +66,21 @@ class MicrofilmWidget(QWidget):
         self._initialize_panel_grid_control(self._main_layout)
 
         self.pixlabel = QLabel()
+        # last rendered preview, kept so that resizing only rescales it
+        self._preview_buffer = None
+        self._preview_image = None
+        self.pixmap = None
+
+        # bursts of option changes are coalesced into a single render that
+        # happens once no change occurred for preview_delay ms
+        self.preview_delay = 50
+        self.preview_render_count = 0
+        self._preview_dirty = False
+        self._panel_dirty = False
+        self._preview_timer = QTimer(self)
+        self._preview_timer.setSingleShot(True)
+        self._preview_timer.setInterval(self.preview_delay)
+        self._preview_timer.timeout.connect(self.flush_preview)
         # add preview to main view. Not ideal for large panels
         # self._main_layout.addWidget(self.pixlabel)
         #self.pixlabel.setFixedWidth(900)
@@ -62,6 +89,22 @@ class MicrofilmWidget(QWidget):
             QSizePolicy.Expanding)
         self.pixlabel.resizeEvent = self._on_resize_preview
 
+        # panel figure and, for each of its cells, the key-frame plotted in it
+        self.panel = None
+        self._cell_elements = None
+        # the preview is drawn on a worker thread from a snapshot of the
+        # figure, so that the figure can be modified in the meantime.
+        # Workers run on a pool of their own. Qt converts images on the
+        # global pool while the GUI thread waits holding the GIL, e.g. when
+        # napari shows a progress bar, so workers waiting for the GIL there
+        # can deadlock the GUI on machines with few cores
+        self._thread_pool = QThreadPool(self)
+        self._workers = set()
+        self._preview_generation = 0
+        self._shown_generation = 0
+        # view restored at the end of a sweep
+        self._sweep_state = None
+
         # initialize panel element list
         self._init_panel_items_widget(self._main_layout)
         self._main_layout.addWidget(self.panelElementListControlWidget)
@@ -131,6 +174,102 @@ class MicrofilmWidget(QWidget):
         self._save_dpi.setValue(300)
         self.save_form.addWidget(self._save_dpi, 1, 1, Qt.AlignTop)
 
+        # format and compression, from 0 (fastest) to 9 (smallest)
+        self.save_form.addWidget(QLabel('Format'), 2, 0, Qt.AlignTop)
+        self._save_format = QComboBox()
+        for extension, name in SAVE_FORMATS.items():
+            self._save_format.addItem(name, extension)
+        self.save_form.addWidget(self._save_format, 2, 1, Qt.AlignTop)
+        self.save_form.addWidget(QLabel('Compression'), 3, 0, Qt.AlignTop)
+        self._save_compression = QSpinBox()
+        self._save_compression.setRange(0, 9)
+        self._save_compression.setValue(6)
+        self.save_form.addWidget(self._save_compression, 3, 1, Qt.AlignTop)
+        # figures are saved in a background process, which is stopped with
+        # the widget. The children of a widget are deleted before its
+        # destroyed signal is emitted, so the saver is captured directly.
+        self.panel_saver = PanelSaver(self)
+        panel_saver = self.panel_saver
+        self.destroyed.connect(lambda: panel_saver.shutdown(wait=False))
+
+        # render cells from the layer data instead of using the screenshots
+        self._render_offscreen = QCheckBox()
+        self._render_offscreen.setText('Render cells from data at save dpi')
+        self.save_form.addWidget(self._render_offscreen, 4, 0, 1, 2, Qt.AlignTop)
+        self.offscreen_renderer = OffscreenRenderer()
+        self._render_worker = None
+
+        # render and write large panels one row at a time
+        self._stream_export = QCheckBox()
+        self._stream_export.setText('Export row by row (large panels)')
+        self.save_form.addWidget(self._stream_export, 5, 0, 1, 2, Qt.AlignTop)
+
+        # export the panel layout for the batch command line tool
+        self._save_spec_button = QPushButton()
+        self._save_spec_button.setText('Save panel spec')
+        self.save_form.addWidget(self._save_spec_button, 6, 0, 1, 2, Qt.AlignTop)
+
+        # session options
+        self.session_group = QGroupBox('Session')
+        self.session_group.setAlignment(Qt.AlignTop)
+        self.session_group.setLayout(QGridLayout())
+        self._options_layout.addWidget(self.session_group)
+
+        self._save_session_button = QPushButton()
+        self._save_session_button.setText('Save session')
+        self.session_group.layout().addWidget(self._save_session_button, 0, 0, Qt.AlignTop)
+        self._load_session_button = QPushButton()
+        self._load_session_button.setText('Load session')
+        self.session_group.layout().addWidget(self._load_session_button, 0, 1, Qt.AlignTop)
+
+        # composite layer options
+        self.composite_group = QGroupBox('Composite layer')
+        self.composite_group.setAlignment(Qt.AlignTop)
+        self.composite_group.setLayout(QGridLayout())
+        self._options_layout.addWidget(self.composite_group)
+
+        self._lazy_composite = QCheckBox()
+        self._lazy_composite.setText('Lazy composite (computed when displayed)')
+        self.composite_group.layout().addWidget(self._lazy_composite, 0, 0, 1, 2, Qt.AlignTop)
+
+        # output size used to pick the pyramid level of multiscale layers
+        self.composite_group.layout().addWidget(QLabel('Multiscale size (px)'), 1, 0, Qt.AlignTop)
+        self._composite_size = QSpinBox()
+        self._composite_size.setRange(16, 100000)
+        self._composite_size.setValue(2048)
+        self.composite_group.layout().addWidget(self._composite_size, 1, 1, Qt.AlignTop)
+
+        # timing of the hot paths
+        self.performance_group = QGroupBox('Performance')
+        self.performance_group.setAlignment(Qt.AlignTop)
+        self.performance_group.setLayout(QGridLayout())
+        self._options_layout.addWidget(self.performance_group)
+
+        self._record_timings = QCheckBox()
+        self._record_timings.setText('Record timings')
+        self.performance_group.layout().addWidget(self._record_timings, 0, 0, 1, 3, Qt.AlignTop)
+        self._timings_label = QLabel()
+        self._timings_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.performance_group.layout().addWidget(self._timings_label, 1, 0, 1, 3, Qt.AlignTop)
+        self._refresh_timings_button = QPushButton()
+        self._refresh_timings_button.setText('Refresh')
+        self.performance_group.layout().addWidget(self._refresh_timings_button, 2, 0, Qt.AlignTop)
+        self._reset_timings_button = QPushButton()
+        self._reset_timings_button.setText('Reset')
+        self.performance_group.layout().addWidget(self._reset_timings_button, 2, 1, Qt.AlignTop)
+        self._save_trace_button = QPushButton()
+        self._save_trace_button.setText('Save trace')
+        self.performance_group.layout().addWidget(self._save_trace_button, 2, 2, Qt.AlignTop)
+
+        # sweep options
+        self._initialize_sweep_control(self._main_layout)
+
+        # cancel running capture sequences
+        self._cancel_capture_button = QPushButton()
+        self._cancel_capture_button.setText('Cancel capture')
+        self._cancel_capture_button.setVisible(False)
+        self._main_layout.addWidget(self._cancel_capture_button)
+
         # initialize preview controls
         self._show_preview = QPushButton()
         self._show_preview.setText('Show preview')
@@ -141,9 +280,20 @@ class MicrofilmWidget(QWidget):
         self.btn_add_image_as_layer.setText('Add single image as layer')
         self._main_layout.addWidget(self.btn_add_image_as_layer)
 
+        # the cells are drawn with the label options, so the panel is only
+        # created once all controls exist
+        self._init_panel()
+
         # add callbacks for widgets 
         self._add_callbacks()
 
+    def closeEvent(self, event):
+        """Stop the saving process when the widget is closed. Pending saves
+        are canceled, a save in progress is finished."""
+
+        self.panel_saver.shutdown(wait=False)
+        super().closeEvent(event)
+
     def _initialize_panel_grid_control(self, layout):
         """Create controls for grid size"""
         
@@ -157,10 +307,57 @@ class MicrofilmWidget(QWidget):
         sizes_form.addWidget(QLabel('Columns'), 1,0)
         sizes_form.addWidget(self.numrows,0,1)
         sizes_form.addWidget(self.numcolumns,1,1)
+        # drop the empty canvas around the data from the snapshots
+        self._crop_to_data = QCheckBox()
+        self._crop_to_data.setText('Crop snapshots to data')
+        sizes_form.addWidget(self._crop_to_data, 2, 0, 1, 2)
+        # cell cropped by 'Capture ROI'
+        sizes_form.addWidget(QLabel('ROI reference cell'), 3, 0)
+        self._roi_reference = QSpinBox()
+        self._roi_reference.setRange(0, 10000)
+        sizes_form.addWidget(self._roi_reference, 3, 1)
 
         sizes_group.setLayout(sizes_form)
         layout.addWidget(sizes_group)
 
+    def _initialize_sweep_control(self, layout):
+        """Create controls to capture one cell per slice or per channel"""
+
+        sweep_group = QGroupBox('Capture sweep')
+        sweep_form = QGridLayout()
+
+        sweep_form.addWidget(QLabel('Axis'), 0, 0)
+        self._sweep_axis = QSpinBox()
+        self._sweep_axis.setRange(0, 100)
+        sweep_form.addWidget(self._sweep_axis, 0, 1)
+
+        sweep_form.addWidget(QLabel('Start'), 1, 0)
+        self._sweep_start = QSpinBox()
+        self._sweep_start.setRange(0, 100000)
+        sweep_form.addWidget(self._sweep_start, 1, 1)
+
+        sweep_form.addWidget(QLabel('Stop'), 2, 0)
+        self._sweep_stop = QSpinBox()
+        self._sweep_stop.setRange(0, 100000)
+        # 0 sweeps up to the last slice
+        self._sweep_stop.setSpecialValueText('end')
+        sweep_form.addWidget(self._sweep_stop, 2, 1)
+
+        sweep_form.addWidget(QLabel('Step'), 3, 0)
+        self._sweep_step = QSpinBox()
+        self._sweep_step.setRange(1, 100000)
+        sweep_form.addWidget(self._sweep_step, 3, 1)
+
+        self._sweep_dims_button = QPushButton()
+        self._sweep_dims_button.setText('Sweep axis')
+        sweep_form.addWidget(self._sweep_dims_button, 4, 0)
+        self._sweep_channels_button = QPushButton()
+        self._sweep_channels_button.setText('Sweep channels')
+        sweep_form.addWidget(self._sweep_channels_button, 4, 1)
+
+        sweep_group.setLayout(sweep_form)
+        layout.addWidget(sweep_group)
+
     def _color_dialog(self):
         """Create color dialog for labels"""
         self._label_color = QColorDialog()
@@ -182,6 +379,9 @@ class MicrofilmWidget(QWidget):
         self.panelElementListControlWidget.captureButton.clicked.connect(
             self._capture_panel_item_callback
         )
+        self.panelElementListControlWidget.roiButton.clicked.connect(
+            self._capture_roi_callback
+        )
         self.numcolumns.valueChanged.connect(self._change_number_rows_cols)
         self.numrows.valueChanged.connect(self._change_number_rows_cols)
 
@@ -198,15 +398,32 @@ class MicrofilmWidget(QWidget):
         self._label_checkbox.stateChanged.connect(self._on_add_label)
         self._label_size.valueChanged.connect(self._on_add_label)
 
-        self._channellabel_size.valueChanged.connect(self.reinitialize)
+        self._channellabel_size.valueChanged.connect(self._schedule_reinitialize)
 
         self._save_button.clicked.connect(self.save_panel)
-
-        self._check_channel_labels.stateChanged.connect(self.reinitialize)
+        self._save_spec_button.clicked.connect(self.save_panel_spec)
+        self._crop_to_data.stateChanged.connect(self._on_crop_to_data)
+        self.panel_saver.saved.connect(lambda path: show_info(f'Panel saved to {path}'))
+        self.panel_saver.failed.connect(
+            lambda path, error: show_error(f'Saving {path} failed: {error}'))
+        self._save_session_button.clicked.connect(self._save_session_callback)
+        self._load_session_button.clicked.connect(self._load_session_callback)
+
+        self._record_timings.stateChanged.connect(self._on_record_timings)
+        self._refresh_timings_button.clicked.connect(self.update_timings)
+        self._reset_timings_button.clicked.connect(self._reset_timings_callback)
+        self._save_trace_button.clicked.connect(self._save_trace_callback)
+
+        self._check_channel_labels.stateChanged.connect(self._schedule_reinitialize)
         self._show_preview.clicked.connect(self.show_preview)
 
         self.btn_add_image_as_layer.clicked.connect(self.add_image_as_layer)
 
+        self._cancel_capture_button.clicked.connect(self.capture_queue.cancel)
+        self._sweep_dims_button.clicked.connect(self._sweep_dims_callback)
+        self._sweep_channels_button.clicked.connect(self._sweep_channels_callback)
+        self.capture_queue.finished.connect(self._on_capture_finished)
+
     def _on_active_panelitem_changed(self, event):
         """Callback on change of active panelitem in the key frames list."""
         active_panelitem = event.value
@@ -229,108 +446,414 @@ class MicrofilmWidget(QWidget):
         self.PanelItemListWidget.setEnabled(has_frames)
     
     def _on_panelitems_moved(self, event=None):
-        """Reconstruct panel object with existing snapshots."""
+        """Rename key-frames after a move and redraw the cells that changed."""
         for panelitem_index, key_frame in enumerate(self.napari_panel.key_frames):
-            #self.napari_panel.update_viewer(panelitem_index)
-            self.add_snapshot_to_panel(panelitem_index, reuse_snapshot=True)
             pos_row, pos_col = self.linear_to_pos_col(panelitem_index)
             key_frame.name = f"Panel elem. [{pos_row}, {pos_col}]"
 
-        self.update_preview()
+        self._update_cells()
 
     def _capture_panel_item_callback(self):
-        """Callback on capture button. Captures both panelitem and snapshot."""
+        """Callback on capture button. Captures both panelitem and snapshot.
+        The panel cell is then drawn from the snapshot of the new key-frame,
+        so that a capture reads the canvas only once."""
 
         current_pos = self.PanelItemListWidget.currentIndex().row()
-        self.add_snapshot_to_panel(current_pos)
 
         pos_row, pos_col = self.linear_to_pos_col(current_pos)
         self.napari_panel.capture_panelitem(insert=False, pos_panel=[pos_row, pos_col])
         
-        self.reinitialize()
-        self.update_preview()
+        self._update_cells()
+
+    def _capture_roi_callback(self):
+        """Callback on ROI button. Replaces the selected key-frame by the
+        current view cropped from the snapshot of the reference cell, so
+        that no screenshot is taken and no snapshot is added."""
+
+        current_pos = self.PanelItemListWidget.currentIndex().row()
+        reference = self._roi_reference.value()
+        if reference >= len(self.napari_panel.key_frames):
+            show_error(f'There is no cell {reference}')
+            return
+        try:
+            self.napari_panel.capture_roi(
+                reference, current_pos, pos_panel=self.linear_to_pos_col(current_pos))
+        except ValueError as error:
+            show_error(str(error))
+            return
+
+        self._update_cells()
 
     def _init_panel(self):
         """Initialize panel with snapshots of key-frames."""
 
-        self.panel = microfilm.microplot.Micropanel(
-            self.numrows.value(), self.numcolumns.value())
+        self._new_panel()
         
         self.napari_panel.key_frames.clear()
-        for i in range(self.numrows.value() * self.numcolumns.value()):
-            pos_row, pos_col = self.linear_to_pos_col(i)
-            self.viewer.reset_view()
-            self.napari_panel.capture_panelitem(pos_panel=[pos_row, pos_col])
-
-        self.update_preview()
+        self._add_placeholders(0, self.numrows.value() * self.numcolumns.value())
+
+        self.refresh_cells()
+        self.request_preview()
+
+    def _new_panel(self):
+        """Replace the panel by an empty one matching the grid size."""
+        # microfilm imports matplotlib, scipy and skimage, it is only loaded
+        # with the first panel to keep the plugin import fast
+        import microfilm.microplot
+
+        if self.panel is not None:
+            self.panel.fig.clear()
+        shape = (self.numrows.value(), self.numcolumns.value())
+        with profiling.span('Micropanel'):
+            self.panel = microfilm.microplot.Micropanel(*shape)
+        self._cell_elements = np.empty(shape, dtype=object)
+
+    def _resize_panel(self, shape):
+        """Change the grid shape of the panel in place. The axes of the kept
+        cells are moved to their new grid position with their plot and
+        labels, so that only the added cells have to be plotted."""
+
+        panel = self.panel
+        axes = list(panel.ax.ravel())
+        microplots = list(panel.microplots.ravel())
+        elements = list(self._cell_elements.ravel())
+        size = shape[0] * shape[1]
+        for ax in axes[size:]:
+            panel.fig.delaxes(ax)
+
+        # same layout as Micropanel.construct_figure
+        grid = panel.fig.add_gridspec(
+            *shape, left=0, right=1, bottom=0, top=1,
+            wspace=panel.margin, hspace=panel.margin)
+        panel.rows, panel.cols = shape
+        panel.ax = np.empty(shape, dtype=object)
+        panel.microplots = np.empty(shape, dtype=object)
+        self._cell_elements = np.empty(shape, dtype=object)
+        for i in range(size):
+            pos = np.unravel_index(i, shape)
+            if i < len(axes):
+                axes[i].set_subplotspec(grid[pos])
+                panel.ax[pos] = axes[i]
+                panel.microplots[pos] = microplots[i]
+                self._cell_elements[pos] = elements[i]
+            else:
+                panel.ax[pos] = panel.fig.add_subplot(grid[pos])
+
+        # Micropanel.add_element sizes the figure from the grid shape,
+        # which is only called for added cells
+        shown = [x for x in panel.microplots.ravel() if x is not None]
+        if shown:
+            images = shown[0].images
+            im_dim = images[0].shape if isinstance(images, list) else images.shape[1:3]
+            panel.fig.set_size_inches(
+                w=shape[1] * im_dim[1] / np.max(im_dim) * panel.figscaling,
+                h=shape[0] * im_dim[0] / np.max(im_dim) * panel.figscaling)
+        # labels are placed from the size of their axis in pixels
+        labels = self._get_labels()
+        for i in range(min(size, len(axes))):
+            self._set_cell_label(i, labels)
 
     def reinitialize(self):
-        """Recreate the panel with existing snapshots and annotations. Used to 
-        update changes to labels."""
-
-        self.panel.fig.clear()
-        self.panel = microfilm.microplot.Micropanel(
-            self.numrows.value(), self.numcolumns.value())
-
-        for i in range(self.numrows.value() * self.numcolumns.value()):
-            pos_row, pos_col = self.linear_to_pos_col(i)
-            self.add_snapshot_to_panel(i, reuse_snapshot=True)
+        """Recreate the panel with existing snapshots and annotations. Used
+        when the channel labels change."""
 
+        self._new_panel()
+        self.refresh_cells()
         self._on_add_label()
         self._on_show_channel_labels()
 
+    def set_cell(self, pos_index, snapshot=None):
+        """Plot the key-frame at index pos_index in its panel cell.
+
+        Only the axis of that cell is redrawn, the other cells are left
+        untouched.
+
+        Parameters
+        ----------
+        pos_index : int
+            Linear index of the cell.
+        snapshot : np.ndarray, optional
+            (3, h, w) RGB image to plot. By default the snapshot of the
+            key-frame is used.
+        """
+
+        import microfilm.microplot
+
+        pos_row, pos_col = np.unravel_index(pos_index, self.panel.microplots.shape)
+        key_frame = self.napari_panel.key_frames[pos_index]
+        if snapshot is None:
+            snapshot = key_frame.snapshot
+
+        # add_element plots the Microimage on the cell axis, so it is only
+        # created here and not shown on its own
+        self.panel.ax[pos_row, pos_col].clear()
+        # snapshots are stored channel-first, as Microimage expects them
+        self.panel.add_element(
+            pos=[pos_row, pos_col],
+            microim=microfilm.microplot.Microimage(
+                snapshot, cmaps=['pure_red', 'pure_green', 'pure_blue'])
+        )
+        self._cell_elements[pos_row, pos_col] = key_frame
+        self._set_cell_label(pos_index)
+
+    def refresh_cells(self):
+        """Plot the cells whose key-frame changed since they were last drawn.
+
+        Returns
+        -------
+        int
+            Number of cells that were redrawn.
+        """
+
+        updated = 0
+        for i, key_frame in enumerate(self.napari_panel.key_frames):
+            if i >= self.panel.microplots.size:
+                break
+            pos_row, pos_col = np.unravel_index(i, self.panel.microplots.shape)
+            if self._cell_elements[pos_row, pos_col] is not key_frame:
+                self.set_cell(i)
+                updated += 1
+        return updated
+
+    def _update_cells(self):
+        """Bring the panel in sync with the key-frames list."""
+
+        if self._check_channel_labels.isChecked():
+            # Micropanel lays out the channel labels for the whole figure, and
+            # recreates it to make room for them, so they can't be updated
+            # for a single cell
+            self.request_preview(rebuild=True)
+            return
+
+        grid_shape = (self.numrows.value(), self.numcolumns.value())
+        resized = self.panel.microplots.shape != grid_shape
+        if resized:
+            self._resize_panel(grid_shape)
+        if self.refresh_cells() or resized:
+            self.request_preview()
+
     def add_snapshot_to_panel(self, pos_index, reuse_snapshot=False):
         """Capture a snaphot of key-frame at index pos_index and add it to panel"""
         
-        pos_row, pos_col = self.linear_to_pos_col(pos_index)
-
         if reuse_snapshot:
-            sshot = np.rollaxis(self.napari_panel.key_frames[pos_index].snapshot[:,:,0:3],2, 0)
+            self.set_cell(pos_index)
         else:
-            sshot = np.rollaxis(self.viewer.screenshot()[:,:,0:3],2, 0)
-        if self.panel:
-            self.panel.add_element(
-                pos=[pos_row, pos_col], 
-                microim = microfilm.microplot.microshow(sshot,
-                ax=self.panel.ax[pos_row,pos_col], 
-                cmaps=['pure_red', 'pure_green', 'pure_blue'])
-            )
+            self.set_cell(pos_index, snapshot=to_channel_first(self.viewer.screenshot()))
+
+    def _on_crop_to_data(self):
+        self.napari_panel.crop_to_data = self._crop_to_data.isChecked()
 
     def _change_number_rows_cols(self, value):
         """Change number of rows and columns of panel. Re-use existing panelitems."""
 
         old_num = len(self.napari_panel.key_frames)
         new_num = self.numrows.value() * self.numcolumns.value()
-        self.panel = microfilm.microplot.Micropanel(
-            self.numrows.value(), self.numcolumns.value())
         if new_num < old_num:
             for i in range(old_num, new_num, -1):
-                self.napari_panel.key_frames.remove(self.napari_panel.key_frames[i-1])
-        for i in range(self.numrows.value() * self.numcolumns.value()):
-            pos_row, pos_col = self.linear_to_pos_col(i)
-            if i<old_num:
-                self.add_snapshot_to_panel(i, reuse_snapshot=True)
-            else:
-                self.viewer.reset_view()
-                self.napari_panel.capture_panelitem(position=i, pos_panel=[pos_row, pos_col])
-        self._on_add_label()
-        self._on_show_channel_labels()
-        self.update_preview()
+                del self.napari_panel.key_frames[i-1]
+        self._add_placeholders(old_num, new_num)
+
+        # kept cells are moved, only the new ones are plotted
+        self._update_cells()
+
+    def _add_placeholders(self, start, stop):
+        """Fill cells start to stop with the reset view. The view is
+        captured once and its snapshot shared by all the new key-frames."""
+
+        if stop <= start:
+            return
+        self.viewer.reset_view()
+        self.napari_panel.capture_panelitems(
+            stop - start, position=start,
+            pos_panels=[self.linear_to_pos_col(i) for i in range(start, stop)])
+
+    def start_capture(self, steps, position=None):
+        """Capture a sequence of views with the capture queue, see
+        `CaptureQueue.start`. The cells are updated once all are captured."""
+
+        if position is None:
+            position = len(self.napari_panel.key_frames)
+        num_frames = sum(count for _, count in steps)
+        self._cancel_capture_button.setVisible(True)
+        self._enable_panel_controls(False)
+        self.capture_queue.start(
+            steps, position=position,
+            pos_panels=[self.linear_to_pos_col(i) for i in range(position, position + num_frames)])
+
+    def _enable_panel_controls(self, enabled):
+        """Enable the grid size and the save actions, which need a key-frame
+        for each cell and are disabled while a capture sequence fills them."""
+
+        for control in (
+                self.numrows, self.numcolumns, self._save_button,
+                self._save_spec_button, self._save_session_button,
+                self._load_session_button):
+            control.setEnabled(enabled)
+
+    def _check_not_capturing(self):
+        """Return whether no capture sequence is running, and ask the user
+        to wait for it otherwise."""
+
+        if self.capture_queue.is_running():
+            show_info('Wait for the capture to finish, or cancel it')
+            return False
+        return True
+
+    def _on_capture_finished(self, key_frames):
+        self._cancel_capture_button.setVisible(False)
+        self._enable_panel_controls(True)
+        if self._sweep_state is not None:
+            # cells left empty by a canceled or short sweep get placeholders
+            self._add_placeholders(
+                len(self.napari_panel.key_frames),
+                self.numrows.value() * self.numcolumns.value())
+            self._sweep_state.apply(self.viewer)
+            self._sweep_state = None
+        self._update_cells()
+        # changes made during the capture were kept until now
+        if self._panel_dirty or self._preview_dirty:
+            self.request_preview()
+
+    def capture_sweep(self, steps):
+        """Replace the key-frames by one capture per step, e.g. from
+        `NapariPanel.sweep_steps`. The number of rows is adapted to fit the
+        captures and the view is restored once they are done."""
+
+        if self.capture_queue.is_running() or not steps:
+            return
+
+        self._sweep_state = ViewerState.from_viewer(self.viewer)
+        rows = int(np.ceil(len(steps) / self.numcolumns.value()))
+        # the key-frames are replaced, so nothing is captured on resize
+        self.numrows.blockSignals(True)
+        self.numrows.setValue(rows)
+        self.numrows.blockSignals(False)
 
-    def update_preview(self):
-        """Update the preview"""
+        self.napari_panel.key_frames.clear()
+        self.start_capture(steps, position=0)
+
+    def _sweep_dims_callback(self):
+        stop = self._sweep_stop.value() or None
+        self.capture_sweep(self.napari_panel.sweep_steps(
+            self._sweep_axis.value(), self._sweep_start.value(), stop,
+            self._sweep_step.value()))
+
+    def _sweep_channels_callback(self):
+        self.capture_sweep(self.napari_panel.visibility_steps())
+
+    def request_preview(self, rebuild=False):
+        """Mark the preview as out of date and schedule a single render.
+
+        Every call restarts the idle timer, so a burst of changes results in
+        one render once the burst is over.
 
-        self.panel.savefig('temp.png')
-        self.pixmap = QPixmap('temp.png')
-        self.pixlabel.setPixmap(self.pixmap.scaledToWidth(self.pixlabel.size().width()))
+        Parameters
+        ----------
+        rebuild : bool
+            Also recreate the panel from the stored snapshots before rendering.
+        """
+
+        self._preview_dirty = True
+        self._panel_dirty = self._panel_dirty or rebuild
+        self._preview_timer.start()
+
+    def _schedule_reinitialize(self):
+        """Callback for options that require the panel to be recreated."""
+
+        self.request_preview(rebuild=True)
+
+    def flush_preview(self):
+        """Apply pending changes and render the preview immediately. While a
+        capture sequence runs, the changes are kept until it is done, as the
+        key-frames of the cells are being replaced."""
+
+        if self.capture_queue.is_running():
+            return
+        if self._panel_dirty:
+            self._panel_dirty = False
+            self.reinitialize()
+        if self._preview_dirty:
+            self._preview_dirty = False
+            self.update_preview()
+        self._preview_timer.stop()
+
+    def update_preview(self):
+        """Update the preview by rendering the panel figure in memory. A
+        snapshot of the figure is drawn on a worker thread, so that the
+        figure can be edited meanwhile, and the preview updated once it is
+        done."""
+
+        self.preview_render_count += 1
+        self._preview_generation += 1
+        generation = self._preview_generation
+
+        # the figure is drawn in 'render preview', this only times the
+        # snapshot and the dispatch
+        with profiling.span('update_preview'):
+            snapshot = figure_snapshot(self.panel.fig)
+
+            def render():
+                with profiling.span('render preview'):
+                    return render_figure_snapshot(snapshot)
+
+            self._preview_worker = create_worker(render)
+            self._preview_worker.returned.connect(
+                lambda buffer: self._set_preview(buffer, generation))
+            self._start_worker(self._preview_worker)
+
+    def _start_worker(self, worker):
+        """Run a worker on the thread pool of the widget."""
+
+        # the pool does not keep the Python worker alive while it runs
+        self._workers.add(worker)
+        worker.finished.connect(lambda: self._workers.discard(worker))
+        self._thread_pool.start(worker)
+
+    def await_workers(self, msecs=-1):
+        """Wait for the preview and cell render workers to finish.
+
+        Parameters
+        ----------
+        msecs : int
+            Maximum time to wait in ms, by default no limit.
+
+        Returns
+        -------
+        bool
+            Whether all workers finished.
+        """
+
+        return self._thread_pool.waitForDone(msecs)
+
+    def _set_preview(self, buffer, generation):
+        """Show a rendered preview, unless a more recent one is shown."""
+
+        if generation < self._shown_generation:
+            return
+        self._shown_generation = generation
+
+        # QImage does not copy the data, so the buffer has to be kept alive
+        # as long as the image and the pixmap built from it are in use
+        self._preview_buffer = buffer
+        height, width = self._preview_buffer.shape[:2]
+        self._preview_image = QImage(
+            self._preview_buffer, width, height,
+            self._preview_buffer.strides[0], QImage.Format_RGBA8888)
+        self.pixmap = QPixmap.fromImage(self._preview_image)
+        self._rescale_preview()
         if self.pixlabel.isVisible():
             self.show_preview()
 
+    def _rescale_preview(self):
+        """Fit the last rendered preview to the label width."""
+
+        if self.pixmap is not None:
+            self.pixlabel.setPixmap(self.pixmap.scaledToWidth(self.pixlabel.size().width()))
+
     def _on_resize_preview(self, event):
         """Adjust the image size to fit to the widget size."""
 
-        self.pixmap = QPixmap('temp.png')
-        self.pixlabel.setPixmap(self.pixmap.scaledToWidth(self.pixlabel.size().width()))
+        self._rescale_preview()
 
     def show_preview(self):
         """Display preview."""
@@ -345,12 +868,18 @@ class MicrofilmWidget(QWidget):
             root=self.napari_panel.key_frames, parent=self
         )
         layout.addWidget(self.PanelItemListWidget)
-        
-        self._init_panel()
 
     def _on_add_label(self):
         """Callback to add labels to each element of panel."""
 
+        labels = self._get_labels()
+        for ind in range(self.panel.microplots.size):
+            self._set_cell_label(ind, labels)
+        self.request_preview()
+
+    def _get_labels(self):
+        """Return the label of each panel element."""
+
         # Use custom label if provided otherwise use default label A, B, C, ...
         if self._label_custom.text() == "":
             labels = string.ascii_uppercase
@@ -359,18 +888,31 @@ class MicrofilmWidget(QWidget):
             diff_lab = len(self.panel.microplots.flatten()) - len(labels)
             if diff_lab > 0:
                 labels += diff_lab *'X'
-
-        # Go through each element, remove existing text and add label
-        for ind, m in enumerate(self.panel.microplots.flatten()):
-            if m is not None:
-                if len(m.ax.texts) > 0:
-                    m.ax.texts.clear()
-                if self._label_checkbox.isChecked():
-                    m.add_label(
-                        label_text=labels[ind],
-                        label_font_size=self._label_size.value(),
-                        label_color=[x/255 for x in self._label_color.currentColor().getRgb()])
-        self.update_preview()
+        return labels
+
+    def _set_cell_label(self, pos_index, labels=None):
+        """Replace the label of a single panel element. Only the label text
+        artists are touched, the image is kept. Channel labels are figure
+        texts and are not affected either."""
+
+        pos_row, pos_col = np.unravel_index(pos_index, self.panel.microplots.shape)
+        m = self.panel.microplots[pos_row, pos_col]
+        if m is None:
+            return
+
+        for text in list(m.ax.texts):
+            text.remove()
+        # microfilm re-adds stored labels whenever the element is re-plotted
+        if m.label_text is not None:
+            m.label_text.pop('default', None)
+
+        if self._label_checkbox.isChecked():
+            if labels is None:
+                labels = self._get_labels()
+            m.add_label(
+                label_text=labels[pos_index],
+                label_font_size=self._label_size.value(),
+                label_color=[x/255 for x in self._label_color.currentColor().getRgb()])
 
     def _on_show_channel_labels(self):
         """Display channel names as panel elements title. Unused"""
@@ -392,18 +934,231 @@ class MicrofilmWidget(QWidget):
                 
                 cur_layer = self.napari_panel.key_frames[i].viewer_state.layers
                 visible_layers[pos_row][pos_col] = [cur_layer[x]['name'] for x in cur_layer if cur_layer[x]['visible'] > 0]
-                layer_colors[pos_row][pos_col] = [self.viewer.layers[x].colormap.colors[-1] for x in visible_layers[pos_row][pos_col]]
+                # colormaps are part of the state, so that loaded sessions
+                # don't need the layers to be in the viewer
+                colormaps = [
+                    cur_layer[x].get('colormap') or self.viewer.layers[x].colormap
+                    for x in visible_layers[pos_row][pos_col]]
+                layer_colors[pos_row][pos_col] = [x.colors[-1] for x in colormaps]
 
             self.panel.add_channel_label(
                 channel_names=visible_layers, channel_label_size=self._channellabel_size.value()/100,
                 channel_colors=layer_colors)
-        self.update_preview()
+        self.request_preview()
 
     def save_panel(self):
-        """Save panel to file."""
-        
-        self.select_file, _ = QFileDialog.getSaveFileName(self, "Save Panel", "", "*.png")
-        self.panel.savefig(self.select_file, dpi=self._save_dpi.value())
+        """Save panel to file. The panel is saved in the background, and
+        `panel_saver.saved` is emitted once it is written.
+
+        Returns
+        -------
+        concurrent.futures.Future or None
+            Future of the saved path, None if no file was selected or if
+            cells are first rendered from the data, or while a capture
+            sequence runs.
+        """
+
+        if not self._check_not_capturing():
+            return None
+        extension = self._save_format.currentData()
+        self.select_file, _ = QFileDialog.getSaveFileName(
+            self, "Save Panel", "", f"{self._save_format.currentText()} (*.{extension})")
+        # make sure no pending change is missing from the saved figure
+        self.flush_preview()
+        if not self.select_file:
+            return None
+        if Path(self.select_file).suffix == '':
+            self.select_file += '.' + extension
+        if self._render_offscreen.isChecked():
+            self._save_offscreen(self.select_file, self._save_dpi.value())
+            return None
+        return self.panel_saver.save(
+            self.get_panel_render(), self.select_file, self._save_compression.value())
+
+    def _save_offscreen(self, path, dpi):
+        """Render each cell from its ViewerState at the size it has in the
+        saved figure, on a worker thread, then save the panel made of them."""
+
+        rows, cols = self.panel.microplots.shape
+        width, height = self.panel.fig.get_size_inches()
+        output_size = int(round(max(width / cols, height / rows) * dpi))
+        canvas_size = get_canvas_size(self.viewer)
+        data = {
+            layer.name: list(layer.data) if layer.multiscale else layer.data
+            for layer in self.viewer.layers if hasattr(layer, 'contrast_limits')
+        }
+        cells = [
+            (key_frame.viewer_state, key_frame.region)
+            for key_frame in list(self.napari_panel.key_frames)[:rows * cols]
+        ]
+
+        def render_cells():
+            return [
+                to_channel_first(self.offscreen_renderer.render(
+                    state, data, output_size, region=region, canvas_size=canvas_size))
+                for state, region in cells
+            ]
+
+        self._render_worker = create_worker(render_cells)
+        # the render description is taken now, so that later edits of the
+        # panel are not saved
+        spec = self.get_panel_spec()
+        spec.dpi = dpi
+        self._render_worker.returned.connect(
+            lambda images: self.panel_saver.save(
+                PanelRender.from_images(spec, images, self._stream_export.isChecked()),
+                path, self._save_compression.value()))
+        self._start_worker(self._render_worker)
+
+    def get_panel_render(self, images=None):
+        """Return an immutable description of the panel with the current
+        options, from which it can be saved while the panel is edited.
+
+        Parameters
+        ----------
+        images : list of np.ndarray, optional
+            Image of each cell, by default the key-frame snapshots.
+        """
+
+        spec = self.get_panel_spec()
+        if images is None:
+            images = [
+                key_frame.snapshot
+                for key_frame in list(self.napari_panel.key_frames)[:spec.rows * spec.cols]]
+        return PanelRender.from_images(spec, images, stream=self._stream_export.isChecked())
+
+    def get_panel_spec(self):
+        """Return a PanelSpec describing the current panel and options."""
+
+        rows, cols = self.numrows.value(), self.numcolumns.value()
+        width, height = self.panel.fig.get_size_inches()
+        labels = None
+        if self._label_checkbox.isChecked():
+            labels = list(self._get_labels())[:rows * cols]
+        return PanelSpec.from_panel(
+            rows, cols, self.napari_panel.key_frames,
+            labels=labels,
+            label_size=self._label_size.value(),
+            label_color=[x/255 for x in self._label_color.currentColor().getRgb()],
+            channel_labels=self._check_channel_labels.isChecked(),
+            channel_label_size=self._channellabel_size.value()/100,
+            dpi=self._save_dpi.value(),
+            cell_size=int(round(max(width / cols, height / rows) * self._save_dpi.value())),
+            canvas_size=list(get_canvas_size(self.viewer)),
+        )
+
+    def save_panel_spec(self):
+        """Save the panel spec to a JSON file used by napari-microfilm-batch."""
+
+        if not self._check_not_capturing():
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Save Panel Spec", "", "*.json")
+        if path:
+            self.get_panel_spec().to_json(path)
+
+    def get_options(self):
+        """Return the panel options as a JSON compatible dict."""
+
+        return {
+            'rows': self.numrows.value(),
+            'cols': self.numcolumns.value(),
+            'add_labels': self._label_checkbox.isChecked(),
+            'label_size': self._label_size.value(),
+            'label_color': list(self._label_color.currentColor().getRgb()),
+            'custom_labels': self._label_custom.text(),
+            'channel_labels': self._check_channel_labels.isChecked(),
+            'channel_label_size': self._channellabel_size.value(),
+            'dpi': self._save_dpi.value(),
+            'crop_to_data': self._crop_to_data.isChecked(),
+            'format': self._save_format.currentData(),
+            'compression': self._save_compression.value(),
+        }
+
+    def set_options(self, options):
+        """Set the panel options from a dict created by `get_options`. The grid
+        shape is not changed, as it depends on the key-frames."""
+
+        controls = [
+            self._label_checkbox, self._label_size, self._label_custom,
+            self._check_channel_labels, self._channellabel_size, self._save_dpi]
+        # a single rebuild is requested once all options are set
+        for control in controls:
+            control.blockSignals(True)
+        try:
+            self._label_checkbox.setChecked(options.get('add_labels', False))
+            self._label_size.setValue(options.get('label_size', 12))
+            self._label_color.setCurrentColor(QColor(*options.get('label_color', [255, 255, 255])))
+            self._label_custom.setText(options.get('custom_labels', ''))
+            self._check_channel_labels.setChecked(options.get('channel_labels', False))
+            self._channellabel_size.setValue(options.get('channel_label_size', 5))
+            self._save_dpi.setValue(options.get('dpi', 300))
+            self._crop_to_data.setChecked(options.get('crop_to_data', False))
+            self._save_format.setCurrentIndex(
+                max(self._save_format.findData(options.get('format', 'png')), 0))
+            self._save_compression.setValue(options.get('compression', 6))
+        finally:
+            for control in controls:
+                control.blockSignals(False)
+
+    def save_session(self, path, compress=False):
+        """Save the key-frames and the panel options to a session file."""
+
+        save_session(path, self.napari_panel.key_frames, self.get_options(), compress=compress)
+
+    def load_session(self, path):
+        """Replace the key-frames and the panel options by those of a session
+        file. Snapshots are only read when their cell is drawn."""
+
+        key_frames, options = load_session(path)
+        rows = options.get('rows', self.numrows.value())
+        cols = options.get('cols', self.numcolumns.value())
+
+        # the loaded key-frames fill the grid, so nothing is captured
+        for control in (self.numrows, self.numcolumns):
+            control.blockSignals(True)
+        try:
+            self.numrows.setValue(rows)
+            self.numcolumns.setValue(cols)
+        finally:
+            for control in (self.numrows, self.numcolumns):
+                control.blockSignals(False)
+
+        self.napari_panel.key_frames.clear()
+        self.napari_panel.key_frames.extend(key_frames)
+        self.set_options(options)
+        self.request_preview(rebuild=True)
+
+    def _save_session_callback(self):
+        if not self._check_not_capturing():
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Save Session", "", "*.zip")
+        if path:
+            self.save_session(path)
+
+    def _load_session_callback(self):
+        if not self._check_not_capturing():
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Load Session", "", "*.zip")
+        if path:
+            self.load_session(path)
+
+    def _on_record_timings(self):
+        profiling.enable(self._record_timings.isChecked())
+        self.update_timings()
+
+    def update_timings(self):
+        """Show the totals of the recorded timing spans."""
+
+        self._timings_label.setText(profiling.format_totals())
+
+    def _reset_timings_callback(self):
+        profiling.reset()
+        self.update_timings()
+
+    def _save_trace_callback(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Save Trace", "", "*.json")
+        if path:
+            profiling.write_chrome_trace(path)
 
     def linear_to_pos_col(self, pos_index):
         """Compute row, col from linear index"""
@@ -411,33 +1166,62 @@ class MicrofilmWidget(QWidget):
         (pos_row, pos_col) = np.unravel_index(pos_index, shape=(self.numrows.value(), self.numcolumns.value()))
         return pos_row, pos_col
     
-    def add_image_as_layer(self, event=None):
-        
-        rgb_image = [x.data for x in self.viewer.layers if x.visible]
+    def add_image_as_layer(self, event=None, lazy=None, memmap_path=None):
+        """Add the composite of the visible layers as an RGB layer.
+
+        Stacks are composited in chunks of frames on a thread pool and
+        written into a single uint8 output. In lazy mode, a dask array is
+        added instead, and only the parts napari displays get computed.
+        Data of any dimensionality is supported.
+
+        If a layer is multiscale, only the region visible in the viewer is
+        composited, at the coarsest pyramid level giving the multiscale size
+        set in the options.
+
+        Parameters
+        ----------
+        lazy : bool, optional
+            Whether to create a lazy composite. By default, the lazy
+            composite option is used.
+        memmap_path : str or Path, optional
+            If provided, the composite of a stack is written to a memory-mapped
+            .npy file at this location instead of being held in memory.
+        """
+
+        visible_layers = [x for x in self.viewer.layers if x.visible]
+        region, target_size = None, None
+        if any(x.multiscale for x in visible_layers):
+            region = camera_region(self.viewer.camera.dict(), get_canvas_size(self.viewer))
+            target_size = self._composite_size.value()
+        regions = [layer_region(x, region, target_size) for x in visible_layers]
+        rgb_image, zoom = match_shapes([x[0] for x in regions])
+        scale = np.array(visible_layers[0].scale, dtype=float)
+        translate = np.array(visible_layers[0].translate, dtype=float)
+        scale[-2:] = regions[0][1] * zoom
+        translate[-2:] = regions[0][2]
+
         contrasts = [np.array(x.contrast_limits).tolist() for x in self.viewer.layers if x.visible]
 
+        from cmap import Colormap
+
         cmaps = [Colormap(x.colormap.colors).to_matplotlib() for x in self.viewer.layers if x.visible]
 
-        if self.viewer.dims.ndim == 3:
-            rgb_sequence = []
-            for ind in range(rgb_image[0].shape[0]):
-                rgb_to_plot = np.stack([x[ind] for x in rgb_image], axis=0)
-                rgb_to_plot, _, _, _ = colorify.multichannel_to_rgb(
-                    rgb_to_plot,
-                    cmaps=cmaps,
-                    rescale_type='limits', 
-                    limits=contrasts,
-                    proj_type='sum')
-                rgb_sequence.append(rgb_to_plot)
-            rgb_sequence = np.stack(rgb_sequence, axis=0)
+        if lazy is None:
+            lazy = self._lazy_composite.isChecked()
+
+        if lazy:
+            rgb_sequence = composite_lazy(rgb_image, cmaps, contrasts)
         elif self.viewer.dims.ndim == 2:
-            rgb_sequence, _, _, _ = colorify.multichannel_to_rgb(
-                rgb_image,
-                cmaps=cmaps,
-                rescale_type='limits', 
-                limits=contrasts,
-                proj_type='sum')
+            rgb_sequence = composite_frames(rgb_image, cmaps, contrasts)
         else:
-            raise ValueError(f'Viewer dimension {self.viewer.dims.ndim} not supported')
-
-        self.viewer.add_image(rgb_sequence)
+            shape = tuple(rgb_image[0].shape) + (3,)
+            out = None
+            if memmap_path is not None:
+                out = np.lib.format.open_memmap(
+                    memmap_path, mode='w+', dtype=np.uint8, shape=shape)
+            with progress(total=shape[0], desc='Compositing frames') as pbar:
+                rgb_sequence = composite_stack(
+                    rgb_image, cmaps, contrasts, out=out, progress=pbar.update)
+
+        self.viewer.add_image(
+            rgb_sequence, rgb=True, scale=scale, translate=translate, name='rgb_sequence')
@@ -1,6 +1,8 @@
+from functools import partial
 from itertools import count
-import numpy as np
+from .composite import camera_region
 from .panel_item import PanelElement, PanelElementList
+from .utils import get_canvas_size
 
 
 class NapariPanel:
@@ -13,11 +15,14 @@ class NapariPanel:
     ----------
     key_frames : list of dict
         List of viewer state dictionaries.
+    crop_to_data : bool
+        Whether captured snapshots are cropped to the visible layers.
     """
 
     def __init__(self, viewer):
         self.viewer = viewer
         self.frame = -1
+        self.crop_to_data = False
         self.key_frames = PanelElementList()
 
         self.key_frames.events.changed.connect(self._on_panelitem_changed)
@@ -38,7 +43,11 @@ class NapariPanel:
             active frame.
         pos_panel : list, optional
             If provided, name the frame with row and column indices [row, col]
-        
+
+        Returns
+        -------
+        PanelElement
+            The captured key-frame.
         """
 
         if position is None:
@@ -51,17 +60,164 @@ class NapariPanel:
                 else:
                     raise ValueError("No selected panelitem to replace !")
 
-        new_frame = PanelElement.from_viewer(self.viewer)
-        if pos_panel is None:
-            new_frame.name = f"Key Frame {next(self._panelitem_counter)}"
-        else:
-            new_frame.name = f"Panel elem. [{pos_panel[0]}, {pos_panel[1]}]"
+        new_frame = PanelElement.from_viewer(self.viewer, crop=self.crop_to_data)
+        new_frame.name = self._frame_name(pos_panel)
 
         if insert:
             self.key_frames.insert(position + 1, new_frame)
         else:
             self.key_frames[position] = new_frame
 
+        return new_frame
+
+    def capture_panelitems(
+        self, count: int, position: int = None, pos_panels: list = None
+    ):
+        """Capture the current view once and insert it as `count` consecutive
+        key-frames sharing the same snapshot, e.g. as placeholders.
+
+        Parameters
+        ----------
+        count : int
+            Number of key-frames to insert.
+        position : int, optional
+            Index of the first inserted key-frame. By default, key-frames are
+            appended.
+        pos_panels : list, optional
+            If provided, name the frames with these [row, col] indices.
+
+        Returns
+        -------
+        list of PanelElement
+            The inserted key-frames.
+        """
+
+        if count < 1:
+            return []
+        if position is None:
+            position = len(self.key_frames)
+        if pos_panels is None:
+            pos_panels = [None] * count
+
+        first = PanelElement.from_viewer(self.viewer, crop=self.crop_to_data)
+        new_frames = [first] + [first.copy() for _ in range(count - 1)]
+        for i, (new_frame, pos_panel) in enumerate(zip(new_frames, pos_panels)):
+            new_frame.name = self._frame_name(pos_panel)
+            self.key_frames.insert(position + i, new_frame)
+
+        return new_frames
+
+    def capture_roi(self, reference: int, position: int, pos_panel: list = None):
+        """Replace a key-frame by the region shown in the viewer, cropped
+        from the snapshot of another key-frame instead of captured. The two
+        key-frames share the snapshot, e.g. for overview and zoom panels.
+
+        Parameters
+        ----------
+        reference : int
+            Index of the key-frame whose snapshot is cropped.
+        position : int
+            Index of the key-frame to replace.
+        pos_panel : list, optional
+            If provided, name the frame with row and column indices [row, col]
+
+        Returns
+        -------
+        PanelElement
+            The new key-frame.
+        """
+
+        region = camera_region(self.viewer.camera.dict(), get_canvas_size(self.viewer))
+        new_frame = self.key_frames[reference].roi(region, name=self._frame_name(pos_panel))
+        self.key_frames[position] = new_frame
+        return new_frame
+
+    def sweep_steps(self, axis: int, start: int = 0, stop: int = None, step: int = 1):
+        """Return capture steps moving through the slices of a dims axis.
+
+        Only `dims.current_step` changes between steps, so the camera and
+        the layers are kept. Steps can be run with `capture_sweep` or with a
+        CaptureQueue.
+
+        Parameters
+        ----------
+        axis : int
+            Dims axis to sweep, e.g. time or z.
+        start, stop, step : int
+            Range of slices, by default all the slices of the axis.
+
+        Returns
+        -------
+        list of (callable, int)
+            Capture steps, one key-frame per slice.
+        """
+
+        if stop is None:
+            stop = int(self.viewer.dims.nsteps[axis])
+        return [(partial(_set_current_step, axis=axis, value=value), 1)
+                for value in range(start, stop, step)]
+
+    def visibility_steps(self, combinations: list = None):
+        """Return capture steps showing combinations of layers, e.g. for a
+        per-channel montage. The camera and dims are kept.
+
+        Parameters
+        ----------
+        combinations : list of list of str, optional
+            Names of the layers shown in each step. By default each visible
+            layer alone, followed by all of them together.
+
+        Returns
+        -------
+        list of (callable, int)
+            Capture steps, one key-frame per combination.
+        """
+
+        if combinations is None:
+            visible = [layer.name for layer in self.viewer.layers if layer.visible]
+            combinations = [[name] for name in visible]
+            if len(visible) > 1:
+                combinations.append(visible)
+        return [(partial(_set_visible_layers, names=list(names)), 1)
+                for names in combinations]
+
+    def capture_sweep(self, steps, position: int = None, pos_panels: list = None):
+        """Run capture steps synchronously and insert the captured key-frames.
+
+        Parameters
+        ----------
+        steps : list of (callable or None, int)
+            Capture steps, e.g. from `sweep_steps` or `visibility_steps`.
+        position : int, optional
+            Index of the first captured key-frame. By default, key-frames are
+            appended.
+        pos_panels : list, optional
+            [row, col] of each captured key-frame, used to name them.
+
+        Returns
+        -------
+        list of PanelElement
+            The captured key-frames.
+        """
+
+        if position is None:
+            position = len(self.key_frames)
+        new_frames = []
+        for prepare, num_frames in steps:
+            if prepare is not None:
+                prepare(self.viewer)
+            names = None
+            if pos_panels is not None:
+                names = pos_panels[len(new_frames):len(new_frames) + num_frames]
+            new_frames.extend(self.capture_panelitems(
+                num_frames, position=position + len(new_frames), pos_panels=names))
+        return new_frames
+
+    def _frame_name(self, pos_panel=None):
+        if pos_panel is None:
+            return f"Key Frame {next(self._panelitem_counter)}"
+        return f"Panel elem. [{pos_panel[0]}, {pos_panel[1]}]"
+
     def set_to_panelitem(self, frame: int):
         """Set the viewer to a given key-frame
         Parameters
@@ -76,17 +232,21 @@ class NapariPanel:
         self.key_frames.selection.active = event.value
 
     def update_viewer(self, panelitem_index):
+        """Set the viewer to the state of a key-frame, changing only the
+        camera, dims and layer attributes that differ."""
 
-        self.viewer.camera.update(self.key_frames[panelitem_index].viewer_state.camera)
-        self.viewer.dims.update(self.key_frames[panelitem_index].viewer_state.dims)
+        self.key_frames[panelitem_index].viewer_state.apply(self.viewer)
 
-        for layer_name, layer_state in self.key_frames[panelitem_index].viewer_state.layers.items():
-            layer = self.viewer.layers[layer_name]
-            for key, value in layer_state.items():
-                original_value = getattr(layer, key)
-                # Only set if value differs to avoid expensive redraws
-                if not np.array_equal(original_value, value):
-                    setattr(layer, key, value)
 
+def _set_current_step(viewer, axis, value):
+    viewer.dims.set_current_step(axis, value)
 
 
+def _set_visible_layers(viewer, names):
+    # layers are hidden first, so that shown layers are not drawn with them
+    for layer in viewer.layers:
+        if layer.name not in names:
+            layer.visible = False
+    for layer in viewer.layers:
+        if layer.name in names:
+            layer.visible = True
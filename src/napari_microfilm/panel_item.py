@@ -1,16 +1,83 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import hashlib
+import weakref
+from dataclasses import dataclass, field
+from enum import Enum
+from functools import cached_property
 from typing import TYPE_CHECKING
 
 import numpy as np
-from napari.utils.events import SelectableEventedList
 
-from .utils import make_thumbnail
+from . import profiling
+from .composite import camera_region, crop_box
+from .snapshot_store import SnapshotStore, get_snapshot_store
+from .state_diff import apply_state
+from .utils import get_canvas_size, get_data_region, make_thumbnail, to_channel_first
 
 if TYPE_CHECKING:
     import napari
 
+# display attributes of image layers stored in addition to the base state,
+# needed to render a state without the viewer
+IMAGE_DISPLAY_KEYS = ("contrast_limits", "colormap", "gamma")
+# entries of the base state that are not needed to display a layer and can
+# be large. Data is referred to by identity in ViewerState.data_refs instead.
+NON_DISPLAY_KEYS = ("metadata", "data", "features", "properties")
+
+
+def data_ref(data, multiscale=False) -> tuple:
+    """Return a token identifying layer data without copying it: the id,
+    shape and dtype of the array, or of each level of multiscale data."""
+    if multiscale:
+        return tuple(data_ref(level) for level in data)
+    return (id(data), tuple(np.shape(data)), str(getattr(data, "dtype", "")))
+
+
+def _update_hash(h, value):
+    """Feed a structural representation of `value` to the hash object `h`."""
+    if isinstance(value, dict):
+        h.update(b"d")
+        for key in sorted(value, key=str):
+            _update_hash(h, key)
+            _update_hash(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(b"l")
+        for item in value:
+            _update_hash(h, item)
+    elif isinstance(value, np.ndarray):
+        h.update(f"a{value.dtype.str}{value.shape}".encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif hasattr(value, "colors"):
+        # colormaps
+        h.update(f"c{getattr(value, 'name', '')}".encode())
+        _update_hash(h, np.asarray(value.colors))
+    else:
+        h.update(repr(value).encode())
+
+
+def _to_json_compatible(value):
+    """Convert the values of a viewer state to JSON compatible types."""
+    if isinstance(value, dict):
+        return {str(k): _to_json_compatible(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json_compatible(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, Enum):
+        return value.value
+    if hasattr(value, "colors"):
+        return {
+            "name": getattr(value, "name", None),
+            "colors": np.asarray(value.colors).tolist(),
+            "controls": np.asarray(getattr(value, "controls", [])).tolist(),
+        }
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
 
 @dataclass(frozen=True)
 class ViewerState:
@@ -22,24 +89,46 @@ class ViewerState:
     dims : dict
         The state of the `napari.components.Dims` in the viewer.
     layers : dict
-        A map of layer.name -> _base_state for each layer in the viewer
-        (excluding metadata).
+        A map of layer.name -> _base_state for each layer in the viewer,
+        restricted to display attributes (no metadata nor data). For image
+        layers, the contrast limits, colormap and gamma are added.
+    data_refs : dict, optional
+        A map of layer.name -> token identifying the layer data, see
+        `data_ref`. Not serialized.
+
+    The content of a state must not be modified after creation: its digest
+    is computed once and used for hashing and equality.
     """
 
     camera: dict
     dims: dict
     layers: dict
+    data_refs: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        # computed once, so that comparisons and hashing are O(1)
+        self.digest
 
     @classmethod
     def from_viewer(cls, viewer: napari.viewer.Viewer):
         """Create a ViewerState from a viewer instance."""
-        layers = {
-            layer.name: layer._get_base_state() for layer in viewer.layers
-        }
-        for d in layers.values():
-            d.pop("metadata")
+        layers = {}
+        for layer in viewer.layers:
+            state = layer._get_base_state()
+            for key in NON_DISPLAY_KEYS:
+                state.pop(key, None)
+            for key in IMAGE_DISPLAY_KEYS:
+                if hasattr(layer, key):
+                    state[key] = getattr(layer, key)
+            layers[layer.name] = state
         return cls(
-            camera=viewer.camera.dict(), dims=viewer.dims.dict(), layers=layers
+            camera=viewer.camera.dict(),
+            dims=viewer.dims.dict(),
+            layers=layers,
+            data_refs={
+                layer.name: data_ref(layer.data, getattr(layer, "multiscale", False))
+                for layer in viewer.layers
+            },
         )
 
     def apply(self, viewer: napari.viewer.Viewer):
@@ -50,16 +139,22 @@ class ViewerState:
             A napari viewer. (viewer state will be directly modified)
         """
 
-        viewer.camera.update(self.camera)
-        viewer.dims.update(self.dims)
+        # only what differs is set, to avoid expensive redraws
+        with profiling.span("ViewerState.apply"):
+            apply_state(viewer, self)
 
-        for layer_name, layer_state in self.layers.items():
-            layer = viewer.layers[layer_name]
-            for key, value in layer_state.items():
-                original_value = getattr(layer, key)
-                # Only set if value differs to avoid expensive redraws
-                if not np.array_equal(original_value, value):
-                    setattr(layer, key, value)
+    def zoomed(self, region, roi_region) -> ViewerState:
+        """Return the state with the camera moved from showing the world
+        `region` to showing `roi_region`, [[y0, x0], [y1, x1]] each."""
+        region = np.asarray(region, dtype=float)
+        roi_region = np.asarray(roi_region, dtype=float)
+        center = list(self.camera["center"])
+        center[-2:] = roi_region.mean(axis=0)
+        zoom = self.camera["zoom"] * np.min(
+            (region[1] - region[0]) / (roi_region[1] - roi_region[0]))
+        return ViewerState(
+            camera={**self.camera, "center": tuple(center), "zoom": float(zoom)},
+            dims=self.dims, layers=self.layers, data_refs=self.data_refs)
 
     def render(
         self, viewer: napari.viewer.Viewer, canvas_only=True
@@ -80,13 +175,62 @@ class ViewerState:
         self.apply(viewer)
         return viewer.screenshot(canvas_only=canvas_only)
 
+    def to_dict(self) -> dict:
+        """Return the state as a dict of JSON compatible values. Colormaps
+        are stored as dicts with name, colors and controls."""
+        return _to_json_compatible(
+            {"camera": self.camera, "dims": self.dims, "layers": self.layers}
+        )
+
+    @classmethod
+    def from_dict(cls, state: dict, restore=True):
+        """Create a ViewerState from a dict created by `to_dict`.
+
+        Parameters
+        ----------
+        state : dict
+            Dict with camera, dims and layers entries.
+        restore : bool
+            Whether to turn colormap dicts and unit names back into napari
+            colormaps and pint units, so that the state can be applied to a
+            viewer. Rendering with `render_state` works in both cases.
+        """
+        dims = dict(state["dims"])
+        layers = {name: dict(layer) for name, layer in state["layers"].items()}
+        if restore:
+            import pint
+            from napari.utils.colormaps import Colormap
+
+            registry = pint.get_application_registry()
+            if dims.get("units") is not None:
+                dims["units"] = tuple(registry(u).units for u in dims["units"])
+            for layer in layers.values():
+                if layer.get("units") is not None:
+                    layer["units"] = tuple(
+                        registry(u).units for u in layer["units"]
+                    )
+                colormap = layer.get("colormap")
+                if isinstance(colormap, dict):
+                    layer["colormap"] = Colormap(
+                        colors=colormap["colors"],
+                        controls=colormap["controls"] or None,
+                        name=colormap["name"] or "custom",
+                    )
+        return cls(camera=dict(state["camera"]), dims=dims, layers=layers)
+
+    @cached_property
+    def digest(self) -> str:
+        """Hash of the content of the state, e.g. to use as a cache key."""
+        h = hashlib.blake2b(digest_size=16)
+        _update_hash(h, (self.camera, self.dims, self.layers, self.data_refs))
+        return h.hexdigest()
+
+    def __hash__(self):
+        return hash(self.digest)
+
     def __eq__(self, other):
         if isinstance(other, ViewerState):
-            return (
-                self.camera == other.camera
-                and self.dims == other.dims
-                and self.layers == other.layers
-            )
+            return self.digest == other.digest
         else:
             return False
 
@@ -99,51 +243,192 @@ class PanelElement:
     ----------
     viewer_state : ViewerState
         The state of the viewer at this keyframe.
-    thumbnail : np.ndarray
-        A thumbnail representing this keyframe.
-    snapshot: np.ndarray
-        The snapshot corresponding to the view
+    snapshot_key : str
+        Key of the snapshot corresponding to the view in `store`. Snapshots
+        are stored as contiguous (3, h, w) uint8 RGB arrays.
     name : str
         A name for the keyframe.
+    thumbnail : np.ndarray, optional
+        A thumbnail representing this keyframe. If None, it is created from
+        the snapshot the first time `get_thumbnail` is called.
+    region : np.ndarray, optional
+        [[y0, x0], [y1, x1]] world bounding box shown by the snapshot.
+    store : SnapshotStore, optional
+        Store holding the snapshot. By default the store returned by
+        `get_snapshot_store`.
+    crop : tuple of int, optional
+        (row0, row1, col0, col1) rectangle of the stored snapshot shown by
+        the element, e.g. for a region of interest of another element
+        (see `roi`). By default the whole snapshot.
     """
 
     viewer_state: ViewerState
-    thumbnail: np.ndarray
-    snapshot: np.ndarray
+    snapshot_key: str
     name: str = "PanelElement"
+    thumbnail: np.ndarray = field(default=None, repr=False)
+    region: np.ndarray = field(default=None, repr=False)
+    store: SnapshotStore = field(default=None, repr=False)
+    crop: tuple = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.store is None:
+            self.store = get_snapshot_store()
+        # free the snapshot once the element is garbage collected
+        weakref.finalize(self, self.store.release, self.snapshot_key)
 
     def __str__(self):
         return self.name
 
+    @property
+    def snapshot(self) -> np.ndarray:
+        """The snapshot corresponding to the view, loaded from the store.
+        Cropped elements return a view of the stored snapshot."""
+        snapshot = self.store.get(self.snapshot_key)
+        if self.crop is not None:
+            row0, row1, col0, col1 = self.crop
+            snapshot = snapshot[:, row0:row1, col0:col1]
+        return snapshot
+
+    def copy(self, name: str = None) -> PanelElement:
+        """Return a new element with the same state sharing the snapshot."""
+        self.store.retain(self.snapshot_key)
+        return PanelElement(
+            viewer_state=self.viewer_state,
+            snapshot_key=self.snapshot_key,
+            name=self.name if name is None else name,
+            thumbnail=self.thumbnail,
+            region=self.region,
+            store=self.store,
+            crop=self.crop,
+        )
+
+    def roi(self, region, name: str = None) -> PanelElement:
+        """Return an element showing a region of interest of this one. It
+        is cropped from the snapshot of this element, which it shares.
+
+        Parameters
+        ----------
+        region : array-like
+            [[y0, x0], [y1, x1]] world region of interest. It is rounded
+            outwards to whole snapshot pixels.
+        name : str, optional
+            Name of the new element, by default the name of this one.
+        """
+        if self.region is None:
+            raise ValueError(f"{self.name} has no region to take a region of interest from")
+        box = crop_box(self.region, region, self.snapshot.shape[1:])
+        if box is None:
+            raise ValueError(f"The region of interest is outside of {self.name}")
+        (rows, cols), roi_region = box
+        row0, col0 = (0, 0) if self.crop is None else (self.crop[0], self.crop[2])
+        crop = (row0 + rows.start, row0 + rows.stop, col0 + cols.start, col0 + cols.stop)
+
+        self.store.retain(self.snapshot_key)
+        return PanelElement(
+            viewer_state=self.viewer_state.zoomed(self.region, roi_region),
+            snapshot_key=self.snapshot_key,
+            name=self.name if name is None else name,
+            region=roi_region,
+            store=self.store,
+            crop=tuple(int(x) for x in crop),
+        )
+
+    def get_thumbnail(self) -> np.ndarray:
+        """Return the thumbnail, creating it on first use."""
+        if self.thumbnail is None:
+            self.thumbnail = make_thumbnail(self.snapshot)
+        return self.thumbnail
+
     @classmethod
     def from_viewer(
-        cls, viewer: napari.viewer.Viewer
+        cls,
+        viewer: napari.viewer.Viewer,
+        snapshot: np.ndarray = None,
+        store: SnapshotStore = None,
+        crop: bool = False,
     ):
-        """Create a PanelElement from a viewer instance."""
+        """Create a PanelElement from a viewer instance.
+
+        A single screenshot feeds both the snapshot and, lazily, the
+        thumbnail.
+
+        Parameters
+        ----------
+        viewer : napari.viewer.Viewer
+            A napari viewer.
+        snapshot : np.ndarray, optional
+            An already captured screenshot of the viewer canvas. If None,
+            the canvas is captured.
+        store : SnapshotStore, optional
+            Store in which the snapshot is kept. By default the store
+            returned by `get_snapshot_store`.
+        crop : bool
+            Whether to crop the snapshot to the visible layers, dropping
+            the empty canvas around them. The box is computed from the
+            camera and the layer extents, and only in 2D.
+        """
+        if snapshot is None:
+            with profiling.span("screenshot"):
+                snapshot = viewer.screenshot(canvas_only=True)
+        if store is None:
+            store = get_snapshot_store()
+        viewer_state = ViewerState.from_viewer(viewer)
+        region = camera_region(viewer_state.camera, get_canvas_size(viewer))
+
+        if crop and viewer.dims.ndisplay == 2:
+            data_region = get_data_region(viewer)
+            # the screenshot can be larger than the canvas, e.g. on HiDPI
+            # screens, so the box is computed in screenshot pixels
+            box = None if data_region is None else crop_box(region, data_region, snapshot.shape)
+            if box is not None:
+                (rows, cols), region = box
+                snapshot = snapshot[rows, cols]
+
         return cls(
-            viewer_state=ViewerState.from_viewer(viewer),
-            thumbnail=make_thumbnail(viewer.screenshot(canvas_only=True)),
-            snapshot=viewer.screenshot(canvas_only=True),
+            viewer_state=viewer_state,
+            snapshot_key=store.put(to_channel_first(snapshot)),
+            region=region,
+            store=store,
         )
 
     def __repr__(self) -> str:
         return f"<PanelElement: {self.name}>"
 
+    @cached_property
+    def digest(self) -> str:
+        """Hash of the content of the element, its state and snapshot. Two
+        elements with the same digest render the same cell."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.viewer_state.digest.encode())
+        h.update(f"{id(self.store)}:{self.snapshot_key}:{self.crop}".encode())
+        return h.hexdigest()
+
     def __hash__(self) -> int:
         return id(self)
 
     def __eq__(self, other):
-        if isinstance(other, PanelElement):
-            return (
-                self.__hash__() == other.__hash__()
-                and self.viewer_state == other.viewer_state
-                and (self.thumbnail == other.thumbnail).all()
-                and (self.snapshot == other.snapshot).all()
-            )
-        else:
-            return False
+        # elements are distinct items of the panel even with the same
+        # content, so that list operations find the exact element without
+        # comparing states or snapshots. Use `digest` to compare content.
+        return self is other
+
+
+def _make_panel_element_list():
+    # napari's evented lists take most of the import time of napari, they are
+    # only needed by the widget and NapariPanel, not by sessions or batches
+    from napari.utils.events import SelectableEventedList
+
+    class PanelElementList(SelectableEventedList[PanelElement]):
+        def __init__(self) -> None:
+            super().__init__(basetype=PanelElement)
+
+    PanelElementList.__module__ = __name__
+    PanelElementList.__qualname__ = "PanelElementList"
+    return PanelElementList
 
 
-class PanelElementList(SelectableEventedList[PanelElement]):
-    def __init__(self) -> None:
-        super().__init__(basetype=PanelElement)
\ No newline at end of file
+def __getattr__(name):
+    if name == "PanelElementList":
+        globals()[name] = _make_panel_element_list()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -1,10 +1,47 @@
+import weakref
+
 from napari._qt.containers import QtListModel, QtListView
 from qtpy.QtCore import QModelIndex, QSize, Qt
-from qtpy.QtGui import QImage
+from qtpy.QtGui import QImage, QPixmap
 
 
 class PanelItemModel(QtListModel):
-    """Model for QtListView of PanelElements"""
+    """Model for QtListView of PanelElements
+
+    Thumbnails are only built here, on the GUI thread, the first time an
+    element is shown. Pixmaps are cached per PanelElement and snapshot, and
+    shared by the elements showing the same snapshot, e.g. placeholders, so
+    that they are built once for each captured snapshot and not on every
+    repaint of the list.
+    """
+
+    def __init__(self, root, parent=None):
+        super().__init__(root, parent=parent)
+        # PanelElement -> (snapshot key and crop, QPixmap)
+        self._thumbnails = weakref.WeakKeyDictionary()
+        # snapshot key and crop -> QPixmap, while an element shows it
+        self._shared_thumbnails = weakref.WeakValueDictionary()
+
+    def _get_thumbnail(self, key_frame):
+        """Return the cached thumbnail pixmap of `key_frame`."""
+        key = (key_frame.snapshot_key, key_frame.crop)
+        cached = self._thumbnails.get(key_frame)
+        if cached is None or cached[0] != key:
+            pixmap = self._shared_thumbnails.get(key)
+            if pixmap is None:
+                thumbnail = key_frame.get_thumbnail()
+                pixmap = QPixmap.fromImage(
+                    QImage(
+                        thumbnail,
+                        thumbnail.shape[1],
+                        thumbnail.shape[0],
+                        QImage.Format_RGBA8888,
+                    )
+                )
+                self._shared_thumbnails[key] = pixmap
+            cached = (key, pixmap)
+            self._thumbnails[key_frame] = cached
+        return cached[1]
 
     def data(self, index: QModelIndex, role: Qt.ItemDataRole):
         """Return data at `index` for the requested `role`.
@@ -13,13 +50,7 @@ class PanelItemModel(QtListModel):
         if role == Qt.EditRole:
             return index.data(Qt.UserRole).name
         if role == Qt.DecorationRole:  # thumbnail
-            key_frame = index.data(Qt.UserRole)
-            return QImage(
-                key_frame.thumbnail,
-                key_frame.thumbnail.shape[1],
-                key_frame.thumbnail.shape[0],
-                QImage.Format_RGBA8888,
-            )
+            return self._get_thumbnail(index.data(Qt.UserRole))
         if role == Qt.SizeHintRole:  # determines size of item
             return QSize(160, 34)
         return super().data(index, role)
@@ -10,8 +10,10 @@ class PanelElementListControlWidget(QFrame):
 
         layout = QHBoxLayout()
         self.captureButton = PanelElementCaptureButton(self.napari_panel)
+        self.roiButton = PanelElementROIButton(self.napari_panel)
         self.deleteButton = PanelElementDeleteButton(self.napari_panel)
         layout.addWidget(self.captureButton)
+        layout.addWidget(self.roiButton)
         layout.addWidget(self.deleteButton)
 
         self.setLayout(layout)
@@ -25,6 +27,18 @@ class PanelElementCaptureButton(QPushButton):
         self.setToolTip("Capture key-frame")
         self.setText("Capture")
 
+
+class PanelElementROIButton(QPushButton):
+    def __init__(self, napari_panel):
+        super().__init__()
+
+        self.napari_panel = napari_panel
+        self.setToolTip(
+            "Replace selected key-frame by the current view, cropped from "
+            "the snapshot of the reference cell")
+        self.setText("Capture ROI")
+
+
 class PanelElementDeleteButton(QPushButton):
     def __init__(self, napari_panel):
         super().__init__()
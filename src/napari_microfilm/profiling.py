@@ -0,0 +1,119 @@
+"""
+This module implements an opt-in instrumentation of the hot paths of the
+plugin (screenshots, thumbnails, panel construction, preview rendering, state
+application, compositing and saving). When enabled, each span is timed and
+counted; totals are available with `get_totals` and the spans can be written
+as a Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+
+    from napari_microfilm import profiling
+
+    profiling.enable()
+    ...
+    print(profiling.get_totals())
+    profiling.write_chrome_trace('trace.json')
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# spans kept for the trace, older ones are dropped
+MAX_EVENTS = 100000
+
+_enabled = False
+_lock = threading.Lock()
+_events = []
+_totals = {}
+
+
+def enable(enabled=True):
+    """Start (or stop, with enabled=False) recording spans."""
+    global _enabled
+    _enabled = enabled
+
+
+def disable():
+    """Stop recording spans. Recorded spans are kept."""
+    enable(False)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """Drop all recorded spans and totals."""
+    with _lock:
+        _events.clear()
+        _totals.clear()
+
+
+def _record(name, start, duration):
+    with _lock:
+        count, total = _totals.get(name, (0, 0.0))
+        _totals[name] = (count + 1, total + duration)
+        _events.append((name, start, duration, threading.get_ident()))
+        if len(_events) > MAX_EVENTS:
+            del _events[:len(_events) - MAX_EVENTS]
+
+
+@contextmanager
+def span(name: str):
+    """Time the enclosed block as a span called `name`, if enabled."""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, start, time.perf_counter() - start)
+
+
+def timed(name: str):
+    """Decorator timing each call of a function as a span called `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_totals() -> dict:
+    """Return a map of span name -> dict with the count, total and mean
+    duration in seconds of the recorded spans."""
+    with _lock:
+        return {
+            name: {'count': count, 'total': total, 'mean': total / count}
+            for name, (count, total) in sorted(_totals.items())
+        }
+
+
+def format_totals() -> str:
+    """Return the totals as a text table, slowest spans first."""
+    totals = sorted(get_totals().items(), key=lambda x: -x[1]['total'])
+    return '\n'.join(
+        f"{name}: {x['count']} x {1000 * x['mean']:.1f} ms = {x['total']:.3f} s"
+        for name, x in totals)
+
+
+def write_chrome_trace(path):
+    """Write the recorded spans as a Chrome trace JSON file."""
+    pid = os.getpid()
+    with _lock:
+        events = [
+            {
+                'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': start * 1e6, 'dur': duration * 1e6,
+            }
+            for name, start, duration, tid in _events
+        ]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,224 @@
+"""
+This module implements the offscreen rendering of panel elements. Instead of
+using a screenshot, a cell is regenerated from its ViewerState by compositing
+the raw layer data at the requested output size, which makes the result
+independent of the screen resolution.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from . import profiling
+from .composite import camera_region, composite_frames, select_level
+
+
+def to_matplotlib_colormap(colormap):
+    """Convert a colormap to a matplotlib colormap.
+
+    Parameters
+    ----------
+    colormap : napari Colormap, dict, array-like or str
+        A napari colormap, a dict with a 'colors' entry, an (N, 3|4) array of
+        colors or a colormap name known to cmap.
+    """
+    from cmap import Colormap
+
+    if hasattr(colormap, 'colors'):
+        colormap = colormap.colors
+    elif isinstance(colormap, dict):
+        colormap = colormap['colors']
+    if not isinstance(colormap, str):
+        colormap = np.asarray(colormap)
+    return Colormap(colormap).to_matplotlib()
+
+
+def is_image_state(layer_state: dict) -> bool:
+    """Whether a layer state has the display attributes of an image layer.
+    Other layers, e.g. points or shapes, are not rendered."""
+
+    return 'contrast_limits' in layer_state and 'colormap' in layer_state
+
+
+def _displayed_axes(dims: dict, ndim: int) -> list:
+    """Return the layer axes displayed as rows and columns."""
+
+    # layers are aligned to the last dimensions of the viewer
+    return [d - (len(dims['order']) - ndim) for d in dims['order'][-2:]]
+
+
+def _data_index(dims: dict, shape: tuple, scale, translate, name: str = '') -> tuple:
+    """Return the index of the displayed plane in a layer of the given shape.
+
+    Raises a ValueError if the dims position is outside of the layer, e.g.
+    when a spec saved on a longer dataset is applied to a shorter one.
+    """
+
+    ndim = len(shape)
+
+    if dims.get('point') is not None:
+        point = np.asarray(dims['point'], dtype=float)
+    else:
+        ranges = np.asarray(dims['range'], dtype=float)
+        point = ranges[:, 0] + np.asarray(dims['current_step']) * ranges[:, 2]
+    point = point[-ndim:]
+    displayed = _displayed_axes(dims, ndim)
+
+    index = []
+    for axis in range(ndim):
+        if axis in displayed:
+            index.append(slice(None))
+        else:
+            position = int(np.round((point[axis] - translate[axis]) / scale[axis]))
+            if not 0 <= position < shape[axis]:
+                raise ValueError(
+                    f"Plane {position} of axis {axis} is outside of layer "
+                    f"'{name}' of shape {tuple(shape)}")
+            index.append(position)
+    return tuple(index)
+
+
+@profiling.timed('render_state')
+def render_state(viewer_state, data: dict, output_size: int, region=None, canvas_size=None):
+    """Render a ViewerState from raw layer data.
+
+    Visible image layers are sliced at the dims position of the state,
+    cropped to the region, resampled with nearest neighbours to the output
+    size and composited with their contrast limits and colormaps. For
+    multiscale data, the coarsest level reaching the output size is read.
+
+    Parameters
+    ----------
+    viewer_state : ViewerState
+        State to render.
+    data : dict
+        Map of layer name -> layer data. Multiscale data is given as a list
+        of arrays, full resolution first.
+    output_size : int
+        Number of pixels along the longest side of the output.
+    region : array-like, optional
+        [[y0, x0], [y1, x1]] world bounding box to render. By default the
+        region displayed by the camera on a canvas of size `canvas_size`.
+    canvas_size : tuple, optional
+        (height, width) of the canvas, used if region is None.
+
+    Returns
+    -------
+    np.ndarray
+        (h, w, 3) uint8 RGB image.
+    """
+
+    if region is None:
+        region = camera_region(viewer_state.camera, canvas_size)
+    region = np.asarray(region, dtype=float)
+    extent = region[1] - region[0]
+    out_shape = np.maximum(np.round(extent / extent.max() * output_size), 1).astype(int)
+    # world coordinates of the output pixel centers
+    out_y = region[0, 0] + (np.arange(out_shape[0]) + 0.5) * extent[0] / out_shape[0]
+    out_x = region[0, 1] + (np.arange(out_shape[1]) + 0.5) * extent[1] / out_shape[1]
+
+    channels, cmaps, limits = [], [], []
+    for name, layer_state in viewer_state.layers.items():
+        if not layer_state.get('visible') or name not in data:
+            continue
+        if not is_image_state(layer_state):
+            continue
+
+        levels = data[name] if isinstance(data[name], (list, tuple)) else [data[name]]
+        ndim = levels[0].ndim
+        scale = np.asarray(layer_state.get('scale', np.ones(ndim)), dtype=float)
+        translate = np.asarray(layer_state.get('translate', np.zeros(ndim)), dtype=float)
+        displayed = _displayed_axes(viewer_state.dims, ndim)
+
+        # pick the pyramid level and the pixels of that level to read
+        factors = np.array([np.divide(levels[0].shape, x.shape) for x in levels])[:, displayed]
+        level = select_level(factors, extent / scale[displayed], output_size)
+        level_scale = scale[displayed] * factors[level]
+        plane = levels[level][_data_index(viewer_state.dims, levels[0].shape, scale, translate, name)]
+        if displayed[0] > displayed[1]:
+            plane = plane.T
+        # napari puts pixel centers at translate + index * scale, so each
+        # output pixel takes the data pixel with the nearest center
+        rows = np.floor((out_y - translate[displayed[0]]) / level_scale[0] + 0.5).astype(int)
+        cols = np.floor((out_x - translate[displayed[1]]) / level_scale[1] + 0.5).astype(int)
+        valid_rows = (rows >= 0) & (rows < plane.shape[0])
+        valid_cols = (cols >= 0) & (cols < plane.shape[1])
+        if not (valid_rows.any() and valid_cols.any()):
+            plane_data = np.zeros(tuple(out_shape))
+        else:
+            # only read the bounding box of the pixels that are needed
+            r0, r1 = rows[valid_rows].min(), rows[valid_rows].max() + 1
+            c0, c1 = cols[valid_cols].min(), cols[valid_cols].max() + 1
+            block = np.asarray(plane[r0:r1, c0:c1])
+            plane_data = block[
+                np.clip(rows - r0, 0, r1 - r0 - 1)[:, None],
+                np.clip(cols - c0, 0, c1 - c0 - 1)[None, :]]
+        # pixels outside of the layer are displayed as the lowest value
+        vmin = layer_state['contrast_limits'][0]
+        plane_data = np.where(valid_rows[:, None] & valid_cols[None, :], plane_data, vmin)
+
+        channels.append(plane_data)
+        cmaps.append(to_matplotlib_colormap(layer_state['colormap']))
+        limits.append(np.asarray(layer_state['contrast_limits'], dtype=float).tolist())
+
+    if not channels:
+        return np.zeros(tuple(out_shape) + (3,), dtype=np.uint8)
+    return composite_frames(channels, cmaps, limits)
+
+
+def _data_token(value):
+    """Identity of layer data used in cache keys."""
+    if isinstance(value, (list, tuple)):
+        return tuple(id(x) for x in value)
+    return id(value)
+
+
+class OffscreenRenderer:
+    """Render ViewerStates with render_state and cache the results.
+
+    Results are cached by state digest, output size, region and identity of
+    the layer data, with least recently used entries dropped beyond
+    `maxsize`. Entries keep a reference to their layer data, so that its
+    identity is not reused by other data while they are cached. The
+    renderer can be used from worker threads.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of cached renders.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, viewer_state, data: dict, output_size: int, region=None, canvas_size=None):
+        """Render a ViewerState, see `render_state`."""
+
+        region_key = None if region is None else np.asarray(region, dtype=float).tobytes()
+        key = (
+            viewer_state.digest,
+            output_size,
+            region_key,
+            None if canvas_size is None else tuple(canvas_size),
+            tuple((name, _data_token(value)) for name, value in data.items()),
+        )
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key][0]
+
+        image = render_state(viewer_state, data, output_size, region, canvas_size)
+
+        with self._lock:
+            self._cache[key] = (image, tuple(data.values()))
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return image
+
+    def clear(self):
+        """Drop all cached renders."""
+        with self._lock:
+            self._cache.clear()
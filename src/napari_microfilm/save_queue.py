@@ -0,0 +1,132 @@
+"""
+This module implements the saving of panels in the background. The panel is
+described by an immutable PanelRender, and the figure is built, drawn and
+encoded in a separate process, so that neither the rendering nor the
+compression hold the GUI thread or the GIL of napari. The cell images are
+copied once to shared memory rather than pickled to the process.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from qtpy.QtCore import QObject, Signal
+
+from .export import PanelRender, save_render
+
+
+def _share_image(image, segments):
+    """Copy an image to a new shared memory segment, appended to segments,
+    and return the (name, shape, dtype) from which a process reads it."""
+
+    segment = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+    segments.append(segment)
+    np.ndarray(image.shape, image.dtype, buffer=segment.buf)[...] = image
+    return segment.name, image.shape, image.dtype.str
+
+
+def _release(segments):
+    """Free the shared memory segments of a save."""
+    for segment in segments:
+        segment.close()
+        segment.unlink()
+
+
+def _save_job(spec, shared_images, stream, path, compress_level):
+    """Save the PanelRender of images in shared memory in a worker process."""
+    import matplotlib
+
+    # workers have no display
+    matplotlib.use("Agg")
+    segments = [shared_memory.SharedMemory(name) for name, _, _ in shared_images]
+    try:
+        render = PanelRender.from_images(spec, [
+            np.ndarray(shape, dtype, buffer=segment.buf)
+            for segment, (_, shape, dtype) in zip(segments, shared_images)], stream)
+        path = save_render(render, path, compress_level)
+        del render
+        return str(path)
+    finally:
+        for segment in segments:
+            try:
+                segment.close()
+            except BufferError:
+                # images still referenced, e.g. by a traceback, keep the
+                # segment mapped until they are collected
+                pass
+
+
+class PanelSaver(QObject):
+    """Save PanelRenders in a worker process.
+
+    Parameters
+    ----------
+    parent : QObject, optional
+        Qt parent.
+
+    Signals
+    -------
+    saved(str)
+        Emitted with the path of each saved file.
+    failed(str, str)
+        Emitted with the path and the error message when saving fails.
+    """
+
+    saved = Signal(str)
+    failed = Signal(str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._executor = None
+        self._pending = set()
+
+    def is_running(self) -> bool:
+        return bool(self._pending)
+
+    def save(self, render: PanelRender, path, compress_level=6):
+        """Start saving a PanelRender to path, see `export.save_render`.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future of the path of the saved file.
+        """
+        if self._executor is None:
+            # the process is started once and reused. It is spawned rather
+            # than forked, as forking a process running Qt threads is unsafe
+            self._executor = ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context('spawn'))
+
+        path = str(path)
+        segments = []
+        try:
+            shared_images = [_share_image(image, segments) for image in render.images]
+            future = self._executor.submit(
+                _save_job, render.spec, shared_images, render.stream, path, compress_level)
+        except BaseException:
+            _release(segments)
+            raise
+        self._pending.add(future)
+        future.add_done_callback(lambda f: self._on_done(f, path, segments))
+        return future
+
+    def _on_done(self, future, path, segments):
+        # called from an executor thread, the signals are queued to the
+        # thread of the receivers
+        _release(segments)
+        self._pending.discard(future)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self.saved.emit(path)
+        else:
+            self.failed.emit(path, str(error))
+
+    def shutdown(self, wait=True):
+        """Stop the worker process, after pending saves if wait is True."""
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
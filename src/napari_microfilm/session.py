@@ -0,0 +1,148 @@
+"""
+This module implements saving and loading of panel sessions. A session is a
+zip file holding the ViewerState of each panel element and the panel options
+as JSON, and the snapshots and thumbnails as .npy files. Snapshots shared by
+several elements, e.g. regions of interest, are stored once. Loading only reads
+the JSON and the thumbnails: snapshots are memory-mapped from the zip file
+(or decompressed, if the session was saved compressed) when a cell needs them.
+"""
+
+import json
+import struct
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+from .panel_item import PanelElement, ViewerState
+from .snapshot_store import SnapshotStore, content_key, get_snapshot_store
+
+SESSION_VERSION = 1
+
+
+def _write_array(archive, name, array):
+    with archive.open(name, "w", force_zip64=True) as f:
+        np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+
+
+def save_session(path, key_frames, options=None, compress=False):
+    """Save panel elements and panel options to a session file.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path of the session file, usually with a .zip extension.
+    key_frames : list of PanelElement
+        Elements to save.
+    options : dict, optional
+        JSON compatible panel options, e.g. grid shape and labels.
+    compress : bool
+        Whether to deflate the snapshots. Compressed snapshots are smaller
+        but have to be decompressed when loaded instead of memory-mapped.
+    """
+    compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    elements = []
+    # (store, key) -> (member name, content key) of the written snapshots
+    snapshots = {}
+    with zipfile.ZipFile(path, "w", compression=compress_type, allowZip64=True) as archive:
+        for i, key_frame in enumerate(key_frames):
+            stored = (id(key_frame.store), key_frame.snapshot_key)
+            if stored not in snapshots:
+                snapshot = key_frame.store.get(key_frame.snapshot_key)
+                snapshots[stored] = (f"snapshots/{len(snapshots)}.npy", content_key(snapshot))
+                _write_array(archive, snapshots[stored][0], snapshot)
+            snapshot_name, snapshot_key = snapshots[stored]
+            thumbnail_name = f"thumbnails/{i}.npy"
+            _write_array(archive, thumbnail_name, key_frame.get_thumbnail())
+            elements.append({
+                "name": key_frame.name,
+                "viewer_state": key_frame.viewer_state.to_dict(),
+                "region": None if key_frame.region is None
+                else np.asarray(key_frame.region).tolist(),
+                "snapshot": snapshot_name,
+                "snapshot_key": snapshot_key,
+                "crop": None if key_frame.crop is None else list(key_frame.crop),
+                "thumbnail": thumbnail_name,
+            })
+        archive.writestr("session.json", json.dumps({
+            "version": SESSION_VERSION,
+            "options": options or {},
+            "elements": elements,
+        }, indent=1))
+
+
+def _member_loader(path, info: zipfile.ZipInfo):
+    """Return a function loading the .npy member `info` of a zip file."""
+
+    if info.compress_type != zipfile.ZIP_STORED:
+        def load():
+            with zipfile.ZipFile(path) as archive, archive.open(info) as f:
+                return np.lib.format.read_array(f, allow_pickle=False)
+        return load
+
+    def load():
+        with open(path, "rb") as f:
+            # the data of a stored member starts after its local header
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_length, extra_length = struct.unpack("<HH", header[26:30])
+            start = info.header_offset + 30 + name_length + extra_length
+            f.seek(start)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        return np.memmap(
+            path, dtype=dtype, mode="r", offset=offset, shape=shape,
+            order="F" if fortran_order else "C")
+    return load
+
+
+def load_session(path, store: SnapshotStore = None):
+    """Load a session saved with `save_session`.
+
+    Only the states and thumbnails are read. Snapshots are loaded by the
+    store when they are first needed, unless the store already holds them.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path of the session file.
+    store : SnapshotStore, optional
+        Store in which the snapshots are registered. By default the store
+        returned by `get_snapshot_store`.
+
+    Returns
+    -------
+    key_frames : list of PanelElement
+        The saved elements.
+    options : dict
+        The saved panel options.
+    """
+    path = Path(path)
+    if store is None:
+        store = get_snapshot_store()
+
+    key_frames = []
+    with zipfile.ZipFile(path) as archive:
+        session = json.loads(archive.read("session.json"))
+        if session.get("version", 0) > SESSION_VERSION:
+            raise ValueError(f"{path.name} was saved with a newer version of napari-microfilm")
+
+        for element in session["elements"]:
+            with archive.open(element["thumbnail"]) as f:
+                thumbnail = np.lib.format.read_array(f, allow_pickle=False)
+            loader = _member_loader(path, archive.getinfo(element["snapshot"]))
+            crop = element["crop"]
+            key_frames.append(PanelElement(
+                viewer_state=ViewerState.from_dict(element["viewer_state"]),
+                snapshot_key=store.put_lazy(loader, key=element["snapshot_key"]),
+                name=element["name"],
+                thumbnail=thumbnail,
+                region=None if element["region"] is None else np.asarray(element["region"]),
+                store=store,
+                crop=None if crop is None else tuple(crop),
+            ))
+    return key_frames, session["options"]
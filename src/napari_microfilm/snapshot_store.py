@@ -0,0 +1,246 @@
+"""
+This module implements the storage of panel element snapshots. Snapshots are
+addressed by a hash of their content, so that identical captures are stored
+once, and reference counted. They are kept in memory up to a configurable
+budget; the least recently used ones are then spilled, either as compressed
+blobs or as files in a cache directory, and loaded again lazily when needed.
+"""
+
+import hashlib
+import itertools
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+def content_key(snapshot: np.ndarray) -> str:
+    """Return the key of a snapshot, a blake2b hash of its shape, dtype
+    and pixels."""
+
+    snapshot = np.ascontiguousarray(snapshot)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{snapshot.shape}{snapshot.dtype.str}".encode())
+    h.update(snapshot.data)
+    return h.hexdigest()
+
+
+def _is_mapped(snapshot) -> bool:
+    """Whether a snapshot is memory-mapped, its pixels are then read from
+    its file and only take memory while the OS caches them."""
+
+    return isinstance(snapshot, np.memmap)
+
+
+class SnapshotStore:
+    """Memory-bounded, content-addressed store of snapshots with LRU
+    eviction.
+
+    Adding a snapshot identical to a stored one returns the key of the
+    stored one and registers an additional user, so memory grows with the
+    number of distinct snapshots.
+
+    Parameters
+    ----------
+    budget : int
+        Maximum number of bytes of snapshots kept uncompressed in memory.
+        Memory-mapped snapshots, e.g. from sessions, are not counted.
+    spill : str
+        What happens to evicted snapshots. 'compress' keeps them as zlib
+        compressed blobs in memory, 'disk' writes them as .npy files in
+        `cache_dir` which are memory-mapped when needed again.
+    cache_dir : str or Path, optional
+        Directory used to spill snapshots with spill='disk'. A temporary
+        directory is created if None.
+    compress_level : int
+        zlib compression level used with spill='compress'.
+
+    Attributes
+    ----------
+    nbytes : int
+        Number of bytes currently held uncompressed in memory.
+    mapped_nbytes : int
+        Number of bytes of the memory-mapped snapshots currently cached.
+    """
+
+    def __init__(
+        self, budget=512 * 2**20, spill='compress', cache_dir=None, compress_level=1
+    ):
+        if spill not in ('compress', 'disk'):
+            raise ValueError(f"Unknown spill mode {spill}, use 'compress' or 'disk'")
+
+        self.budget = budget
+        self.spill = spill
+        self.compress_level = compress_level
+        self._cache_dir = None if cache_dir is None else Path(cache_dir)
+
+        self._cache = OrderedDict()  # key -> np.ndarray, most recent last
+        self._spilled = {}  # key -> callable returning the snapshot
+        self._files = {}  # key -> path of the spilled file
+        self._sources = {}  # key -> loader of snapshots added with put_lazy
+        self._refcount = {}
+        self.nbytes = 0
+        self.mapped_nbytes = 0
+
+        self._counter = itertools.count()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self._refcount
+
+    def __len__(self):
+        return len(self._refcount)
+
+    def put(self, snapshot: np.ndarray) -> str:
+        """Add a snapshot to the store and return its key. The caller is a
+        user of the snapshot, see `release`."""
+
+        snapshot = np.asarray(snapshot)
+        key = content_key(snapshot)
+        with self._lock:
+            if key in self._refcount:
+                self._refcount[key] += 1
+            else:
+                self._refcount[key] = 1
+                self._insert(key, snapshot)
+        return key
+
+    def put_lazy(self, loader, key: str = None) -> str:
+        """Add a snapshot that is only loaded when first requested, e.g. from
+        a session file, and return its key.
+
+        Parameters
+        ----------
+        loader : callable
+            Function returning the snapshot. It is called again instead of
+            spilling the snapshot when it is evicted.
+        key : str, optional
+            Content key of the snapshot (see `content_key`), if known. A
+            stored snapshot with the same key is used instead of the loader.
+            Without key, the snapshot is not deduplicated.
+        """
+
+        with self._lock:
+            if key is None:
+                key = f"lazy-{next(self._counter)}"
+            elif key in self._refcount:
+                self._refcount[key] += 1
+                return key
+            self._refcount[key] = 1
+            self._sources[key] = loader
+            self._spilled[key] = loader
+        return key
+
+    def get(self, key: str) -> np.ndarray:
+        """Return the snapshot stored under `key`, loading it if it was spilled."""
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+            snapshot = self._spilled.pop(key)()
+            self._insert(key, snapshot)
+            return snapshot
+
+    def retain(self, key: str):
+        """Register an additional user of the snapshot `key`."""
+
+        with self._lock:
+            self._refcount[key] += 1
+
+    def release(self, key: str):
+        """Drop a user of the snapshot `key`, and the snapshot with the last one."""
+
+        with self._lock:
+            if key not in self._refcount:
+                return
+            self._refcount[key] -= 1
+            if self._refcount[key] > 0:
+                return
+
+            del self._refcount[key]
+            snapshot = self._cache.pop(key, None)
+            if snapshot is not None:
+                self._count(snapshot, -1)
+            self._spilled.pop(key, None)
+            self._sources.pop(key, None)
+            path = self._files.pop(key, None)
+            if path is not None:
+                path.unlink(missing_ok=True)
+
+    def _insert(self, key, snapshot):
+        self._cache[key] = snapshot
+        self._count(snapshot, 1)
+        self._evict()
+
+    def _count(self, snapshot, sign):
+        if _is_mapped(snapshot):
+            self.mapped_nbytes += sign * snapshot.nbytes
+        else:
+            self.nbytes += sign * snapshot.nbytes
+
+    def _evict(self):
+        """Spill least recently used snapshots until the budget is met. The
+        most recent snapshot is always kept in memory. Memory-mapped
+        snapshots are kept, as spilling them frees no memory."""
+
+        for key in list(self._cache)[:-1]:
+            if self.nbytes <= self.budget:
+                break
+            snapshot = self._cache[key]
+            if _is_mapped(snapshot):
+                continue
+            del self._cache[key]
+            self._count(snapshot, -1)
+            if key in self._sources:
+                self._spilled[key] = self._sources[key]
+            else:
+                self._spilled[key] = self._spill(key, snapshot)
+
+    def _spill(self, key, snapshot):
+        """Move a snapshot out of memory and return a function loading it."""
+
+        shape, dtype = snapshot.shape, snapshot.dtype
+
+        if self.spill == 'compress':
+            blob = zlib.compress(np.ascontiguousarray(snapshot), self.compress_level)
+            return lambda: np.frombuffer(zlib.decompress(blob), dtype=dtype).reshape(shape)
+
+        # snapshots are never modified, so a file written once stays valid
+        if key not in self._files:
+            path = self._get_cache_dir() / f"snapshot_{key}.npy"
+            np.save(path, snapshot)
+            self._files[key] = path
+        path = self._files[key]
+        return lambda: np.load(path, mmap_mode='r')
+
+    def _get_cache_dir(self):
+        if self._cache_dir is None:
+            self._tempdir = tempfile.TemporaryDirectory(prefix='napari_microfilm_')
+            self._cache_dir = Path(self._tempdir.name)
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        return self._cache_dir
+
+
+_default_store = None
+
+
+def get_snapshot_store() -> SnapshotStore:
+    """Return the store used by default for new panel elements."""
+
+    global _default_store
+    if _default_store is None:
+        _default_store = SnapshotStore()
+    return _default_store
+
+
+def set_snapshot_store(store: SnapshotStore):
+    """Set the store used by default for new panel elements, e.g. to change
+    the memory budget or the spill mode."""
+
+    global _default_store
+    _default_store = store
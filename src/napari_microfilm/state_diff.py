@@ -0,0 +1,148 @@
+"""
+This module implements the comparison of a viewer with a ViewerState, and the
+application of the differences only. Unchanged camera, dims and layer
+attributes are not touched. Layers whose slicing changes are refreshed once
+however many of their attributes change, and layers whose display only
+changes are not refreshed.
+"""
+
+from contextlib import ExitStack, nullcontext
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# layer attributes changing what is sliced. Other attributes, e.g. contrast
+# limits, gamma, colormap or opacity, only change how the slice is displayed
+SLICING_KEYS = ("affine", "projection_mode", "rotate", "scale", "shear", "translate", "units")
+
+
+def values_equal(a, b) -> bool:
+    """Compare two state values. Lists and tuples with the same items are
+    equal, so that states loaded from JSON compare equal to the viewer."""
+
+    if a is b:
+        return True
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        a, b = np.asarray(a), np.asarray(b)
+        return a.shape == b.shape and np.array_equal(a, b)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(values_equal(x, y) for x, y in zip(a, b))
+    try:
+        result = a == b
+        return bool(np.all(result))
+    except Exception:
+        return False
+
+
+@dataclass
+class StateDiff:
+    """Attributes of a viewer that differ from a ViewerState.
+
+    Parameters
+    ----------
+    camera : dict
+        Camera fields to update.
+    dims : dict
+        Dims fields to update.
+    layers : dict
+        Map of layer name -> dict of layer attributes to update.
+    """
+
+    camera: dict = field(default_factory=dict)
+    dims: dict = field(default_factory=dict)
+    layers: dict = field(default_factory=dict)
+
+    def __bool__(self):
+        return bool(self.camera or self.dims or self.layers)
+
+
+def _changed(current: dict, target: dict) -> dict:
+    return {
+        key: value for key, value in target.items()
+        if key not in current or not values_equal(current[key], value)
+    }
+
+
+def diff_state(viewer, viewer_state) -> StateDiff:
+    """Return the differences between a viewer and a ViewerState.
+
+    Layers of the state which are not in the viewer are ignored.
+    """
+
+    diff = StateDiff(
+        camera=_changed(viewer.camera.dict(), viewer_state.camera),
+        dims=_changed(viewer.dims.dict(), viewer_state.dims),
+    )
+    for layer_name, layer_state in viewer_state.layers.items():
+        if layer_name not in viewer.layers:
+            continue
+        layer = viewer.layers[layer_name]
+        # the base state has the same representation as the ViewerState, e.g.
+        # the affine matrix instead of the Affine transform
+        current = layer._get_base_state()
+        changed = {
+            key: value for key, value in layer_state.items()
+            if not values_equal(
+                current[key] if key in current else getattr(layer, key), value)
+        }
+        if changed:
+            diff.layers[layer_name] = changed
+    return diff
+
+
+def apply_diff(viewer, diff: StateDiff):
+    """Apply the differences computed by `diff_state` to a viewer.
+
+    Layers that get hidden are hidden first, so that they are not sliced for
+    the new dims, and layers that get shown are shown last, once their other
+    attributes are set. Refreshes of the layers whose slicing changes, see
+    `SLICING_KEYS`, are blocked while the state is applied, and each of them
+    is refreshed once at the end. Layers whose display only changes are not
+    refreshed.
+    """
+
+    layers = {name: viewer.layers[name] for name in diff.layers}
+    hidden = [name for name, changed in diff.layers.items() if not changed.get('visible', True)]
+    shown = [name for name, changed in diff.layers.items() if changed.get('visible', False)]
+    resliced = [
+        name for name, changed in diff.layers.items()
+        if any(key in SLICING_KEYS for key in changed)]
+
+    for name in hidden:
+        layers[name].visible = diff.layers[name]['visible']
+
+    with ExitStack() as stack:
+        for name in resliced:
+            # napari < 0.4.19 has no refresh blocking
+            stack.enter_context(getattr(layers[name], '_block_refresh', nullcontext)())
+
+        if diff.dims:
+            viewer.dims.update(diff.dims)
+        if diff.camera:
+            viewer.camera.update(diff.camera)
+        for name, changed in diff.layers.items():
+            for key, value in changed.items():
+                if key != 'visible':
+                    setattr(layers[name], key, value)
+
+    for name in resliced:
+        if name not in hidden and name not in shown:
+            layers[name].refresh()
+    # showing a layer slices and refreshes it
+    for name in shown:
+        layers[name].visible = diff.layers[name]['visible']
+
+
+def apply_state(viewer, viewer_state) -> StateDiff:
+    """Update a viewer to match a ViewerState, changing only what differs.
+
+    Returns
+    -------
+    StateDiff
+        The differences that were applied.
+    """
+
+    diff = diff_state(viewer, viewer_state)
+    if diff:
+        apply_diff(viewer, diff)
+    return diff
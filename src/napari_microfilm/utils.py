@@ -1,13 +1,38 @@
 import numpy as np
 
+from . import profiling
 
+
+@profiling.timed('make_thumbnail')
 def make_thumbnail(image: np.ndarray, shape=(30, 30, 4)) -> np.ndarray:
-    """Resizes an image to `shape` with padding"""
+    """Resizes a (3, h, w) RGB snapshot to an RGBA image of `shape` with
+    padding
+
+    The image is first strided down to about twice the target size and
+    the remaining blocks of pixels are averaged, so that the cost does not
+    depend on the full resolution of the image.
+    """
     from napari.layers.utils.layer_utils import convert_to_uint8
-    from scipy import ndimage as ndi
 
-    scale_factor = np.min(np.divide(shape, image.shape))
-    intermediate_image = ndi.zoom(image, (scale_factor, scale_factor, 1))
+    # channel-last view, snapshots are opaque
+    image = np.moveaxis(image, 0, -1)
+    factor = max(image.shape[0] / shape[0], image.shape[1] / shape[1])
+    stride = max(int(factor) // 2, 1)
+    strided = image[::stride, ::stride]
+
+    block = max(int(np.ceil(factor / stride)), 1)
+    block_rows = min(block, strided.shape[0])
+    block_cols = min(block, strided.shape[1])
+    rows = strided.shape[0] // block_rows
+    cols = strided.shape[1] // block_cols
+    intermediate_image = (
+        strided[: rows * block_rows, : cols * block_cols]
+        .reshape(rows, block_rows, cols, block_cols, -1)
+        .mean(axis=(1, 3))
+        .astype(image.dtype)
+    )
+    alpha = np.full(intermediate_image.shape[:2] + (1,), np.iinfo(np.uint8).max, dtype=image.dtype)
+    intermediate_image = np.concatenate([intermediate_image, alpha], axis=-1)
 
     padding_needed = np.subtract(shape, intermediate_image.shape)
     pad_amounts = [(p // 2, (p + 1) // 2) for p in padding_needed]
@@ -21,4 +46,165 @@ def make_thumbnail(image: np.ndarray, shape=(30, 30, 4)) -> np.ndarray:
     f_dest = thumbnail[..., 3][..., None] / 255
     f_source = 1 - f_dest
     thumbnail = thumbnail * f_dest + background * f_source
-    return thumbnail.astype(np.uint8)
\ No newline at end of file
+    return thumbnail.astype(np.uint8)
+
+
+def to_channel_first(image: np.ndarray) -> np.ndarray:
+    """Return the RGB channels of an (h, w, 3|4) screenshot as a contiguous
+    (3, h, w) array, the layout in which snapshots are stored and plotted."""
+
+    return np.ascontiguousarray(np.moveaxis(image[:, :, 0:3], 2, 0))
+
+
+def figure_to_rgba(fig) -> np.ndarray:
+    """Render a matplotlib figure with Agg and return its pixels.
+
+    The figure is drawn on a renderer of its own, without going through the
+    figure canvas, so that it can be called from a worker thread even if the
+    canvas belongs to a GUI backend.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        Figure to render.
+
+    Returns
+    -------
+    np.ndarray
+        A (h, w, 4) uint8 RGBA image. The array is a copy, so it stays valid
+        after the figure is redrawn.
+    """
+    from matplotlib.backends.backend_agg import RendererAgg
+
+    width, height = fig.bbox.size
+    renderer = RendererAgg(int(width), int(height), fig.dpi)
+    fig.draw(renderer)
+    return np.array(renderer.buffer_rgba())
+
+
+def _text_kwargs(text) -> dict:
+    """Return the arguments recreating a matplotlib text."""
+
+    x, y = text.get_position()
+    return dict(
+        x=x, y=y, s=text.get_text(), color=text.get_color(),
+        fontproperties=text.get_fontproperties().copy(),
+        ha=text.get_ha(), va=text.get_va(), rotation=text.get_rotation(),
+        alpha=text.get_alpha())
+
+
+def figure_snapshot(fig) -> dict:
+    """Describe what is drawn in a panel figure, so that it can be rendered
+    with `render_figure_snapshot` while the figure itself is modified.
+
+    Only the artists of panel figures are described: the image and texts
+    of each axis, whose frame and ticks are hidden, and the texts of the
+    figure. Image data is referenced and not copied, as the panel replaces
+    images instead of modifying them.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        Figure to describe.
+
+    Returns
+    -------
+    dict
+        Description of the figure.
+    """
+
+    axes = []
+    for ax in fig.axes:
+        # position of the axis once adjusted to the aspect of its image
+        ax.apply_aspect()
+        axes.append(dict(
+            position=ax.get_position().bounds,
+            images=[
+                dict(A=im.get_array(), interpolation=im.get_interpolation(),
+                     origin=im.origin, alpha=im.get_alpha())
+                for im in ax.images if im.get_visible()],
+            texts=[_text_kwargs(text) for text in ax.texts if text.get_visible()],
+        ))
+    return dict(
+        size=tuple(fig.get_size_inches()), dpi=fig.dpi,
+        facecolor=fig.get_facecolor(), frameon=fig.get_frameon(), axes=axes,
+        texts=[_text_kwargs(text) for text in fig.texts if text.get_visible()])
+
+
+def render_figure_snapshot(snapshot: dict) -> np.ndarray:
+    """Render a figure described by `figure_snapshot` on a new figure, see
+    `figure_to_rgba`. The figure is not registered with pyplot, so that it
+    can be rendered on a worker thread. Images are placed directly on the
+    figure, without the cost of creating axes.
+
+    Parameters
+    ----------
+    snapshot : dict
+        Description of the figure.
+
+    Returns
+    -------
+    np.ndarray
+        A (h, w, 4) uint8 RGBA image.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.image import BboxImage
+    from matplotlib.transforms import Bbox, BboxTransformTo, TransformedBbox
+
+    fig = Figure(
+        figsize=snapshot['size'], dpi=snapshot['dpi'],
+        facecolor=snapshot['facecolor'], frameon=snapshot['frameon'])
+    for axis in snapshot['axes']:
+        bbox = TransformedBbox(Bbox.from_bounds(*axis['position']), fig.transFigure)
+        for image in axis['images']:
+            artist = BboxImage(
+                bbox, interpolation=image['interpolation'], origin=image['origin'])
+            artist.set_data(image['A'])
+            artist.set_alpha(image['alpha'])
+            fig.add_artist(artist)
+        for kwargs in axis['texts']:
+            fig.text(**kwargs, transform=BboxTransformTo(bbox))
+    for kwargs in snapshot['texts']:
+        fig.text(**kwargs, transform=fig.transFigure)
+    return figure_to_rgba(fig)
+
+
+def get_canvas_size(viewer) -> tuple:
+    """Return the (height, width) of the viewer canvas in screen pixels."""
+
+    canvas = getattr(viewer, 'canvas', None)
+    if canvas is not None and hasattr(canvas, 'size'):
+        return tuple(canvas.size)
+    # napari < 0.6
+    return tuple(viewer._canvas_size)
+
+
+def get_data_region(viewer):
+    """Return the world bounding box of the visible layers along the
+    displayed axes.
+
+    Returns
+    -------
+    np.ndarray or None
+        [[y0, x0], [y1, x1]] in world coordinates, None if no layer is
+        visible.
+    """
+
+    displayed = list(viewer.dims.displayed)
+    boxes = []
+    for layer in viewer.layers:
+        if not layer.visible:
+            continue
+        # the augmented extent covers whole pixels, as displayed
+        extent = getattr(layer, '_extent_world_augmented', None)
+        if extent is None:
+            extent = layer.extent.world
+        # layers are aligned to the last dimensions of the viewer
+        axes = [d - (viewer.dims.ndim - layer.ndim) for d in displayed]
+        if min(axes) < 0:
+            continue
+        boxes.append(np.asarray(extent, dtype=float)[:, axes])
+    if not boxes:
+        return None
+    boxes = np.stack(boxes)
+    return np.stack([boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0)])